@@ -0,0 +1,242 @@
+import re
+import time
+from collections import deque
+from multiprocessing import Pool, get_context
+from PIL import Image
+from image_hashes import content_hash, dhash
+
+
+def is_gibberish(text):
+    """Check if generated caption is nonsensical"""
+    text = text.lower()
+    if len(text.split()) > 20:  # Too long
+        return True
+    if len(set(text.split())) < 3:  # Too repetitive
+        return True
+    if re.search(r'\b(\w+)\b.*\b\1\b.*\b\1\b', text):  # Repeated words
+        return True
+    return False
+
+
+def generate_object_caption(detections):
+    """Generate caption from detected objects"""
+    if not detections:
+        return "An image"
+
+    objects = [d['class'] for d in detections if d['confidence'] > 0.3]
+    if not objects:
+        return "An image"
+
+    objects = list(set(objects))  # Remove duplicates
+    if len(objects) == 1:
+        return f"An image of {objects[0]}"
+    elif len(objects) == 2:
+        return f"An image of {objects[0]} and {objects[1]}"
+    else:
+        return f"An image containing {', '.join(objects[:-1])}, and {objects[-1]}"
+
+
+def clean_caption(caption):
+    """Strip odd characters from a decoded caption and capitalize it."""
+    return re.sub(r'[^a-zA-Z0-9,.!?\'" ]+', '', caption).capitalize()
+
+
+def needs_detection(caption):
+    """Whether a caption is too generic or garbled to keep."""
+    return caption.lower() == "an image" or is_gibberish(caption)
+
+
+def image_hashes(image):
+    """Content and perceptual hashes recorded for each analyzed image."""
+    return {'content_sha256': content_hash(image), 'dhash': dhash(image)}
+
+
+def decode_image(image_path):
+    """Open and convert one image to RGB and hash it. Returns (image, hashes, error, seconds); runs in pool workers."""
+    start = time.perf_counter()
+    try:
+        with Image.open(image_path) as img:
+            image = img.convert("RGB")
+        return image, image_hashes(image), None, time.perf_counter() - start
+    except Exception as e:
+        return None, None, str(e), time.perf_counter() - start
+
+
+# Placed among run() items to analyze a partial batch now instead of waiting for it to fill
+FLUSH = object()
+
+
+def hash_image(image_path):
+    """Hashes of one image file, or None if it cannot be read; runs in pool workers."""
+    image, hashes, _, _ = decode_image(image_path)
+    return hashes
+
+
+def hash_images(items, workers=None):
+    """Hash (key, image_path) items on a process pool, yielding (key, hashes or None)."""
+    keys = [key for key, _ in items]
+    with Pool(workers) as pool:
+        yield from zip(keys, pool.imap(hash_image, [path for _, path in items], chunksize=16))
+
+
+class AnalysisPipeline:
+    """Decode -> caption -> detect pipeline over batches of images.
+
+    A process pool decodes images while the main process runs the models,
+    with at most max_in_flight images decoded or decoding ahead of the
+    captioner. Captions are generated batch_size images at a time, and the
+    images whose caption is generic or gibberish go to the detector as one
+    batch. The captioner needs caption_batch(images) -> [str] and a name;
+    the detector needs detect_batch(images) -> [[detection, ...]] and a
+    name, so small stand-ins can replace the real models.
+
+    Images are hashed as they are decoded. An image whose pixels match one
+    already analyzed (in `cache`, content hash -> analysis, or earlier in
+    the run) reuses that analysis without running either model.
+
+    Items may be a stream that is still growing; a FLUSH among them sends
+    the images before it through the models without waiting for a full
+    batch. mp_context names the multiprocessing start method for the pool
+    ('spawn' is safe when other threads are running).
+    """
+
+    STAGES = ('decode', 'caption', 'detect')
+
+    def __init__(self, captioner, detector, workers=None, batch_size=8, max_in_flight=64, cache=None,
+                 mp_context=None):
+        self.captioner = captioner
+        self.detector = detector
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_in_flight = max(max_in_flight, batch_size)
+        self.cache = {} if cache is None else cache
+        self.mp_context = mp_context
+        self.counters = {stage: [0, 0.0] for stage in self.STAGES}
+        self.cached = 0
+        self.elapsed = 0.0
+
+    def run(self, items):
+        """Analyze (key, image_path) items, yielding (key, analysis, hashes) as each batch completes."""
+        start = time.perf_counter()
+        try:
+            if self.workers == 0:
+                # Decode inline, e.g. where worker processes are unavailable
+                decoded = ((item, None) if item is FLUSH else (item[0], decode_image(item[1])) for item in items)
+                yield from self._analyze(decoded)
+            else:
+                with get_context(self.mp_context).Pool(self.workers) as pool:
+                    yield from self._analyze(self._decode_ahead(pool, items))
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def _decode_ahead(self, pool, items):
+        pending = deque()
+        items = iter(items)
+        exhausted = False
+        while True:
+            # Keep the pool busy, but never more than max_in_flight images ahead. Nothing more is
+            # read past a FLUSH until it comes out, as the next item may be a long way off
+            while not exhausted and len(pending) < self.max_in_flight and not (pending and pending[-1][0] is FLUSH):
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                elif item is FLUSH:
+                    pending.append((FLUSH, None))
+                else:
+                    key, path = item
+                    pending.append((key, pool.apply_async(decode_image, (path,))))
+            if not pending:
+                return
+            key, result = pending.popleft()
+            yield key, None if key is FLUSH else result.get()
+
+    def _analyze(self, decoded):
+        batch = []
+        for key, decoded_image in decoded:
+            if key is FLUSH:
+                if batch:
+                    yield from self._analyze_batch(batch)
+                    batch = []
+                continue
+            image, hashes, error, seconds = decoded_image
+            self._count('decode', 1, seconds)
+            if error is not None:
+                yield key, {'error': error}, None
+                continue
+            cached = self.cache.get(hashes['content_sha256'])
+            if cached is not None:
+                self.cached += 1
+                yield key, dict(cached), hashes
+                continue
+            batch.append((key, image, hashes))
+            if len(batch) >= self.batch_size:
+                yield from self._analyze_batch(batch)
+                batch = []
+        if batch:
+            yield from self._analyze_batch(batch)
+
+    def _analyze_batch(self, batch):
+        # Identical images within the batch are analyzed once
+        firsts = {}
+        for key, image, hashes in batch:
+            firsts.setdefault(hashes['content_sha256'], image)
+        self.cached += len(batch) - len(firsts)
+        analyses = dict(zip(firsts, self._analyze_images(list(firsts.values()))))
+
+        for key, image, hashes in batch:
+            analysis = analyses[hashes['content_sha256']]
+            if 'error' not in analysis:
+                self.cache[hashes['content_sha256']] = analysis
+            yield key, dict(analysis), hashes
+
+    def _analyze_images(self, images):
+        start = time.perf_counter()
+        try:
+            captions = [clean_caption(caption) for caption in self.captioner.caption_batch(images)]
+        except Exception as e:
+            # Fall back to object detection for the whole batch
+            print(f"Caption generation error: {str(e)}")
+            captions = [None] * len(images)
+        self._count('caption', len(images), time.perf_counter() - start)
+
+        fallback = [i for i, caption in enumerate(captions) if caption is None or needs_detection(caption)]
+        detections, detect_error = {}, None
+        if fallback:
+            start = time.perf_counter()
+            try:
+                found = self.detector.detect_batch([images[i] for i in fallback])
+                detections = dict(zip(fallback, found))
+            except Exception as e:
+                detect_error = str(e)
+            self._count('detect', len(fallback), time.perf_counter() - start)
+
+        for i in range(len(images)):
+            if detect_error is not None and i in fallback:
+                yield {'error': detect_error}
+                continue
+            found = detections.get(i)
+            caption = generate_object_caption(found) if i in detections else captions[i]
+            yield {
+                'caption': caption,
+                'detections': found if found else None,
+                'model': self.captioner.name if not found else
+                f"{self.captioner.name} with {self.detector.name} fallback"
+            }
+
+    def _count(self, stage, images, seconds):
+        self.counters[stage][0] += images
+        self.counters[stage][1] += seconds
+
+    def stats(self):
+        """Images, busy seconds and images/sec per stage, the end-to-end rate and cache savings."""
+        stats = {stage: {'images': images, 'seconds': seconds,
+                         'images_per_sec': images / seconds if seconds else 0.0}
+                 for stage, (images, seconds) in self.counters.items()}
+        # Saved time assumes a cached image would have cost the average model time per inferred image
+        inferred, model_seconds = self.counters['caption'][0], self.counters['caption'][1] + self.counters['detect'][1]
+        stats['cached'] = {'images': self.cached,
+                           'saved_seconds': self.cached * model_seconds / inferred if inferred else 0.0}
+        done = self.counters['decode'][0]
+        stats['total'] = {'images': done, 'seconds': self.elapsed,
+                          'images_per_sec': done / self.elapsed if self.elapsed else 0.0}
+        return stats
@@ -0,0 +1,58 @@
+import re
+from nltk.stem import PorterStemmer, WordNetLemmatizer
+from nltk.corpus import stopwords
+
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+
+class TextAnalyzer:
+    """Lowercase, strip punctuation, drop stopwords, then lemmatize and stem.
+
+    Lemmatizing and stemming dominate the cost and the vocabulary repeats a
+    lot, so normalized terms are memoized per token. The memo is bounded and
+    evicts its oldest entries first; a memo_size of 0 disables it.
+    """
+
+    def __init__(self, memo_size=200000):
+        self.stemmer = PorterStemmer()
+        self.lemmatizer = WordNetLemmatizer()
+        self.stop_words = set(stopwords.words('english'))
+        self.memo_size = memo_size
+        self.memo = {}
+
+    def normalize(self, token):
+        """Lemmatized and stemmed form of a single non-stopword token."""
+        term = self.memo.get(token)
+        if term is None:
+            term = self.stemmer.stem(self.lemmatizer.lemmatize(token))
+            if self.memo_size > 0:
+                if len(self.memo) >= self.memo_size:
+                    del self.memo[next(iter(self.memo))]
+                self.memo[token] = term
+        return term
+
+    def analyze(self, text):
+        """Clean and process text into index terms."""
+        stop_words = self.stop_words
+        normalize = self.normalize
+        return [normalize(token) for token in PUNCTUATION.sub('', text.lower()).split()
+                if token not in stop_words]
+
+    def analyze_batch(self, texts):
+        """Analyze many texts in one call, normalizing each distinct token once."""
+        stop_words = self.stop_words
+        token_lists = [PUNCTUATION.sub('', text.lower()).split() for text in texts]
+        terms = {}
+        for tokens in token_lists:
+            for token in tokens:
+                if token not in terms and token not in stop_words:
+                    terms[token] = self.normalize(token)
+        return [[terms[token] for token in tokens if token not in stop_words] for tokens in token_lists]
+
+    def warm(self, memo):
+        """Seed the memo with token -> term pairs, e.g. from an index snapshot."""
+        if self.memo_size > 0:
+            for token, term in memo.items():
+                if len(self.memo) >= self.memo_size:
+                    break
+                self.memo[token] = term
@@ -1,7 +1,19 @@
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory
-from irsystem import ImageSearchEngine
-from config import Config
+from flask import (Flask, render_template, request, redirect, url_for, send_from_directory, send_file, abort,
+                   jsonify, Response, g)
+from werkzeug.utils import safe_join
+from irsystem import ImageSearchEngine, SEARCH_METHODS, engine_options
+from facets import FacetFilter, parse_time
+from config import load_settings
+from thumbnails import THUMBNAIL_SIZES, THUMBNAIL_FORMATS, thumbnail_path, is_fresh, render_thumbnails, file_etag
+from instrumentation import Registry, SlowQueryProfiler
+from http_cache import EncodedBody, StaticAssets
+from query_cache import QueryCache
 import os
+import json
+import base64
+import threading
+import time
+from itertools import islice
 from datetime import datetime
 import nltk
 nltk.download('stopwords',quiet=True)
@@ -9,82 +21,436 @@ nltk.download('wordnet',quiet=True)
 
 app = Flask(__name__)
 app.config['APP_NAME'] = "Visual Voyager"
-app.config.from_object(Config)
+# Defaults plus deployment overrides, e.g. another METADATA_FILE, from the file named by VISUAL_VOYAGER_SETTINGS
+app.config.update(load_settings())
 
 # Initialize search engine
-search_engine = ImageSearchEngine()
+search_engine = ImageSearchEngine(**engine_options(app.config))
+
+
+def watch_index(interval):
+    """Swap in a new index snapshot whenever one is written for changed metadata, without a restart."""
+    while True:
+        time.sleep(interval)
+        try:
+            if search_engine.reload_snapshot():
+                app.logger.info("Loaded index generation %d", search_engine.index_generation)
+        except Exception:
+            app.logger.exception("Index reload failed")
+
+
+def start_worker():
+    """Per-process setup, run in each gunicorn worker after the fork (see gunicorn.conf.py)."""
+    search_engine.after_fork()
+    if app.config['INDEX_RELOAD_INTERVAL'] is not None:
+        threading.Thread(target=watch_index, args=(app.config['INDEX_RELOAD_INTERVAL'],),
+                         name='index-watcher', daemon=True).start()
+
+# Request, search stage and cache metrics of this worker, served at /metrics
+metrics = Registry()
+request_latency = metrics.histogram('visual_voyager_request_duration_seconds',
+                                    'Time to serve a request, streamed bodies included', ['route', 'method'])
+requests_served = metrics.counter('visual_voyager_requests_total', 'Requests served', ['route', 'status'])
+stage_latency = metrics.histogram('visual_voyager_search_stage_seconds',
+                                  'Time a search spent in each stage', ['method', 'stage'])
+
+def observe_stages(method, stages):
+    for stage, seconds in stages.items():
+        stage_latency.observe(seconds, method=method, stage=stage)
+
+search_engine.stage_hooks.append(observe_stages)
+
+@metrics.collector
+def engine_metrics():
+    cache = search_engine.result_cache.stats()
+    for counter in ('hits', 'misses', 'evictions', 'expirations'):
+        yield f"visual_voyager_query_cache_{counter}_total", 'counter', f"Result cache {counter}", [({}, cache[counter])]
+    yield 'visual_voyager_query_cache_entries', 'gauge', "Result lists in the cache", [({}, cache['size'])]
+    pages = page_cache.stats()
+    for counter in ('hits', 'misses', 'evictions'):
+        yield f"visual_voyager_page_cache_{counter}_total", 'counter', f"Rendered page cache {counter}", \
+            [({}, pages[counter])]
+    yield 'visual_voyager_index_generation', 'gauge', "Index generation being served", \
+        [({}, search_engine.index_generation)]
+    yield 'visual_voyager_indexed_images', 'gauge', "Images in the index", [({}, search_engine.total_images)]
+
+# Opt-in: stacks of requests slower than the threshold are sampled and saved for flame graphs
+profiler = SlowQueryProfiler(app.config['PROFILE_SLOW_REQUESTS'], app.config['PROFILE_FOLDER'],
+                             app.config['PROFILE_INTERVAL']) if app.config['PROFILE_SLOW_REQUESTS'] is not None else None
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if profiler:
+        profiler.start()
+
+@app.after_request
+def record_request_latency(response):
+    # Label by route pattern, not path, so the number of series stays bounded
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    method, endpoint, status = request.method, request.endpoint or 'unmatched', response.status_code
+    start, thread_id = g.request_start, threading.get_ident()
+    
+    def finish():
+        # Runs once the body has been sent, so streamed responses are timed in full
+        duration = time.perf_counter() - start
+        request_latency.observe(duration, route=route, method=method)
+        requests_served.inc(route=route, status=status)
+        if profiler:
+            path = profiler.stop(duration, endpoint, thread_id)
+            if path:
+                app.logger.warning("Slow request %s %s took %.0f ms, stacks saved to %s",
+                                   method, route, duration * 1000, path)
+    
+    response.call_on_close(finish)
+    return response
+
+# Rendered pages keyed by route, arguments and index generation, so a new index never serves old pages
+page_cache = QueryCache(app.config['PAGE_CACHE_SIZE'] if app.config['HTTP_CACHING'] else 0)
+static_assets = StaticAssets(app.static_folder) if app.config['HTTP_CACHING'] else None
+
+def cached_page(render):
+    """This request's page from page_cache, rendered by render() -> (html, meta) on a miss.
+
+    Returns (response, meta). With HTTP_CACHING off every request renders
+    a plain uncompressed page.
+    """
+    if not app.config['HTTP_CACHING']:
+        html, meta = render()
+        return html, meta
+    # The generation is read before rendering: a page rendered during a reload is filed under the older one
+    key = (request.endpoint, tuple(sorted(request.view_args.items())), tuple(sorted(request.args.items(multi=True))),
+           search_engine.index_generation)
+    
+    def compute():
+        html, meta = render()
+        return EncodedBody(html.encode('utf-8'), 'text/html', meta=meta)
+    
+    page = page_cache.get_or_compute(key, compute)
+    response = page.respond(request)
+    # Browsers keep the page but check back each time, getting a 304 until the index changes
+    response.cache_control.no_cache = True
+    return response, page.meta
+
+@app.url_defaults
+def hashed_static_urls(endpoint, values):
+    if static_assets and endpoint == 'static' and 'filename' in values:
+        values['filename'] = static_assets.url(values['filename'])
+
+def serve_static(filename):
+    """Hashed css/js precompressed and cacheable forever; anything else as Flask serves it."""
+    asset = static_assets.get(filename) if static_assets else None
+    if asset is None:
+        return app.send_static_file(filename)
+    response = asset.respond(request)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['STATIC_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
+
+app.view_functions['static'] = serve_static
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=Registry.CONTENT_TYPE)
+
+@app.route('/healthz')
+def healthz():
+    return jsonify(pid=os.getpid(), generation=search_engine.index_generation, images=search_engine.total_images)
+
+
+# Query parameters that filter the gallery and search results; object and model may repeat
+FILTER_ARGS = ('object', 'min_conf', 'model', 'since', 'until')
+
+def filter_values(args, name):
+    """Non-empty values of a filter parameter, from request args or a JSON object."""
+    if hasattr(args, 'getlist'):
+        values = args.getlist(name)
+    else:
+        value = args.get(name)
+        values = value if isinstance(value, list) else [value]
+    return [value for value in values if value not in (None, '')]
+
+def request_filters(args=None):
+    """FacetFilter from the filter parameters of a request (or of a JSON object); aborts on malformed ones."""
+    args = request.args if args is None else args
+    # JSON bodies can hold anything; only strings, and single numbers or strings for the bounds, make a filter
+    objects, models = filter_values(args, 'object'), filter_values(args, 'model')
+    if not all(isinstance(value, str) for value in objects + models):
+        abort(400, 'Malformed filter; object and model are strings or lists of strings')
+    if not hasattr(args, 'getlist') and \
+            any(isinstance(args.get(name), (list, dict)) for name in ('min_conf', 'since', 'until')):
+        abort(400, 'Malformed filter; min_conf, since and until take a single value')
+    try:
+        min_conf = [float(value) for value in filter_values(args, 'min_conf')]
+        since = [parse_time(str(value)) for value in filter_values(args, 'since')]
+        until = [parse_time(str(value), end=True) for value in filter_values(args, 'until')]
+    except (ValueError, TypeError):
+        abort(400, 'Malformed filter; dates are YYYY-MM-DD or YYYY-MM-DD HH:MM:SS')
+    return FacetFilter(objects, min_conf[0] if min_conf else None, models,
+                       since[0] if since else None, until[0] if until else None)
 
 @app.context_processor
 def inject_now():
-    """Make 'now' available in all templates"""
-    return {'now': datetime.now()}
+    """Make 'now' and the thumbnail sizes available in all templates"""
+    return {'now': datetime.now(), 'thumbnail_sizes': THUMBNAIL_SIZES}
+
+@app.context_processor
+def inject_filters():
+    """The request's active filter parameters, for links and forms that keep them"""
+    return {'filter_args': {name: filter_values(request.args, name) for name in FILTER_ARGS
+                            if filter_values(request.args, name)}}
 
 @app.route('/')
 def index():
     page = request.args.get('page', 1, type=int)
     per_page = app.config['PER_PAGE']
     
-    all_images = search_engine.get_all_images()
-    print(all_images[0])
-    total_images = len(all_images)
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_images = all_images[start:end]
-    
-    return render_template('index.html',
-                        images=paginated_images,
-                         page=page,
-                         per_page=per_page,
-                         total_images=total_images,
-                         start=start,
-                         end=end)
+    def render():
+        # Filtering only intersects bitmaps, so a filtered gallery is never scored
+        filters = request_filters()
+        all_images = search_engine.get_all_images(filters)
+        total_images = len(all_images)
+        start = (page - 1) * per_page
+        end = start + per_page
+        paginated_images = all_images[start:end]
+        
+        return render_template('index.html',
+                               images=paginated_images,
+                               page=page,
+                               per_page=per_page,
+                               total_images=total_images,
+                               start=start,
+                               end=end,
+                               filtered=bool(filters),
+                               facets=search_engine.facet_counts(filters)), None
+    
+    response, _ = cached_page(render)
+    return response
 
 @app.route('/search', methods=['GET', 'POST'])
 def search():
     if request.method == 'POST':
         query = request.form['query']
         method = request.form.get('method', 'vsm')
-        return redirect(url_for('search_results', query=query, method=method))
+        filters = {name: filter_values(request.form, name) for name in FILTER_ARGS if filter_values(request.form, name)}
+        return redirect(url_for('search_results', query=query, method=method, **filters))
     
     return redirect(url_for('index'))
 
+def run_search(method, query, top_k, stream=False, filters=None):
+    """Ranked (metadata, score) results of one query, or a lazy iterator of them with stream=True."""
+    collapse = app.config['COLLAPSE_DUPLICATES']
+    if method == 'vsm':
+        return search_engine.search_vsm(query, top_k=top_k, collapse=collapse, stream=stream, filters=filters)
+    if method == 'bm25':
+        return search_engine.search_bm25(query, top_k=top_k, collapse=collapse, stream=stream, filters=filters)
+    if method == 'semantic':
+        return search_engine.search_semantic(query, top_k=top_k, collapse=collapse,
+                                             nprobe=app.config['IVF_NPROBE'], stream=stream, filters=filters)
+    if method == 'hybrid':
+        return search_engine.search_hybrid(query, top_k=top_k, collapse=collapse,
+                                           nprobe=app.config['IVF_NPROBE'], stream=stream, filters=filters)
+    abort(400)
+
 @app.route('/search/results')
 def search_results():
     query = request.args.get('query', '')
     method = request.args.get('method', 'vsm')
     
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = app.config['PER_PAGE']
+    
     if not query:
         return redirect(url_for('index'))
     
-    if method == 'vsm':
-        results = search_engine.search_vsm(query)
-    elif method == 'bm25':
-        results = search_engine.search_bm25(query)
-    # else:
-    #     results = search_engine.search_semantic(query)
+    def render():
+        # Only rank as far as the requested page, plus one to know if there is a next page
+        start = (page - 1) * per_page
+        end = start + per_page
+        
+        results = run_search(method, query, end + 1, filters=request_filters())
+        has_next = len(results) > end
+        
+        return render_template('results.html',
+                               query=query,
+                               method=method,
+                               results=results[start:end],
+                               page=page,
+                               start=start,
+                               has_next=has_next), bool(results)
     
-    return render_template('results.html',
-                         query=query,
-                         method=method,
-                         results=results)
+    response, found = cached_page(render)
+    if found and page == 1:
+        # Only queries that found something are worth suggesting to others, cached page or not
+        search_engine.query_log.record(query)
+    return response
+
+def api_result(record, score):
+    """Compact JSON object for one search result."""
+    return {'filename': record['filename'], 'score': round(score, 6), 'alt_text': record['alt_text'],
+            'caption': record['caption'], 'source_url': record['source_url']}
+
+def encode_cursor(offset, query, method, filters):
+    """Opaque cursor for the results after `offset`, valid for this query, method, filter and index generation."""
+    state = {'offset': offset, 'generation': search_engine.index_generation, 'query': query, 'method': method,
+             'filters': repr(filters.key)}
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, query, method, filters):
+    """Offset stored in a cursor from encode_cursor(); aborts if it belongs to another search or index."""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        offset = int(state['offset'])
+    except (ValueError, TypeError, KeyError):
+        abort(400, 'Malformed cursor')
+    if state.get('query') != query or state.get('method') != method or \
+            state.get('filters') != repr(filters.key) or offset < 0:
+        abort(400, 'Cursor belongs to a different search')
+    if state.get('generation') != search_engine.index_generation:
+        # Ranks shift when the index changes, so offsets into the old ranking would skip or repeat results
+        abort(409, 'The index changed since this cursor was issued; start the search again')
+    return offset
+
+def wants_ndjson():
+    return request.args.get('stream', type=int) == 1 or \
+        request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+def ndjson(lines):
+    """Streamed response writing one JSON document per line as the iterator produces them."""
+    return Response((json.dumps(line, separators=(',', ':')) + '\n' for line in lines),
+                    mimetype='application/x-ndjson')
+
+@app.route('/api/search')
+def api_search():
+    """Top-k results as compact JSON with a cursor for the next page, or every result as NDJSON."""
+    query = request.args.get('query', '')
+    method = request.args.get('method', 'vsm')
+    if not query or method not in SEARCH_METHODS:
+        abort(400)
+    filters = request_filters()
+    
+    if wants_ndjson():
+        # Streamed results are assembled one by one, so the list can be long; no k means every match
+        top_k = request.args.get('k', type=int)
+        if top_k is not None and top_k < 1:
+            abort(400)
+        return ndjson(api_result(record, score)
+                      for record, score in run_search(method, query, top_k, stream=True, filters=filters))
+    
+    k = min(max(request.args.get('k', app.config['API_DEFAULT_K'], type=int), 1), app.config['API_MAX_K'])
+    cursor = request.args.get('cursor')
+    start = decode_cursor(cursor, query, method, filters) if cursor else 0
+    # Rank one past the page to know whether there is a next one, and assemble only the page itself
+    page = list(islice(run_search(method, query, start + k + 1, stream=True, filters=filters), start, start + k + 1))
+    if page and not cursor:
+        search_engine.query_log.record(query)
+    return jsonify({
+        'query': query,
+        'method': method,
+        'results': [api_result(record, score) for record, score in page[:k]],
+        'next_cursor': encode_cursor(start + k, query, method, filters) if len(page) > k else None
+    })
+
+@app.route('/api/facets')
+def api_facets():
+    """Images per detected object and per model, among those the filter parameters select."""
+    return jsonify(search_engine.facet_counts(request_filters()))
+
+@app.route('/api/suggest')
+def api_suggest():
+    """Autocomplete for the search box: popular queries and word completions for partly typed text."""
+    text = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', app.config['SUGGEST_LIMIT'], type=int), 1), app.config['API_MAX_K'])
+    response = jsonify({'query': text, 'suggestions': search_engine.suggest(text, limit) if text.strip() else []})
+    # Keystrokes repeat the same prefixes, so let the browser reuse answers briefly
+    response.cache_control.max_age = app.config['SUGGEST_MAX_AGE']
+    return response
+
+@app.route('/api/search/batch', methods=['POST'])
+def api_search_batch():
+    """Many queries ranked together; a JSON body of {queries, method, k, filters} or NDJSON lines of {query}.
+
+    Answers with one result list per query, as JSON or, for NDJSON
+    requests, one line per query streamed as it is assembled. Filters
+    come from the query string for NDJSON and apply to every query.
+    """
+    if request.mimetype == 'application/x-ndjson':
+        try:
+            lines = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+            queries = [line['query'] if isinstance(line, dict) else line for line in lines]
+        except (ValueError, KeyError):
+            abort(400)
+        options = request.args
+        filters = request_filters()
+    else:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get('queries'), list):
+            abort(400)
+        queries = body['queries']
+        options = body
+        if not isinstance(body.get('filters', {}), dict):
+            abort(400)
+        filters = request_filters(body.get('filters', {}))
+    
+    method = options.get('method', 'vsm')
+    try:
+        k = min(max(int(options.get('k', app.config['API_DEFAULT_K'])), 1), app.config['API_MAX_K'])
+    except (ValueError, TypeError):
+        abort(400)
+    if method not in SEARCH_METHODS or len(queries) > app.config['API_MAX_BATCH'] or \
+            not all(isinstance(query, str) for query in queries):
+        abort(400)
+    
+    nprobe = app.config['IVF_NPROBE'] if method in ('semantic', 'hybrid') else None
+    results = search_engine.search_batch(queries, method, top_k=k, collapse=app.config['COLLAPSE_DUPLICATES'],
+                                         nprobe=nprobe, stream=True, filters=filters)
+    answers = ({'query': query, 'results': [api_result(record, score) for record, score in ranked]}
+               for query, ranked in zip(queries, results))
+    if request.mimetype == 'application/x-ndjson' or wants_ndjson():
+        return ndjson(answers)
+    return jsonify({'method': method, 'k': k, 'results': list(answers)})
 
 @app.route('/image/<filename>')
 def image_detail(filename):
-    image_data = next((img for img in search_engine.image_metadata 
-                      if img['filename'] == filename), None)
+    image_data = search_engine.get_image(filename)
     
     if not image_data:
         return redirect(url_for('index'))
     
-    return render_template('image.html', image=image_data)
+    response, _ = cached_page(lambda: (render_template('images.html', image=image_data), None))
+    return response
 
 @app.route('/images/<filename>')
 def serve_image(filename):
     return send_from_directory(app.config['IMAGE_FOLDER'], filename)
 
+@app.route('/thumbs/<int:size>/<filename>')
+def serve_thumbnail(size, filename):
+    source_path = safe_join(app.config['IMAGE_FOLDER'], filename)
+    if size not in THUMBNAIL_SIZES or source_path is None or not os.path.isfile(source_path):
+        abort(404)
+    
+    # Browsers that decode WebP list it in Accept; everyone else gets JPEG
+    ext = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpg'
+    thumb_path = thumbnail_path(app.config['THUMBNAIL_FOLDER'], size, filename, ext)
+    if not is_fresh(thumb_path, source_path):
+        try:
+            render_thumbnails(source_path, app.config['THUMBNAIL_FOLDER'], filename)
+        except OSError:
+            # Not an image Pillow can decode (UnidentifiedImageError is an OSError), e.g. metadata.json
+            abort(404)
+    
+    response = send_file(thumb_path, mimetype=THUMBNAIL_FORMATS[ext][1], etag=file_etag(thumb_path),
+                         conditional=True, max_age=app.config['THUMBNAIL_MAX_AGE'])
+    response.cache_control.public = True
+    response.vary.add('Accept')
+    return response
+
 if __name__ == '__main__':
     # Create thumbnails directory if it doesn't exist
     if not os.path.exists(app.config['THUMBNAIL_FOLDER']):
         os.makedirs(app.config['THUMBNAIL_FOLDER'])
     
+    start_worker()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,1501 @@
+import argparse
+import gc
+import gzip
+import http.client
+import json
+import platform
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import quote
+from urllib.request import urlopen
+import nltk
+import numpy as np
+from irsystem import ImageSearchEngine
+from analyzer import PUNCTUATION, TextAnalyzer
+from config import IMAGE_FOLDER, METADATA_FILE
+from downloader import ImageDownloader
+from journal import MetadataJournal
+from analysis_pipeline import AnalysisPipeline
+from ingest import IngestPipeline
+from image_hashes import NearDuplicateIndex
+from PIL import Image
+from thumbnails import THUMBNAIL_SIZES, build_thumbnails
+from metadata_store import MetadataStore
+from scoring import rank, rank_scores
+from vector_index import VectorIndex, normalize
+from postings import CompressedPostings
+from query_cache import QueryCache
+import synthetic_corpus
+from suggest import PrefixIndex
+from facets import FacetFilter, facet_record
+from tests.stand_ins import (StandInCaptioner, StandInDetector, image_bytes, jpeg_bytes, scrolling_source,
+                              serve_images)
+
+nltk.download('stopwords', quiet=True)
+nltk.download('wordnet', quiet=True)
+
+
+def timed(fn, repeat):
+    """Run fn `repeat` times and return the wall-clock durations in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def report(label, durations):
+    print(f"{label:<24} median {statistics.median(durations) * 1000:9.2f} ms"
+          f"   min {min(durations) * 1000:9.2f} ms")
+
+
+def bench_startup(args):
+    """Compare a cold index build against loading the prebuilt snapshot."""
+    engine = ImageSearchEngine()
+    if not engine.loaded_from_snapshot:
+        print("💾 No snapshot for current metadata, building one first")
+        engine.save_snapshot()
+
+    cold = timed(lambda: ImageSearchEngine(use_snapshot=False), args.repeat)
+    warm = timed(lambda: ImageSearchEngine(), args.repeat)
+
+    print(f"⏱️ Engine startup over {args.repeat} runs ({engine.total_images} images)")
+    report("cold build", cold)
+    report("snapshot load", warm)
+    print(f"🚀 Speedup: {statistics.median(cold) / statistics.median(warm):.1f}x")
+
+
+def replicate_index(engine, copies):
+    """Tile the engine's corpus `copies` times in place, keeping its term distribution.
+
+    Copies after the first get their filenames prefixed with the copy number so they stay unique.
+    """
+    n = engine.total_images
+    postings_per_term = np.diff(engine.term_offsets)
+    term_offsets = np.zeros_like(engine.term_offsets)
+    term_offsets[1:] = np.cumsum(postings_per_term * copies)
+
+    # Copy-major tiling, then a stable sort on term id gives term -> copy -> doc order,
+    # so every postings list stays sorted by doc id
+    shifts = (np.arange(copies, dtype=np.int64) * n)[:, None]
+    docs, freqs = engine.index.posting_arrays()
+    posting_docs = (docs[None, :] + shifts).ravel()
+    posting_freqs = np.tile(freqs, copies)
+    term_ids = np.repeat(np.arange(len(postings_per_term)), postings_per_term)
+    order = np.argsort(np.tile(term_ids, copies), kind='stable')
+
+    engine._attach_index(engine.terms, term_offsets,
+                         posting_docs[order].astype(np.int32), posting_freqs[order],
+                         np.tile(engine.doc_token_counts, copies), np.tile(engine.doc_lengths, copies),
+                         MetadataStore.from_records(
+                             dict(image, filename=f"{copy}-{image['filename']}" if copy else image['filename'])
+                             for copy in range(copies) for image in engine.image_metadata),
+                         engine.vectors.take(np.tile(np.arange(n), copies)))
+    return engine
+
+
+def sample_queries(engine, count, seed=0):
+    """Short queries drawn from real alt texts, leaving out any without index terms (punctuation, stop words)."""
+    rng = random.Random(seed)
+    images = engine.image_metadata
+    queries = []
+    for position in rng.sample(range(len(images)), len(images)):
+        words = images[position]['alt_text'].split()
+        start = rng.randrange(max(len(words) - 2, 1))
+        query = ' '.join(words[start:start + rng.randint(1, 3)])
+        if engine.analyzer.analyze(query):
+            queries.append(query)
+            if len(queries) == count:
+                break
+    return queries
+
+
+def bench_scoring(args):
+    """Check the numpy backend against the reference loops, then time both at scale."""
+    engine = ImageSearchEngine(cache_size=0)
+    queries = sample_queries(engine, args.queries)
+
+    # Full search results must be identical on the real corpus
+    for query in queries:
+        for search in ('search_vsm', 'search_bm25'):
+            engine.scoring = 'numpy'
+            fast = [(image['filename'], score) for image, score in getattr(engine, search)(query)]
+            engine.scoring = 'python'
+            slow = [(image['filename'], score) for image, score in getattr(engine, search)(query)]
+            assert fast == slow, f"{search} rankings differ for {query!r}"
+    print(f"✅ numpy and python backends agree on {len(queries)} queries")
+
+    # Time scoring plus ranking; result assembly is shared by both backends
+    base_size = engine.total_images
+    for copies in args.copies:
+        scaled = replicate_index(ImageSearchEngine(cache_size=0), copies)
+        print(f"\n📚 {scaled.total_images} documents ({copies} x {base_size})")
+        for method in ('vsm', 'bm25'):
+            timings, rankings = {}, {}
+            for backend in ('python', 'numpy'):
+                scaled.scoring = backend
+                score = getattr(scaled, f"score_{method}")
+                start = time.perf_counter()
+                rankings[backend] = [rank(score(query)) for query in queries]
+                timings[backend] = (time.perf_counter() - start) / len(queries)
+            assert all(np.array_equal(slow, fast) for slow, fast in zip(rankings['python'], rankings['numpy'])), \
+                f"{method} rankings differ at {scaled.total_images} documents"
+            print(f"{method:<6} python {timings['python'] * 1000:9.2f} ms/query"
+                  f"   numpy {timings['numpy'] * 1000:9.2f} ms/query"
+                  f"   speedup {timings['python'] / timings['numpy']:.1f}x")
+
+
+def pruned_top_k(engine, method, query, top_k):
+    """Ranked (doc_ids, scores) from the MaxScore path of the numpy backend, bypassing the cache."""
+    if method == 'vsm':
+        return engine.index.rank_vsm(engine._prepare_text(query), top_k, 'numpy')
+    return engine.index.rank_bm25(engine._prepare_text(query), 1.5, 0.75, top_k, 'numpy')
+
+
+def bench_topk(args):
+    """Full ranking vs argpartition vs MaxScore pruning for top-k queries at scale."""
+    engine = ImageSearchEngine()
+    queries = sample_queries(engine, args.queries)
+
+    for copies in args.copies:
+        scaled = replicate_index(ImageSearchEngine(cache_size=0), copies)
+        print(f"\n📚 {scaled.total_images} documents, top {args.k}")
+        for method in ('vsm', 'bm25'):
+            score = getattr(scaled, f"score_{method}")
+
+            # Pruned results must equal the head of the exhaustive ranking
+            for query in queries:
+                exact_ids, exact_scores = rank_scores(score(query), args.k)
+                pruned_ids, pruned_scores = pruned_top_k(scaled, method, query, args.k)
+                assert np.array_equal(exact_ids, pruned_ids) and np.array_equal(exact_scores, pruned_scores), \
+                    f"{method} top-{args.k} differs for {query!r}"
+
+            # The same work in each row: analyze, score and select, no result assembly
+            full = timed(lambda: [rank_scores(score(query)) for query in queries], 1)[0]
+            partitioned = timed(lambda: [rank_scores(score(query), args.k) for query in queries], 1)[0]
+            pruned = timed(lambda: [pruned_top_k(scaled, method, query, args.k) for query in queries], 1)[0]
+            print(f"{method:<6} all matches {full / len(queries) * 1000:8.2f} ms"
+                  f"   argpartition {partitioned / len(queries) * 1000:8.2f} ms"
+                  f"   maxscore {pruned / len(queries) * 1000:8.2f} ms")
+
+
+def bench_lookup(args):
+    """Image detail lookups by filename: linear scan vs the filename hash index."""
+    import app as webapp
+    client = webapp.app.test_client()
+    rng = random.Random(0)
+
+    for copies in args.copies:
+        scaled = replicate_index(ImageSearchEngine(cache_size=0), copies)
+        store = scaled.image_metadata
+        filenames = [store.value('filename', doc_id) for doc_id in rng.sample(range(len(store)), args.lookups)]
+        records = list(store)  # the old list-of-dicts layout
+
+        scan = timed(lambda: [next(image for image in records if image['filename'] == filename)
+                              for filename in filenames], 1)[0]
+        build = timed(lambda: scaled.index.doc_ids_by_filename, 1)[0]
+        indexed = timed(lambda: [scaled.get_image(filename) for filename in filenames], 1)[0]
+        assert [scaled.get_image(filename) for filename in filenames] == \
+            [next(image for image in records if image['filename'] == filename) for filename in filenames]
+
+        webapp.search_engine = scaled
+        responses = []
+        request = timed(lambda: responses.extend(client.get(f"/image/{filename}") for filename in filenames), 1)[0]
+        assert all(response.status_code == 200 for response in responses)
+
+        print(f"\n📚 {len(store)} images, {args.lookups} lookups")
+        print(f"linear scan   {scan / args.lookups * 1e6:10.1f} us/lookup")
+        print(f"hash index    {indexed / args.lookups * 1e6:10.1f} us/lookup"
+              f"   (built once in {build * 1000:.1f} ms)")
+        print(f"GET /image/   {request / args.lookups * 1e6:10.1f} us/request")
+
+
+def bench_download(args):
+    """Images/sec and bytes/sec of the downloader against a local stand-in host."""
+    server = serve_images(args.size, args.latency, args.fail_every)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/img"
+    print(f"⏱️ {args.images} images of {args.size} bytes, {args.latency * 1000:.0f} ms latency, "
+          f"every {args.fail_every}th fails once")
+
+    try:
+        for workers in args.workers:
+            download_dir = tempfile.mkdtemp(prefix='download-bench-')
+            try:
+                urls = [f"{base_url}/{number}.jpg" for number in range(1, args.images + 1)]
+                with ImageDownloader(download_dir, workers=workers, per_host_rate=args.rate,
+                                     backoff=0.05) as downloader:
+                    results = list(downloader.download_all(urls))
+                stats = downloader.stats()
+
+                assert stats['downloaded'] == args.images and stats['failed'] == 0, stats
+                for url, path, size, _ in results:
+                    number = int(os.path.splitext(os.path.basename(url))[0])
+                    with open(path, 'rb') as f:
+                        assert f.read() == image_bytes(number, args.size), f"corrupt download {url}"
+                print(f"{workers:>3} workers  {stats['images_per_sec']:8.1f} images/sec"
+                      f"   {stats['bytes_per_sec'] / 2 ** 20:8.2f} MiB/sec")
+            finally:
+                shutil.rmtree(download_dir, ignore_errors=True)
+    finally:
+        server.shutdown()
+
+
+def bench_journal(args):
+    """Analyser write cost: rewriting metadata.json every 10 images vs journal appends plus one compaction."""
+    with open(METADATA_FILE, 'r') as f:
+        surrogates = list(json.load(f).values())
+    analyzed = [data for data in surrogates if data.get('analysis')]
+
+    for count in args.images:
+        entries = {f"{number}.jpg": dict(surrogates[number % len(surrogates)], analyzed=False)
+                   for number in range(count)}
+        for data in entries.values():
+            data.pop('analysis', None)
+        updates = [(filename, {'analysis': analyzed[number % len(analyzed)]['analysis'], 'analyzed': True})
+                   for number, filename in enumerate(entries)]
+        workdir = tempfile.mkdtemp(prefix='journal-bench-')
+        try:
+            rewrite_file = os.path.join(workdir, 'rewrite.json')
+            journal_file = os.path.join(workdir, 'journal.json')
+            for path in (rewrite_file, journal_file):
+                with open(path, 'w') as f:
+                    json.dump(entries, f, indent=2)
+
+            def rewrite():
+                metadata = json.loads(json.dumps(entries))
+                for processed, (filename, data) in enumerate(updates, 1):
+                    metadata[filename].update(data)
+                    if processed % 10 == 0:
+                        with open(rewrite_file, 'w') as f:
+                            json.dump(metadata, f, indent=2)
+                with open(rewrite_file, 'w') as f:
+                    json.dump(metadata, f, indent=2)
+
+            journal = MetadataJournal(journal_file)
+
+            def journaled():
+                for filename, data in updates:
+                    journal.append(filename, data)
+                journal.compact()
+
+            # A run killed mid-append must resume with every whole record
+            for filename, data in updates[:count // 2]:
+                journal.append(filename, data)
+            with open(journal.path, 'a') as f:
+                f.write('{"filename": "torn')
+            resumed = journal.load()
+            assert sum(data['analyzed'] for data in resumed.values()) == count // 2
+            os.remove(journal.path)
+
+            slow = timed(rewrite, 1)[0]
+            fast = timed(journaled, 1)[0]
+            with open(rewrite_file, 'r') as a, open(journal_file, 'r') as b:
+                assert json.load(a) == json.load(b), "journal compaction differs from full rewrites"
+            print(f"{count:>7} images   rewrite every 10 {slow:8.2f} s   journal {fast:8.2f} s"
+                  f"   speedup {slow / fast:.1f}x")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_analysis(args):
+    """Per-stage throughput of the analysis pipeline with stand-in models on the local images."""
+    with open(METADATA_FILE, 'r') as f:
+        filenames = list(json.load(f))[:args.images]
+    items = [(filename, os.path.join(IMAGE_FOLDER, filename)) for filename in filenames]
+    print(f"⏱️ {len(items)} images, models cost {args.call_cost * 1000:.0f} ms/call"
+          f" + {args.image_cost * 1000:.0f} ms/image")
+
+    baseline = None
+    for workers, batch_size in [(0, 1)] + [(workers, args.batch_size) for workers in args.workers]:
+        pipeline = AnalysisPipeline(StandInCaptioner(args.call_cost, args.image_cost),
+                                    StandInDetector(args.call_cost, args.image_cost),
+                                    workers=workers, batch_size=batch_size, max_in_flight=args.in_flight)
+        results = {key: analysis for key, analysis, _ in pipeline.run(items)}
+        if baseline is None:
+            baseline = results
+        assert results == baseline, "pipeline settings changed the analysis results"
+
+        stats = pipeline.stats()
+        stages = '   '.join(f"{stage} {stats[stage]['images_per_sec']:8.1f}" for stage in pipeline.STAGES)
+        print(f"workers {workers:>2} batch {batch_size:>3}   {stats['total']['images_per_sec']:7.1f} images/sec"
+              f"   ({stages} images/sec busy)")
+
+
+def bench_ingest(args):
+    """Time-to-searchable of crawl -> download -> analyze -> index: three batch runs vs the streaming pipeline."""
+    server = serve_images(args.size, args.latency, 0, payload=lru_cache(maxsize=None)(jpeg_bytes))
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/img"
+    urls = [f"{base_url}/{number}.jpg" for number in range(1, args.images + 1)]
+    print(f"⏱️ {args.images} images appearing {args.per_scroll} per {args.scroll_delay}s scroll, "
+          f"{args.latency * 1000:.0f} ms per download, models cost {args.call_cost * 1000:.0f} ms/call"
+          f" + {args.image_cost * 1000:.0f} ms/image, into a {args.corpus} document index")
+
+    def setup(workdir):
+        metadata_file = os.path.join(workdir, 'metadata.json')
+        synthetic_corpus.write(metadata_file, args.corpus, seed=0)
+        # Snapshots prune everything else in their directory
+        engine = ImageSearchEngine(use_snapshot=False, cache_size=0, metadata_file=metadata_file,
+                                   index_dir=os.path.join(workdir, 'index'))
+        downloader = ImageDownloader(os.path.join(workdir, 'images'), workers=args.download_workers, backoff=0.05)
+        analysis = AnalysisPipeline(StandInCaptioner(args.call_cost, args.image_cost),
+                                    StandInDetector(args.call_cost, args.image_cost), workers=args.decode_workers,
+                                    batch_size=args.batch_size, mp_context='spawn')
+        return metadata_file, engine, downloader, analysis
+
+    def report_latencies(label, latencies, seconds):
+        latencies = sorted(latencies)
+        print(f"{label:<10} searchable p50 {latencies[len(latencies) // 2]:6.2f}s"
+              f"   p95 {latencies[int(len(latencies) * 0.95)]:6.2f}s   max {latencies[-1]:6.2f}s"
+              f"   all done in {seconds:6.2f}s")
+
+    try:
+        # Today's tools one after another: scroll everything, download everything, analyze, then index
+        workdir = tempfile.mkdtemp(prefix='ingest-batch-')
+        try:
+            metadata_file, engine, downloader, analysis = setup(workdir)
+            discovered_at = {}
+            start = time.monotonic()
+            with downloader:
+                found = dict(scrolling_source(urls, args.per_scroll, args.scroll_delay, discovered_at))
+                os.makedirs(downloader.download_dir)
+                downloaded = {os.path.basename(path): url for url, path, _, _ in downloader.download_all(found) if path}
+            items = [(filename, os.path.join(downloader.download_dir, filename)) for filename in downloaded]
+            surrogates = {filename: dict(hashes, source_url=downloaded[filename], alt_text=found[downloaded[filename]],
+                                         timestamp=time.strftime("%Y-%m-%d %H:%M:%S"), analysis=result, analyzed=True)
+                          for filename, result, hashes in analysis.run(items)}
+            engine.add_documents(surrogates)
+            done = time.monotonic()
+            assert all(engine.get_image(filename) for filename in surrogates), "batch ingest lost images"
+            report_latencies('batch', [done - discovered_at[url] for url in found], done - start)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        for queue_size in args.queue_sizes:
+            workdir = tempfile.mkdtemp(prefix='ingest-stream-')
+            try:
+                metadata_file, engine, downloader, analysis = setup(workdir)
+                pipeline = IngestPipeline(downloader, analysis, metadata_file, engine=engine,
+                                          discovered_queue=queue_size, downloaded_queue=queue_size,
+                                          analyzed_queue=queue_size, batch_timeout=args.batch_timeout,
+                                          publish=lambda: (engine.refresh_from_metadata(), engine.save_snapshot()),
+                                          publish_interval=args.publish_interval)
+                start = time.monotonic()
+                with downloader:
+                    stats = pipeline.run(scrolling_source(urls, args.per_scroll, args.scroll_delay, {}))
+                seconds = time.monotonic() - start
+
+                assert stats['searchable']['images'] == args.images, stats
+                filenames = [os.path.basename(url) for url in urls]
+                assert all(engine.get_image(filename) for filename in filenames), "streaming ingest lost images"
+                metadata = MetadataJournal(metadata_file).load()
+                assert all(metadata[filename].get('analyzed') for filename in filenames), "metadata.json is behind"
+                stages = '   '.join(f"{stage} p50 {stats[stage]['p50']:5.2f}s" for stage in pipeline.STAGES[:-1])
+                print(f"{'queues ' + str(queue_size):<10} searchable p50 {stats['searchable']['p50']:6.2f}s"
+                      f"   p95 {stats['searchable']['p95']:6.2f}s   max {stats['searchable']['max']:6.2f}s"
+                      f"   all done in {seconds:6.2f}s   ({stages}, {stats['published']} publishes)")
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        server.shutdown()
+
+
+# Timed in a fresh interpreter; the last line printed is [seconds, peak RSS in KiB, current RSS in KiB]
+PROBE = """
+import json, os, resource, time
+start = time.perf_counter()
+{code}
+with open('/proc/self/statm') as f:
+    resident = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+print(json.dumps([time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resident]))
+"""
+
+
+def resident_kib():
+    """Current resident set size of this process in KiB."""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def probe(code):
+    """Wall time, peak RSS and final RSS of running code in a new interpreter, or None if it fails."""
+    completed = subprocess.run([sys.executable, '-c', PROBE.format(code=code)],
+                               capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode != 0:
+        return None
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def bench_analyser_startup(args):
+    """Import time and peak RSS of image_analyser, with and without work to do."""
+    workdir = tempfile.mkdtemp(prefix='analyser-startup-')
+    # Copies of metadata.json, so the real one is never rewritten: as crawled (entries analyzed
+    # before hashing was added get hashed on the next run) and as left after that migration
+    unhashed, hashed = os.path.join(workdir, 'unhashed.json'), os.path.join(workdir, 'hashed.json')
+    with open(METADATA_FILE, 'r') as f:
+        metadata = json.load(f)
+    with open(unhashed, 'w') as f:
+        json.dump({filename: {key: value for key, value in data.items() if key not in ('content_sha256', 'dhash')}
+                   for filename, data in metadata.items()}, f)
+
+    def analyze(metadata_file):
+        return (f"import image_analyser; image_analyser.DOWNLOAD_DIR = {IMAGE_FOLDER!r}; "
+                f"image_analyser.METADATA_FILE = {metadata_file!r}; image_analyser.analyze_images()")
+
+    def migrate():
+        shutil.copyfile(unhashed, hashed)
+        return analyze(hashed)
+
+    probes = {
+        'import image_analyser': lambda: "import image_analyser",
+        # Decodes every image once; afterwards `hashed` is fully migrated
+        'hash migration': migrate,
+        'nothing to analyze': lambda: analyze(hashed),
+        # What every import paid before any weights were read, when the stack loaded eagerly
+        'model stack imports': lambda: "import torch, transformers, ultralytics",
+    }
+    print(f"⏱️ Fresh interpreter per run, median of {args.repeat}, {len(metadata)} images in metadata")
+    try:
+        for label, code in probes.items():
+            runs = [probe(code()) for _ in range(args.repeat)]
+            if None in runs:
+                print(f"{label:<24} unavailable (failed to run here)")
+                continue
+            print(f"{label:<24} {statistics.median(seconds for seconds, _, _ in runs) * 1000:9.1f} ms"
+                  f"   peak RSS {max(rss for _, rss, _ in runs) / 1024:8.1f} MiB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_dedup(args):
+    """Inference skipped by the content-hash cache and near-duplicates caught by dHash, on planted copies."""
+    with open(METADATA_FILE, 'r') as f:
+        filenames = list(json.load(f))[:args.images]
+    workdir = tempfile.mkdtemp(prefix='dedup-bench-')
+    try:
+        # Every tenth image gets a lossless copy (same pixels, new name and bytes), and
+        # every tenth, offset by five, a shrunken, recompressed copy
+        items, exact, near = [], {}, {}
+        for number, filename in enumerate(filenames):
+            path = os.path.join(IMAGE_FOLDER, filename)
+            items.append((filename, path))
+            if number % 10 == 0:
+                copy = os.path.join(workdir, f"copy-{number}.png")
+                Image.open(path).convert('RGB').save(copy)
+                exact[f"copy-{number}"] = filename
+                items.append((f"copy-{number}", copy))
+            elif number % 10 == 5:
+                copy = os.path.join(workdir, f"near-{number}.jpg")
+                image = Image.open(path).convert('RGB')
+                image.resize((image.width * 9 // 10, image.height * 9 // 10)).save(copy, quality=60)
+                near[f"near-{number}"] = filename
+                items.append((f"near-{number}", copy))
+        random.Random(0).shuffle(items)
+
+        pipeline = AnalysisPipeline(StandInCaptioner(args.call_cost, args.image_cost),
+                                    StandInDetector(args.call_cost, args.image_cost), batch_size=args.batch_size)
+        results = {key: (analysis, hashes) for key, analysis, hashes in pipeline.run(items)}
+        for copy, original in exact.items():
+            assert results[copy][0] == results[original][0], f"{copy} did not reuse the analysis of {original}"
+
+        index = NearDuplicateIndex(args.distance)
+        flagged = {}
+        for key, _ in items:
+            match = index.find(results[key][1]['dhash'])
+            if match is not None:
+                flagged[key] = match
+            index.add(key, results[key][1]['dhash'])
+        planted = {**exact, **near}
+        caught = sum(1 for copy, original in planted.items()
+                     if flagged.get(copy) == original or flagged.get(original) == copy)
+        other = sum(1 for key, match in flagged.items() if planted.get(key) != match and planted.get(match) != key)
+
+        stats = pipeline.stats()
+        print(f"⏱️ {len(items)} images: {len(filenames)} originals, {len(exact)} lossless copies, "
+              f"{len(near)} recompressed copies")
+        print(f"♻️ Analyses reused {stats['cached']['images']}   inferred {stats['caption']['images']}"
+              f"   inference saved ~{stats['cached']['saved_seconds']:.2f} s"
+              f" of {stats['caption']['seconds'] + stats['detect']['seconds']:.2f} s spent")
+        print(f"🔍 Planted copies caught {caught}/{len(planted)} within {args.distance} bits"
+              f"   other near-duplicate pairs flagged {other}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_thumbnails(args):
+    """Bytes and server CPU per gallery page view: full-size images vs thumbnails."""
+    import app as webapp
+    client = webapp.app.test_client()
+    thumb_folder = tempfile.mkdtemp(prefix='thumb-bench-')
+    webapp.app.config['THUMBNAIL_FOLDER'] = thumb_folder
+    filenames = [image['filename'] for image in webapp.search_engine.get_all_images()[:webapp.app.config['PER_PAGE']]]
+    size = THUMBNAIL_SIZES[-1]
+
+    def page_view(urls, headers=None):
+        """(bytes, CPU seconds) to fetch every image on the page."""
+        start = time.process_time()
+        responses = [client.get(url, headers=headers) for url in urls]
+        cpu = time.process_time() - start
+        assert all(response.status_code in (200, 304) for response in responses)
+        return sum(len(response.data) for response in responses), cpu
+
+    def report_view(label, views):
+        sizes, cpus = zip(*views)
+        print(f"{label:<30} {statistics.median(sizes) / 1024:9.1f} KiB/page"
+              f"   {statistics.median(cpus) * 1000:8.1f} ms CPU/page")
+
+    try:
+        full = [f"/images/{filename}" for filename in filenames]
+        thumbs = [f"/thumbs/{size}/{filename}" for filename in filenames]
+        accept_jpeg = {'Accept': 'image/jpeg,*/*'}
+        accept_webp = {'Accept': 'image/avif,image/webp,*/*'}
+
+        print(f"⏱️ Gallery page of {len(filenames)} images, {size}px thumbnails, median of {args.repeat}")
+        report_view("page HTML", [page_view(['/']) for _ in range(args.repeat)])
+        cold = page_view(thumbs, accept_webp)
+        report_view("WebP, rendered on demand", [cold])
+        report_view("full-size images", [page_view(full) for _ in range(args.repeat)])
+        report_view("JPEG thumbnails", [page_view(thumbs, accept_jpeg) for _ in range(args.repeat)])
+        report_view("WebP thumbnails", [page_view(thumbs, accept_webp) for _ in range(args.repeat)])
+
+        # A repeat visit after max-age only revalidates each thumbnail
+        etags = {url: client.get(url, headers=accept_webp).headers['ETag'] for url in thumbs}
+        views = []
+        for _ in range(args.repeat):
+            start = time.process_time()
+            responses = [client.get(url, headers=dict(accept_webp, **{'If-None-Match': etag}))
+                         for url, etag in etags.items()]
+            views.append((sum(len(response.data) for response in responses), time.process_time() - start))
+            assert all(response.status_code == 304 for response in responses)
+        report_view("WebP revalidated (304)", views)
+
+        shutil.rmtree(thumb_folder)
+        all_images = [image['filename'] for image in webapp.search_engine.get_all_images()]
+        start = time.perf_counter()
+        rendered, failed = build_thumbnails(all_images, thumb_folder=thumb_folder)
+        print(f"🖼️ Prebuilt {rendered} images x {len(THUMBNAIL_SIZES)} sizes x 2 formats "
+              f"in {time.perf_counter() - start:.1f} s ({failed} failed)")
+    finally:
+        shutil.rmtree(thumb_folder, ignore_errors=True)
+
+
+def bench_shards(args):
+    """Per-query p50/p99 latency of top-k search against shard count, checking scores stay identical."""
+    engine = ImageSearchEngine(cache_size=0)
+    queries = sample_queries(engine, args.queries)
+    print(f"🧵 {os.cpu_count()} CPUs")
+
+    for copies in args.copies:
+        reference = {}
+        print(f"\n📚 {engine.total_images * copies} documents, top {args.k}")
+        for shards in args.shards:
+            start = time.perf_counter()
+            scaled = replicate_index(ImageSearchEngine(cache_size=0, shards=shards), copies)
+            setup = time.perf_counter() - start
+            for method in ('vsm', 'bm25'):
+                search = getattr(scaled, f"search_{method}")
+                results = [search(query, top_k=args.k) for query in queries]
+                if shards == args.shards[0]:
+                    reference[method] = results
+                assert results == reference[method], f"{method} results differ with {shards} shards"
+                latencies = [timed(lambda: search(query, top_k=args.k), 1)[0] * 1000 for query in queries]
+                print(f"{shards:3d} shards {method:<5} p50 {np.percentile(latencies, 50):8.2f} ms"
+                      f"   p99 {np.percentile(latencies, 99):8.2f} ms   (index built in {setup:.1f}s)")
+            if scaled.shard_pool:
+                scaled.shard_pool.shutdown()
+
+
+def bench_postings(args):
+    """Postings memory, decode throughput and AND queries: Python lists vs CSR arrays vs varint blocks."""
+    engine = ImageSearchEngine(cache_size=0)
+    # Conjunctive queries need at least two distinct indexed terms
+    term_queries = [sorted({engine.vocabulary[term] for term in engine._prepare_text(query) if term in engine.vocabulary})
+                    for query in sample_queries(engine, args.queries * 4)]
+    term_queries = [term_ids for term_ids in term_queries if len(term_ids) > 1][:args.queries]
+
+    for copies in args.copies:
+        scaled = replicate_index(ImageSearchEngine(cache_size=0), copies)
+        index = scaled.index
+        total = len(index.posting_docs)
+        start = time.perf_counter()
+        compressed = CompressedPostings.encode(index.term_offsets, index.posting_docs, index.posting_freqs)
+        print(f"\n📚 {scaled.total_images} documents, {total} postings (encoded in {time.perf_counter() - start:.2f}s)")
+
+        sizes = {'csr arrays': index.term_offsets.nbytes + index.posting_docs.nbytes + index.posting_freqs.nbytes,
+                 'varint blocks': compressed.nbytes}
+        if copies <= args.python_max:
+            # The dict of (doc_id, freq) tuple lists the index used to keep
+            before = resident_kib()
+            docs, freqs = index.posting_docs.tolist(), index.posting_freqs.tolist()
+            bounds = index.term_offsets.tolist()
+            lists = {term: list(zip(docs[start:end], freqs[start:end]))
+                     for term, start, end in zip(index.terms, bounds, bounds[1:])}
+            del docs, freqs
+            sizes['python lists'] = (resident_kib() - before) * 1024
+            del lists
+        for label, size in sizes.items():
+            print(f"{label:<14} {size / total:6.2f} bytes/posting   {size / 2 ** 20:8.1f} MiB")
+
+        # Every list one term at a time, as queries read them, then all at once
+        term_ids = range(len(index.terms))
+        csr = timed(lambda: [index.postings(term_id) for term_id in term_ids], 1)[0]
+        per_term = timed(lambda: [compressed.postings(term_id) for term_id in term_ids], 1)[0]
+        bulk = timed(compressed.decode_all, 1)[0]
+        assert all(np.array_equal(a, b) for a, b in zip(compressed.decode_all(), (index.posting_docs, index.posting_freqs)))
+        print(f"csr slices     {total / csr / 1e6:8.1f} M postings/sec")
+        print(f"varint lists   {total / per_term / 1e6:8.1f} M postings/sec")
+        print(f"varint bulk    {total / bulk / 1e6:8.1f} M postings/sec")
+
+        # AND queries: skip pointers decode only the blocks that can hold candidates
+        def full_decode(term_ids):
+            docs = compressed.postings(term_ids[0])[0]
+            for term_id in term_ids[1:]:
+                docs = np.intersect1d(docs, compressed.postings(term_id)[0], assume_unique=True)
+            return docs
+
+        # Sampled queries, and the rarest terms each paired with the most common one
+        by_frequency = np.argsort(np.diff(index.term_offsets), kind='stable')
+        rare_common = [[int(term_id), int(by_frequency[-1])] for term_id in by_frequency[:args.queries]]
+        for label, workload in (('sampled', term_queries), ('rare+common', rare_common)):
+            expected = [full_decode(term_ids) for term_ids in workload]
+            assert all(np.array_equal(compressed.intersect(term_ids), want)
+                       for term_ids, want in zip(workload, expected))
+            decoded = timed(lambda: [full_decode(term_ids) for term_ids in workload], 1)[0]
+            skipped = timed(lambda: [compressed.intersect(term_ids) for term_ids in workload], 1)[0]
+            print(f"AND {label:<12} full decode {decoded / len(workload) * 1000:7.2f} ms/query"
+                  f"   skip pointers {skipped / len(workload) * 1000:7.2f} ms/query")
+
+        # Ranked search pays the decode on every query term
+        packed = replicate_index(ImageSearchEngine(cache_size=0, compress_postings=True), copies)
+        queries = sample_queries(engine, args.queries)
+        for label, searcher in (('csr', scaled), ('varint', packed)):
+            durations = [timed(lambda: searcher.search_bm25(query, top_k=50), 1)[0] * 1000 for query in queries]
+            print(f"bm25 top 50, {label:<7} p50 {np.percentile(durations, 50):7.2f} ms"
+                  f"   p99 {np.percentile(durations, 99):7.2f} ms")
+        del scaled, packed, index, compressed
+
+        # Whole-process RSS of a worker holding the index, including metadata and embeddings
+        for compress in (False, True):
+            result = probe("import benchmark\nfrom irsystem import ImageSearchEngine\n"
+                           f"engine = benchmark.replicate_index(ImageSearchEngine(cache_size=0, "
+                           f"compress_postings={compress}), {copies})\n"
+                           "import gc; gc.collect()")
+            label = 'varint' if compress else 'csr'
+            print(f"worker RSS, {label:<7} " + ("unavailable" if result is None else f"{result[2] / 1024:8.1f} MiB"))
+
+
+def bench_vectors(args):
+    """Semantic search latency and recall@k of float16, int8 and IVF indexes against exact float32 search."""
+    engine = ImageSearchEngine(cache_size=0)
+    queries = sample_queries(engine, args.queries)
+    query_vectors = engine._embed(queries)
+    base = engine.vectors.rows()
+    rng = np.random.default_rng(0)
+
+    for copies in args.copies:
+        # Noisy copies of the real embeddings, so neighbours are not exact ties
+        embeddings = np.tile(base, (copies, 1))
+        if copies > 1:
+            embeddings += rng.normal(0, args.noise / np.sqrt(base.shape[1]), embeddings.shape).astype(np.float32)
+            embeddings = normalize(embeddings)
+        exact_index = VectorIndex.build(embeddings, 'float32', nlist=0)
+        exact = [exact_index.search(query, args.k)[0] for query in query_vectors]
+
+        print(f"\n📚 {len(embeddings)} embeddings x {embeddings.shape[1]} dims, top {args.k}")
+        variants = [(f"exact {dtype}", VectorIndex.build(embeddings, dtype, nlist=0), None)
+                    for dtype in ('float32', 'float16', 'int8')]
+        nlist = args.nlist or max(int(np.sqrt(len(embeddings))), 1)
+        start = time.perf_counter()
+        ivf = VectorIndex.build(embeddings, 'float16', nlist=nlist)
+        print(f"IVF build ({nlist} lists) {time.perf_counter() - start:.1f}s")
+        variants += [(f"ivf nprobe={nprobe}", ivf, nprobe) for nprobe in args.nprobe if nprobe <= nlist]
+        del embeddings
+
+        for label, index, nprobe in variants:
+            found = []
+            single = timed(lambda: found.extend(index.search(query, args.k, nprobe)[0] for query in query_vectors), 1)[0]
+            # Queries with no exact neighbours have nothing to recall, so they do not count either way
+            recall = statistics.mean(len(np.intersect1d(got, want)) / len(want)
+                                     for got, want in zip(found, exact) if len(want))
+            line = (f"{label:<18} {single / len(queries) * 1000:8.2f} ms/query   recall@{args.k} {recall:.3f}"
+                    f"   {index.vectors.nbytes / 2 ** 20:8.1f} MiB")
+            if nprobe is None:
+                batched = timed(lambda: index.search_batch(query_vectors, args.k), 1)[0]
+                line += f"   batched {batched / len(queries) * 1000:8.2f} ms/query"
+            print(line)
+
+    # End to end on the real corpus, including query embedding and fusion
+    for method in ('bm25', 'semantic', 'hybrid'):
+        search = getattr(engine, f"search_{method}")
+        durations = timed(lambda: [search(query, top_k=args.k) for query in queries], args.repeat)
+        report(f"{method} search", [d / len(queries) for d in durations])
+
+
+def bench_api(args):
+    """JSON API vs the HTML results page, batch vs one-by-one queries, NDJSON streaming vs a JSON list."""
+    import app as webapp
+    client = webapp.app.test_client()
+    engine = webapp.search_engine
+    queries = sample_queries(engine, args.queries)
+    if args.copies > 1:
+        replicate_index(engine, args.copies)
+    print(f"⏱️ {engine.total_images} images, {len(queries)} queries, k={args.k}, result cache off")
+    engine.result_cache = QueryCache(max_entries=0)
+
+    def fetch(urls):
+        """(bytes, seconds) to fetch every url."""
+        start = time.perf_counter()
+        responses = [client.get(url) for url in urls]
+        assert all(response.status_code == 200 for response in responses)
+        return sum(len(response.data) for response in responses), time.perf_counter() - start
+
+    for method in ('vsm', 'bm25'):
+        for label, path in (('HTML /search/results', '/search/results'), ('JSON /api/search', '/api/search')):
+            size, seconds = fetch([f"{path}?query={quote(query)}&method={method}&k={args.k}" for query in queries])
+            print(f"{method:<5} {label:<22} {size / len(queries) / 1024:8.1f} KiB/query"
+                  f"   {seconds / len(queries) * 1000:8.2f} ms/query")
+
+        # The same queries one request at a time vs in one batch request
+        start = time.perf_counter()
+        singles = [client.get(f"/api/search?query={quote(query)}&method={method}&k={args.k}").get_json()['results']
+                   for query in queries]
+        single_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        batch = client.post('/api/search/batch', json={'queries': queries, 'method': method, 'k': args.k}).get_json()
+        batch_seconds = time.perf_counter() - start
+        assert [answer['results'] for answer in batch['results']] == singles
+        print(f"{method:<5} {'one request per query':<22} {len(queries) / single_seconds:8.0f} queries/s")
+        print(f"{method:<5} {'/api/search/batch':<22} {len(queries) / batch_seconds:8.0f} queries/s"
+              f"   ({single_seconds / batch_seconds:.1f}x)")
+
+    # Every result of a broad query: peak memory to serialize a whole list vs streaming it line by line
+    query = max(queries, key=lambda query: len(engine.search_bm25(query)))
+    with webapp.app.app_context():
+        tracemalloc.start()
+        whole = webapp.jsonify([webapp.api_result(record, score)
+                                for record, score in webapp.run_search('bm25', query, None)]).get_data()
+        _, list_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    tracemalloc.start()
+    response = client.get(f"/api/search?query={quote(query)}&method=bm25&stream=1", buffered=False)
+    streamed = sum(len(chunk) for chunk in response.response)
+    _, stream_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    lines = len(engine.search_bm25(query))
+    print(f"📦 '{query}': {lines} results, JSON list {len(whole) / 1024:.0f} KiB peak {list_peak / 1024:.0f} KiB,"
+          f" NDJSON {streamed / 1024:.0f} KiB peak {stream_peak / 1024:.0f} KiB")
+
+
+def child_pids(pid):
+    """Pids of a process' direct children."""
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The parent pid follows the state, after the parenthesized command name
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children
+
+
+def memory_kib(pid):
+    """Unique (private) and proportional set size of a process in KiB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields['Private_Clean'] + fields['Private_Dirty'], fields['Pss']
+
+
+def fetch_json(url, timeout=5):
+    with urlopen(url, timeout=timeout) as response:
+        return json.load(response)
+
+
+def poll_workers(base_url, workers, until, timeout):
+    """Seconds until every worker answers /healthz with until(answer) true, or None on timeout.
+
+    Each round sends one concurrent request per worker, so idle workers
+    share them and every worker is reached within a few rounds.
+    """
+    start = time.perf_counter()
+    done = set()
+    with ThreadPoolExecutor(workers) as pool:
+        while time.perf_counter() - start < timeout:
+            def check(_):
+                try:
+                    return fetch_json(f"{base_url}/healthz", timeout=1)
+                except OSError:
+                    return None
+            for answer in pool.map(check, range(workers)):
+                if answer is not None and until(answer):
+                    done.add(answer['pid'])
+            if len(done) >= workers:
+                return time.perf_counter() - start
+            time.sleep(0.05)
+    return None
+
+
+def bench_workers(args):
+    """gunicorn start-to-ready time, per-worker memory and hot index reloads, with and without preloading."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    workdir = args.workdir or tempfile.mkdtemp(prefix='workers-')
+    os.makedirs(workdir, exist_ok=True)
+    index_dir = os.path.join(workdir, 'index')
+    metadata_file = os.path.join(workdir, 'metadata.json')
+    # Two versions of the corpus with a snapshot each; swapping the file in triggers a hot reload
+    versions = [os.path.join(workdir, f"metadata-{args.size}-{seed}.json") for seed in (args.seed, args.seed + 1)]
+    for version, seed in zip(versions, (args.seed, args.seed + 1)):
+        if not os.path.exists(version):
+            synthetic_corpus.write(version, args.size, seed=seed)
+        ImageSearchEngine(cache_size=0, metadata_file=version, index_dir=index_dir).save_snapshot()
+        gc.collect()
+    settings = os.path.join(workdir, 'settings.py')
+    with open(settings, 'w') as f:
+        f.write(f"METADATA_FILE = {metadata_file!r}\nINDEX_DIR = {index_dir!r}\n"
+                f"INDEX_RELOAD_INTERVAL = {args.reload_interval!r}\n")
+    # No config file at all: gunicorn's defaults, each worker imports the app itself
+    plain_config = os.path.join(workdir, 'plain.conf.py')
+    open(plain_config, 'w').close()
+    with open(versions[0], 'r') as f:
+        queries = synthetic_corpus.vocabulary_queries(json.load(f), args.queries, args.seed)
+
+    print(f"⏱️ {args.size} documents from a snapshot, {args.queries} warm-up queries spread over the workers")
+    env = dict(os.environ, VISUAL_VOYAGER_SETTINGS=settings)
+    for label, config in (('per-worker import', plain_config), ('preload + fork', os.path.join(here, 'gunicorn.conf.py'))):
+        for workers in args.workers:
+            shutil.copyfile(versions[0], metadata_file)
+            port = args.port
+            base_url = f"http://127.0.0.1:{port}"
+            start = time.perf_counter()
+            server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', config, '-w', str(workers),
+                                       '-b', f"127.0.0.1:{port}", '--log-level', 'warning', 'app:app'],
+                                      cwd=here, env=env)
+            try:
+                if poll_workers(base_url, workers, lambda answer: True, args.timeout) is None:
+                    print(f"{label:<18} {workers:3d} workers  not ready after {args.timeout}s")
+                    continue
+                ready = time.perf_counter() - start
+                with ThreadPoolExecutor(workers) as pool:
+                    list(pool.map(lambda query: fetch_json(f"{base_url}/api/search?query={quote(query)}&k=20"),
+                                  queries))
+                memory = [memory_kib(pid) for pid in child_pids(server.pid)]
+                master_uss, _ = memory_kib(server.pid)
+                uss = [private for private, _ in memory]
+                line = (f"{label:<18} {workers:3d} workers  ready {ready:6.2f}s   worker USS mean "
+                        f"{statistics.mean(uss) / 1024:7.1f} MiB max {max(uss) / 1024:7.1f} MiB   "
+                        f"total PSS {sum(pss for _, pss in memory) / 1024:8.1f} MiB   master USS {master_uss / 1024:6.1f} MiB")
+                if config != plain_config and args.reload_interval is not None:
+                    # Hot reload: a new snapshot's metadata appears, every worker swaps generations in place
+                    generation = fetch_json(f"{base_url}/healthz")['generation']
+                    shutil.copyfile(versions[1], metadata_file + '.tmp')
+                    os.replace(metadata_file + '.tmp', metadata_file)
+                    reloaded = poll_workers(base_url, workers, lambda answer: answer['generation'] > generation,
+                                            args.timeout)
+                    line += f"   reload {reloaded:.2f}s" if reloaded is not None else "   reload timed out"
+                print(line)
+            finally:
+                server.terminate()
+                server.wait()
+    if not args.workdir:
+        shutil.rmtree(workdir)
+
+
+class BrowserCache:
+    """Just enough of a browser's HTTP cache for load tests.
+
+    Responses still fresh under max-age are reused without a request; the
+    rest are revalidated with If-None-Match and reused on a 304.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def fetch(self, connection, path, counters):
+        """Body of path, fetched over connection unless still fresh; counts requests and bytes."""
+        entry = self.entries.get(path)
+        if entry and entry['expires'] > time.monotonic():
+            counters['cached'] += 1
+            return entry['body']
+        headers = {'Accept-Encoding': 'gzip, br'}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        counters['requests'] += 1
+        counters['bytes'] += len(body) + sum(len(name) + len(value) + 4 for name, value in response.getheaders())
+        if response.status == 304:
+            counters['not_modified'] += 1
+            return entry['body']
+        assert response.status == 200, (path, response.status)
+        if response.getheader('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        cache_control = response.getheader('Cache-Control') or ''
+        max_age = next((int(part.split('=')[1]) for part in cache_control.split(', ') if part.startswith('max-age=')), 0)
+        self.entries[path] = {'etag': response.getheader('ETag'), 'body': body,
+                              'expires': time.monotonic() + (max_age if 'no-cache' not in cache_control else 0)}
+        return body
+
+
+def bench_pages(args):
+    """Requests/sec and bytes transferred for browsing sessions, without and with HTTP caching."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    workdir = args.workdir or tempfile.mkdtemp(prefix='pages-')
+    os.makedirs(workdir, exist_ok=True)
+    index_dir = os.path.join(workdir, 'index')
+    metadata_file = os.path.join(workdir, f"metadata-{args.size}.json")
+    if not os.path.exists(metadata_file):
+        synthetic_corpus.write(metadata_file, args.size, seed=args.seed)
+    ImageSearchEngine(cache_size=0, metadata_file=metadata_file, index_dir=index_dir).save_snapshot()
+    with open(metadata_file, 'r') as f:
+        queries = synthetic_corpus.vocabulary_queries(json.load(f), args.queries, args.seed)
+
+    # Popularity falls off with rank, as in real traffic: page 1 and the top queries dominate
+    rng = random.Random(args.seed)
+    views = [f"/?page={rank}" for rank in range(1, args.pages + 1)] + \
+        [f"/search/results?query={quote(query)}&method=bm25" for query in queries]
+    weights = [1 / rank for rank in range(1, args.pages + 1)] + [1 / rank for rank in range(1, len(queries) + 1)]
+    sessions = [rng.choices(views, weights, k=args.views) for _ in range(args.clients)]
+    asset_pattern = re.compile(rb'(?:href|src)="(/static/[^"]+)"')
+
+    print(f"⏱️ {args.clients} browsers x {args.views} page views over {args.pages} gallery pages and "
+          f"{len(queries)} queries, {args.size} documents, {args.workers} gunicorn workers")
+    for label, caching in (('before', False), ('after', True)):
+        settings = os.path.join(workdir, f"settings-{label}.py")
+        with open(settings, 'w') as f:
+            f.write(f"METADATA_FILE = {metadata_file!r}\nINDEX_DIR = {index_dir!r}\n"
+                    f"INDEX_RELOAD_INTERVAL = None\nHTTP_CACHING = {caching!r}\n")
+        base_url = f"http://127.0.0.1:{args.port}"
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(here, 'gunicorn.conf.py'),
+                                   '-w', str(args.workers), '-b', f"127.0.0.1:{args.port}", '--log-level', 'warning',
+                                   'app:app'], cwd=here, env=dict(os.environ, VISUAL_VOYAGER_SETTINGS=settings))
+        try:
+            if poll_workers(base_url, args.workers, lambda answer: True, args.timeout) is None:
+                print(f"{label:<7} server not ready after {args.timeout}s")
+                continue
+
+            def browse(session, returning):
+                counters = {'requests': 0, 'bytes': 0, 'not_modified': 0, 'cached': 0}
+                cache = BrowserCache()
+                connection = http.client.HTTPConnection('127.0.0.1', args.port, timeout=30)
+                try:
+                    for view in session:
+                        if not returning:
+                            cache = BrowserCache()
+                        page = cache.fetch(connection, view, counters)
+                        for asset in asset_pattern.findall(page):
+                            cache.fetch(connection, asset.decode(), counters)
+                finally:
+                    connection.close()
+                return counters
+
+            # First visits start every view with an empty browser cache; returning visitors keep theirs
+            for visitors in ('first', 'returning'):
+                start = time.perf_counter()
+                with ThreadPoolExecutor(args.clients) as pool:
+                    results = list(pool.map(lambda session: browse(session, visitors == 'returning'), sessions))
+                seconds = time.perf_counter() - start
+                totals = {name: sum(counters[name] for counters in results) for name in results[0]}
+                page_views = args.clients * args.views
+                print(f"{label:<7} {visitors:<10} {totals['requests'] / seconds:8.1f} requests/sec"
+                      f"   {page_views / seconds:7.1f} page views/sec   {totals['bytes'] / 2 ** 20:8.2f} MiB transferred"
+                      f"   {totals['bytes'] / page_views / 1024:7.1f} KiB/view   {totals['requests']} requests,"
+                      f" {totals['not_modified']} answered 304, {totals['cached']} from the browser cache")
+        finally:
+            server.terminate()
+            server.wait()
+    if not args.workdir:
+        shutil.rmtree(workdir)
+
+
+def corpus_path(directory, size):
+    return os.path.join(directory, f"metadata-{size}.json")
+
+
+def bench_corpus(args):
+    """Write synthetic metadata.json files at the given sizes."""
+    os.makedirs(args.out_dir, exist_ok=True)
+    for size in args.sizes:
+        start = time.perf_counter()
+        path = corpus_path(args.out_dir, size)
+        synthetic_corpus.write(path, size, seed=args.seed)
+        print(f"📝 {size} documents -> {path} ({os.path.getsize(path) / 2 ** 20:.1f} MiB, "
+              f"{time.perf_counter() - start:.1f}s)")
+
+
+def percentiles(latencies):
+    return {f"p{q}": float(np.percentile(latencies, q)) for q in (50, 95, 99)}
+
+
+def measure_scale(size, workdir, args):
+    """Build, cold start, memory and query latency metrics for one synthetic corpus size."""
+    metadata_file = corpus_path(workdir, size)
+    if not os.path.exists(metadata_file):
+        synthetic_corpus.write(metadata_file, size, seed=args.seed)
+    index_dir = os.path.join(workdir, f"index-{size}")
+    engine_args = f"metadata_file={metadata_file!r}, index_dir={index_dir!r}"
+    metrics = {}
+
+    # Index build and startup from the snapshot, each in a fresh interpreter
+    build = probe(f"from irsystem import ImageSearchEngine\nImageSearchEngine(use_snapshot=False, {engine_args})")
+    if build is None:
+        # Usually out of memory; the result file records it and the other sizes still run
+        return {'error': "index build failed"}
+    metrics['build_s'], build_peak, _ = build
+    metrics['build_peak_rss_mib'] = build_peak / 1024
+    engine = ImageSearchEngine(cache_size=0, metadata_file=metadata_file, index_dir=index_dir)
+    engine.save_snapshot()
+    del engine
+    gc.collect()
+    cold = probe(f"from irsystem import ImageSearchEngine\n"
+                 f"assert ImageSearchEngine({engine_args}).loaded_from_snapshot")
+    if cold is None:
+        return dict(metrics, error="snapshot load failed")
+    metrics['cold_start_s'], _, cold_resident = cold
+    metrics['resident_mib'] = cold_resident / 1024
+
+    # Per-query latency on the snapshot, result cache off so every query is scored
+    engine = ImageSearchEngine(cache_size=0, metadata_file=metadata_file, index_dir=index_dir)
+    if args.queries_file:
+        queries = synthetic_corpus.load_queries(args.queries_file)[:args.queries]
+    else:
+        with open(metadata_file, 'r') as f:
+            queries = synthetic_corpus.vocabulary_queries(json.load(f), args.queries, args.seed)
+    for method in ('vsm', 'bm25'):
+        search = getattr(engine, f"search_{method}")
+        for query in queries[:10]:
+            search(query, top_k=args.k)
+        # Median of a few runs per query, so one scheduler hiccup does not move the tail percentiles
+        latencies = [statistics.median(timed(lambda: search(query, top_k=args.k), args.repeat)) * 1000
+                     for query in queries]
+        metrics.update((f"{method}_{name}_ms", value) for name, value in percentiles(latencies).items())
+    metrics['terms'] = len(engine.terms)
+    metrics['postings'] = int(engine.term_offsets[-1])
+    return metrics
+
+
+# Metrics compared against a baseline; all of them are better lower
+TRACKED_METRICS = ('build_s', 'build_peak_rss_mib', 'cold_start_s', 'resident_mib',
+                   'vsm_p50_ms', 'vsm_p95_ms', 'vsm_p99_ms', 'bm25_p50_ms', 'bm25_p95_ms', 'bm25_p99_ms')
+
+
+def compare_results(baseline, current, tolerance):
+    """Print each tracked metric against the baseline and return the ones worse by more than tolerance."""
+    regressions = []
+    for size, metrics in current['scales'].items():
+        before = baseline['scales'].get(size)
+        if before is None:
+            print(f"{size:>9} documents: not in the baseline")
+            continue
+        if 'error' in metrics and 'error' not in before:
+            regressions.append((size, 'error', None, metrics['error']))
+            print(f"{size:>9} {metrics['error']:<20}   ❌ regression")
+        for name in TRACKED_METRICS:
+            if name not in metrics or not before.get(name):
+                continue
+            change = metrics[name] / before[name] - 1
+            regressed = change > tolerance
+            if regressed:
+                regressions.append((size, name, before[name], metrics[name]))
+            print(f"{size:>9} {name:<20} {before[name]:10.2f} -> {metrics[name]:10.2f}   {change:+7.1%}"
+                  f"{'   ❌ regression' if regressed else ''}")
+    return regressions
+
+
+def bench_suite(args):
+    """Benchmark the engine on synthetic corpora, save the metrics as JSON and compare them to a baseline."""
+    workdir = args.workdir or tempfile.mkdtemp(prefix='search-suite-')
+    os.makedirs(workdir, exist_ok=True)
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'python': platform.python_version(), 'numpy': np.__version__,
+                    'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'workload': {'queries': args.queries, 'queries_file': args.queries_file, 'k': args.k,
+                     'repeat': args.repeat, 'seed': args.seed},
+        'scales': {},
+    }
+    try:
+        for size in args.sizes:
+            print(f"📚 {size} documents")
+            metrics = results['scales'][str(size)] = measure_scale(size, workdir, args)
+            if 'error' in metrics:
+                print(f"   ❌ {metrics['error']}")
+                continue
+            print(f"   build {metrics['build_s']:.1f}s (peak {metrics['build_peak_rss_mib']:.0f} MiB), "
+                  f"cold start {metrics['cold_start_s']:.2f}s ({metrics['resident_mib']:.0f} MiB), "
+                  f"{metrics['terms']} terms")
+            for method in ('vsm', 'bm25'):
+                print(f"   {method:<5} p50 {metrics[f'{method}_p50_ms']:8.2f} ms   p95 {metrics[f'{method}_p95_ms']:8.2f} ms"
+                      f"   p99 {metrics[f'{method}_p99_ms']:8.2f} ms")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"💾 Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if compare_results(baseline, results, args.tolerance):
+            sys.exit(1)
+
+
+def bench_compare(args):
+    """Compare two saved suite results; exits non-zero on a regression."""
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    with open(args.current, 'r') as f:
+        current = json.load(f)
+    if compare_results(baseline, current, args.tolerance):
+        sys.exit(1)
+    print("✅ No regressions")
+
+
+def synthetic_vocabulary(engine, size, seed=0):
+    """{word: document frequency} of `size` distinct words: the real ones, then suffixed variants, Zipf weighted."""
+    rng = np.random.default_rng(seed)
+    words = engine.index.suggestions.words()
+    vocabulary = list(words)
+    suffix = 1
+    while len(vocabulary) < size:
+        vocabulary.extend(f"{word}{synthetic_corpus.alphabetic(suffix)}"
+                          for word in words[:size - len(vocabulary)])
+        suffix += 1
+    weights = np.maximum((len(vocabulary) / np.arange(1, len(vocabulary) + 1)).astype(np.int64), 1)
+    return dict(zip(vocabulary, rng.permutation(weights).tolist()))
+
+
+def bench_suggest(args):
+    """Autocomplete lookups on a large vocabulary: prefix index vs scanning a sorted word list."""
+    engine = ImageSearchEngine(cache_size=0)
+    rng = random.Random(0)
+    for size in args.terms:
+        vocabulary = synthetic_vocabulary(engine, size)
+        start = time.perf_counter()
+        index = PrefixIndex.build(vocabulary)
+        build = time.perf_counter() - start
+        print(f"\n📚 {len(index)} words, index {index.nbytes / 2 ** 20:.1f} MiB, built in {build:.1f}s")
+
+        words = rng.sample(list(vocabulary), args.queries)
+        for length in (1, 2, 3, 5):
+            prefixes = [word[:length] for word in words]
+            cold = [timed(lambda: index.complete(prefix, args.limit), 1)[0] * 1000 for prefix in prefixes]
+            warm = [timed(lambda: index.complete(prefix, args.limit), 1)[0] * 1000 for prefix in prefixes]
+            print(f"prefix length {length}   first p50 {np.percentile(cold, 50):7.3f} ms   p99 {np.percentile(cold, 99):7.3f} ms"
+                  f"   repeat p50 {np.percentile(warm, 50):7.3f} ms   p99 {np.percentile(warm, 99):7.3f} ms")
+
+        # What a lookup costs without an index: filter every word, then sort the matches
+        ordered = sorted(vocabulary)
+        scans = [timed(lambda: sorted((word for word in ordered if word.startswith(word_[:3])),
+                                      key=vocabulary.__getitem__, reverse=True)[:args.limit], 1)[0] * 1000
+                 for word_ in words[:20]]
+        print(f"linear scan, length 3   p50 {np.percentile(scans, 50):9.3f} ms")
+
+    # End to end through the web route on the real corpus
+    import app as webapp
+    client = webapp.app.test_client()
+    prefixes = [word[:rng.randint(1, 4)] for word in rng.sample(engine.index.suggestions.words(), args.queries)]
+    latencies = [timed(lambda: client.get(f"/api/suggest?q={quote(prefix)}"), 1)[0] * 1000 for prefix in prefixes]
+    print(f"\n/api/suggest ({len(webapp.search_engine.index.suggestions)} words)   "
+          f"p50 {np.percentile(latencies, 50):7.3f} ms   p99 {np.percentile(latencies, 99):7.3f} ms")
+
+
+def bench_filters(args):
+    """Filtered gallery browsing and filtered search: bitmaps before scoring vs filtering ranked results."""
+    workdir = tempfile.mkdtemp(prefix='filters-')
+    try:
+        for size in args.sizes:
+            path = os.path.join(workdir, f"metadata-{size}.json")
+            corpus = synthetic_corpus.write(path, size, seed=args.seed)
+            engine = ImageSearchEngine(use_snapshot=False, cache_size=0, metadata_file=path, index_dir=workdir)
+            facets = engine.index.facets
+            objects = sorted(facets.counts()['objects'].items(), key=lambda item: -item[1])
+            timestamps = np.sort(facets.timestamps[facets.timestamps > np.iinfo(np.int64).min])
+            # The newest tenth of the images by crawl time
+            recent = int(timestamps[len(timestamps) * 9 // 10]) if len(timestamps) else None
+            filters = {
+                'common object': FacetFilter([objects[0][0]]),
+                'rare object': FacetFilter([objects[-1][0]]),
+                'object + min_conf': FacetFilter([objects[0][0]], min_conf=0.5),
+                'model': FacetFilter(models=[facets.model_names[0]]),
+                'recent tenth': FacetFilter(since=recent),
+                'object + recent': FacetFilter([objects[0][0]], since=recent),
+            }
+            print(f"\n📚 {size} documents, {len(objects)} object classes, bitmaps "
+                  f"{(facets.object_bitmaps.nbytes + facets.model_bitmaps.nbytes) / 1024:.0f} KiB")
+
+            entries = list(corpus.values())
+            queries = sample_queries(engine, args.queries, args.seed)
+            for label, facet_filter in filters.items():
+                selected = engine.index.select(facet_filter)
+                browse = timed(lambda: engine.get_all_images(facet_filter)[:args.k], args.repeat)
+                # Without an index, browsing means checking every entry's fields
+                scan = timed(lambda: [data for data in entries if matches(facet_record(data), facet_filter)][:args.k],
+                             max(1, args.repeat // 5))
+                filtered, post = [], []
+                for query in queries:
+                    filtered.append(timed(lambda: engine.search_bm25(query, top_k=args.k, filters=facet_filter), 1)[0])
+                    start = time.perf_counter()
+                    keep = np.zeros(engine.total_images, dtype=bool)
+                    keep[selected] = True
+                    ranked = [(record, score) for record, score in engine.search_bm25(query)
+                              if keep[engine.index.doc_ids_by_filename[record['filename']]]][:args.k]
+                    post.append(time.perf_counter() - start)
+                    assert ranked == engine.search_bm25(query, top_k=args.k, filters=facet_filter), label
+                print(f"{label:<18} {len(selected):8d} images   browse {statistics.median(browse) * 1000:8.2f} ms"
+                      f" (scan {statistics.median(scan) * 1000:8.1f} ms)   bm25 top {args.k} "
+                      f"p50 {np.percentile(filtered, 50) * 1000:7.2f} ms"
+                      f" (rank then filter {np.percentile(post, 50) * 1000:7.2f} ms)")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def matches(record, facet_filter):
+    """Whether a facet_record() passes a FacetFilter, checked field by field."""
+    timestamp, model, objects = record
+    floor = -1.0 if facet_filter.min_conf is None else facet_filter.min_conf
+    if facet_filter.objects:
+        if not any(objects.get(name, -2.0) >= floor for name in facet_filter.objects):
+            return False
+    elif facet_filter.min_conf is not None and not any(value >= floor for value in objects.values()):
+        return False
+    if facet_filter.models and model not in facet_filter.models:
+        return False
+    if facet_filter.since is not None or facet_filter.until is not None:
+        if timestamp is None or (facet_filter.since is not None and timestamp < facet_filter.since) or \
+                (facet_filter.until is not None and timestamp > facet_filter.until):
+            return False
+    return True
+
+
+def bench_analyzer(args):
+    """Tokens/sec of the text analyzer on the real captions and alt texts."""
+    with open(METADATA_FILE, 'r') as f:
+        surrogates = json.load(f)
+    texts = [data['alt_text'] for data in surrogates.values()]
+    texts += [data['analysis']['caption'] for data in surrogates.values() if data.get('analysis')]
+    tokens = sum(len(PUNCTUATION.sub('', text.lower()).split()) for text in texts)
+
+    def per_text(analyzer):
+        return lambda: [analyzer.analyze(text) for text in texts]
+
+    uncached = TextAnalyzer(memo_size=0)
+    warm = TextAnalyzer()
+    warm.analyze_batch(texts)
+    runs = {
+        'no memo': per_text(uncached),
+        'memo, cold': lambda: per_text(TextAnalyzer())(),
+        'memo, warm': per_text(warm),
+        'batch, cold': lambda: TextAnalyzer().analyze_batch(texts),
+    }
+    assert uncached.analyze_batch(texts) == [uncached.analyze(text) for text in texts] == warm.analyze_batch(texts)
+
+    print(f"⏱️ Analyzing {len(texts)} texts, {tokens} tokens")
+    for label, run in runs.items():
+        best = min(timed(run, args.repeat))
+        print(f"{label:<14} {tokens / best:12,.0f} tokens/sec")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Visual Voyager performance benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    startup = subparsers.add_parser('startup', help="cold build vs snapshot load")
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.set_defaults(func=bench_startup)
+
+    scoring = subparsers.add_parser('scoring', help="numpy vs python scoring backends")
+    scoring.add_argument('--queries', type=int, default=20)
+    scoring.add_argument('--copies', type=int, nargs='+', default=[100, 1000],
+                         help="corpus replication factors")
+    scoring.set_defaults(func=bench_scoring)
+
+    topk = subparsers.add_parser('topk', help="top-k selection and dynamic pruning")
+    topk.add_argument('--k', type=int, default=50)
+    topk.add_argument('--queries', type=int, default=20)
+    topk.add_argument('--copies', type=int, nargs='+', default=[100, 1000],
+                      help="corpus replication factors")
+    topk.set_defaults(func=bench_topk)
+
+    lookup = subparsers.add_parser('lookup', help="image detail lookups by filename")
+    lookup.add_argument('--lookups', type=int, default=200)
+    lookup.add_argument('--copies', type=int, nargs='+', default=[1, 100, 1000],
+                        help="corpus replication factors")
+    lookup.set_defaults(func=bench_lookup)
+
+    download = subparsers.add_parser('download', help="concurrent image downloads against a local host")
+    download.add_argument('--images', type=int, default=200)
+    download.add_argument('--size', type=int, default=64 * 1024, help="bytes per image")
+    download.add_argument('--latency', type=float, default=0.05, help="seconds per response")
+    download.add_argument('--fail-every', type=int, default=10)
+    download.add_argument('--rate', type=float, default=None, help="requests/sec per host")
+    download.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    download.set_defaults(func=bench_download)
+
+    journal = subparsers.add_parser('journal', help="metadata rewrites vs append-only journal")
+    journal.add_argument('--images', type=int, nargs='+', default=[1000, 5000])
+    journal.set_defaults(func=bench_journal)
+
+    analysis = subparsers.add_parser('analysis', help="batched image analysis pipeline with stand-in models")
+    analysis.add_argument('--images', type=int, default=500)
+    analysis.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    analysis.add_argument('--batch-size', type=int, default=8)
+    analysis.add_argument('--in-flight', type=int, default=64)
+    analysis.add_argument('--call-cost', type=float, default=0.02, help="model seconds per call")
+    analysis.add_argument('--image-cost', type=float, default=0.002, help="model seconds per image")
+    analysis.set_defaults(func=bench_analysis)
+
+    ingest = subparsers.add_parser('ingest', help="time-to-searchable: batch tools vs the streaming ingest pipeline")
+    ingest.add_argument('--images', type=int, default=200)
+    ingest.add_argument('--per-scroll', type=int, default=20, help="images revealed per scroll")
+    ingest.add_argument('--scroll-delay', type=float, default=0.5, help="seconds per scroll")
+    ingest.add_argument('--size', type=int, default=64, help="pixels per image side")
+    ingest.add_argument('--latency', type=float, default=0.05, help="seconds per download")
+    ingest.add_argument('--download-workers', type=int, default=8)
+    ingest.add_argument('--decode-workers', type=int, default=2)
+    ingest.add_argument('--batch-size', type=int, default=8)
+    ingest.add_argument('--batch-timeout', type=float, default=0.2)
+    ingest.add_argument('--queue-sizes', type=int, nargs='+', default=[4, 64], help="bound on every stage queue")
+    ingest.add_argument('--publish-interval', type=float, default=5)
+    ingest.add_argument('--call-cost', type=float, default=0.02, help="model seconds per call")
+    ingest.add_argument('--image-cost', type=float, default=0.002, help="model seconds per image")
+    ingest.add_argument('--corpus', type=int, default=2000, help="documents already indexed")
+    ingest.set_defaults(func=bench_ingest)
+
+    analyser_startup = subparsers.add_parser('analyser-startup', help="image_analyser import time and memory")
+    analyser_startup.add_argument('--repeat', type=int, default=5)
+    analyser_startup.set_defaults(func=bench_analyser_startup)
+
+    dedup = subparsers.add_parser('dedup', help="analysis cache hits and near-duplicate detection")
+    dedup.add_argument('--images', type=int, default=500)
+    dedup.add_argument('--batch-size', type=int, default=8)
+    dedup.add_argument('--distance', type=int, default=4, help="max dHash Hamming distance")
+    dedup.add_argument('--call-cost', type=float, default=0.02, help="model seconds per call")
+    dedup.add_argument('--image-cost', type=float, default=0.002, help="model seconds per image")
+    dedup.set_defaults(func=bench_dedup)
+
+    thumbs = subparsers.add_parser('thumbnails', help="bytes and CPU per gallery page view")
+    thumbs.add_argument('--repeat', type=int, default=5)
+    thumbs.set_defaults(func=bench_thumbnails)
+
+    analyzer = subparsers.add_parser('analyzer', help="memoized text analysis throughput")
+    analyzer.add_argument('--repeat', type=int, default=5)
+    analyzer.set_defaults(func=bench_analyzer)
+
+    shards = subparsers.add_parser('shards', help="query latency percentiles against shard count")
+    shards.add_argument('--k', type=int, default=50)
+    shards.add_argument('--queries', type=int, default=200)
+    shards.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    shards.add_argument('--copies', type=int, nargs='+', default=[100, 1000],
+                        help="corpus replication factors")
+    shards.set_defaults(func=bench_shards)
+
+    postings = subparsers.add_parser('postings', help="postings memory and decode speed by format")
+    postings.add_argument('--queries', type=int, default=100)
+    postings.add_argument('--copies', type=int, nargs='+', default=[100, 1000],
+                          help="corpus replication factors")
+    postings.add_argument('--python-max', type=int, default=100,
+                          help="largest replication factor to also build Python lists for")
+    postings.set_defaults(func=bench_postings)
+
+    vectors = subparsers.add_parser('vectors', help="semantic search latency and recall vs exact search")
+    vectors.add_argument('--k', type=int, default=50)
+    vectors.add_argument('--queries', type=int, default=50)
+    vectors.add_argument('--copies', type=int, nargs='+', default=[1, 100],
+                         help="corpus replication factors")
+    vectors.add_argument('--noise', type=float, default=0.5, help="noise added to replicated embeddings")
+    vectors.add_argument('--nlist', type=int, default=None, help="IVF lists, default sqrt(n)")
+    vectors.add_argument('--nprobe', type=int, nargs='+', default=[4, 16, 64])
+    vectors.add_argument('--repeat', type=int, default=5)
+    vectors.set_defaults(func=bench_vectors)
+
+    suggest = subparsers.add_parser('suggest', help="autocomplete latency on large vocabularies")
+    suggest.add_argument('--terms', type=int, nargs='+', default=[100_000, 1_000_000])
+    suggest.add_argument('--queries', type=int, default=500)
+    suggest.add_argument('--limit', type=int, default=8)
+    suggest.set_defaults(func=bench_suggest)
+
+    filters = subparsers.add_parser('filters', help="bitmap-filtered browsing and search vs filtering afterwards")
+    filters.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    filters.add_argument('--k', type=int, default=50)
+    filters.add_argument('--queries', type=int, default=50)
+    filters.add_argument('--repeat', type=int, default=20)
+    filters.add_argument('--seed', type=int, default=0)
+    filters.set_defaults(func=bench_filters)
+
+    api = subparsers.add_parser('api', help="JSON API, batch queries and NDJSON streaming vs the HTML page")
+    api.add_argument('--queries', type=int, default=200)
+    api.add_argument('--k', type=int, default=50)
+    api.add_argument('--copies', type=int, default=100, help="corpus replication factor")
+    api.set_defaults(func=bench_api)
+
+    workers = subparsers.add_parser('workers', help="gunicorn startup and per-worker memory, preloaded vs not")
+    workers.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    workers.add_argument('--size', type=int, default=100_000, help="synthetic corpus size")
+    workers.add_argument('--queries', type=int, default=200)
+    workers.add_argument('--reload-interval', type=float, default=1.0, help="workers' snapshot polling interval")
+    workers.add_argument('--timeout', type=float, default=300)
+    workers.add_argument('--port', type=int, default=8765)
+    workers.add_argument('--seed', type=int, default=0)
+    workers.add_argument('--workdir', help="keep generated corpora and snapshots here for reuse")
+    workers.set_defaults(func=bench_workers)
+
+    pages = subparsers.add_parser('pages', help="HTTP load test of page views, without and with response caching")
+    pages.add_argument('--size', type=int, default=20_000, help="synthetic corpus size")
+    pages.add_argument('--clients', type=int, default=16, help="concurrent browsers, each with its own cache")
+    pages.add_argument('--views', type=int, default=50, help="page views per browser")
+    pages.add_argument('--pages', type=int, default=20, help="gallery pages browsed")
+    pages.add_argument('--queries', type=int, default=50, help="distinct searches")
+    pages.add_argument('--workers', type=int, default=4)
+    pages.add_argument('--timeout', type=float, default=300)
+    pages.add_argument('--port', type=int, default=8766)
+    pages.add_argument('--seed', type=int, default=0)
+    pages.add_argument('--workdir', help="keep the generated corpus and snapshot here for reuse")
+    pages.set_defaults(func=bench_pages)
+
+    corpus = subparsers.add_parser('corpus', help="write synthetic metadata.json files")
+    corpus.add_argument('--sizes', type=int, nargs='+', default=list(synthetic_corpus.SCALES))
+    corpus.add_argument('--out-dir', default='synthetic')
+    corpus.add_argument('--seed', type=int, default=0)
+    corpus.set_defaults(func=bench_corpus)
+
+    suite = subparsers.add_parser('suite', help="build, startup, memory and latency on synthetic corpora")
+    suite.add_argument('--sizes', type=int, nargs='+', default=list(synthetic_corpus.SCALES))
+    suite.add_argument('--queries', type=int, default=200)
+    suite.add_argument('--queries-file', help="query log, JSON lines with a \"query\" field or plain text lines; "
+                                              "default samples the corpus vocabulary")
+    suite.add_argument('--k', type=int, default=50)
+    suite.add_argument('--repeat', type=int, default=3, help="timed runs per query")
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--workdir', help="keep generated corpora and snapshots here for reuse")
+    suite.add_argument('--output', default='benchmark-results.json')
+    suite.add_argument('--baseline', help="saved results to compare against; exits non-zero on a regression")
+    suite.add_argument('--tolerance', type=float, default=0.1, help="relative slowdown counted as a regression")
+    suite.set_defaults(func=bench_suite)
+
+    compare = subparsers.add_parser('compare', help="compare two saved suite results")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--tolerance', type=float, default=0.1)
+    compare.set_defaults(func=bench_compare)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -9,9 +9,49 @@ IMAGE_FOLDER =  os.path.join(os.path.dirname(__file__), "pikwizard_images")
 # METADATA_FILE = os.path.join(IMAGE_FOLDER, "\metadata.json")
 METADATA_FILE = os.path.join(os.path.dirname(__file__), "pikwizard_images/metadata.json")
 
+# Prebuilt search index snapshots (written by `python irsystem.py`)
+INDEX_DIR = os.path.join(BASE_DIR, "index_snapshot")
+
 # Flask configuration
 class Config:
     SECRET_KEY = 'your-secret-key-here'
     IMAGE_FOLDER = os.path.join(os.path.dirname(__file__), "pikwizard_images")
     THUMBNAIL_FOLDER = os.path.join(BASE_DIR, 'static', 'thumbnails')
-    PER_PAGE = 50  # Images per page
\ No newline at end of file
+    THUMBNAIL_MAX_AGE = 30 * 24 * 3600  # Seconds browsers may reuse a thumbnail before revalidating
+    PER_PAGE = 50  # Images per page
+    QUERY_CACHE_SIZE = 1024  # Cached result lists per worker, 0 disables
+    QUERY_CACHE_TTL = None  # Seconds before a cached result expires, None keeps it until evicted
+    COLLAPSE_DUPLICATES = False  # Show only the best-ranked of near-duplicate images in search results
+    EMBEDDING_MODEL = None  # sentence-transformers model for semantic search, None uses the offline hashing embedder
+    EMBEDDING_DTYPE = 'int8'  # Stored embedding precision, 'int8' or 'float16'
+    IVF_NPROBE = None  # IVF lists searched per semantic query, None scores every image exactly
+    INDEX_SHARDS = 1  # Doc id shards scored in parallel per query; more than 1 pays off on large corpora with spare cores
+    COMPRESS_POSTINGS = False  # Hold postings delta + varint coded: about a third of the memory, slower long lists
+    API_DEFAULT_K = 20  # Results per /api/search page when no k is given
+    API_MAX_K = 100  # Largest k for JSON pages; NDJSON streams are not capped
+    API_MAX_BATCH = 1000  # Most queries in one /api/search/batch request
+    PROFILE_SLOW_REQUESTS = None  # Seconds above which a request's sampled stacks are saved for flame graphs, None disables
+    PROFILE_FOLDER = os.path.join(BASE_DIR, 'profiles')  # Where slow-request stacks are written, in collapsed format
+    PROFILE_INTERVAL = 0.005  # Seconds between stack samples while profiling
+    SUGGEST_LIMIT = 8  # Autocomplete suggestions shown under the search box
+    SUGGEST_MAX_AGE = 60  # Seconds browsers may reuse an autocomplete answer
+    METADATA_FILE = METADATA_FILE  # Image metadata indexed by the app
+    INDEX_DIR = INDEX_DIR  # Where index snapshots are written and loaded from
+    INDEX_RELOAD_INTERVAL = 30  # Seconds between each worker's checks for a newer index snapshot, None disables
+    HTTP_CACHING = True  # Cache rendered pages with ETags, precompress them and serve content-hashed static assets
+    PAGE_CACHE_SIZE = 256  # Rendered pages kept per worker, keyed by route, query string and index generation
+    STATIC_MAX_AGE = 365 * 24 * 3600  # Seconds browsers keep a hashed css/js file; its name changes with its content
+
+
+def load_settings():
+    """Config as the app sees it: the defaults above, then overrides from the
+    Python file named by VISUAL_VOYAGER_SETTINGS, if set.
+
+    The offline index builders read their settings through this too, so the
+    snapshots they write are the ones the app looks for and accepts.
+    """
+    from flask import Config as FlaskConfig
+    settings = FlaskConfig(BASE_DIR)
+    settings.from_object(Config)
+    settings.from_envvar('VISUAL_VOYAGER_SETTINGS', silent=True)
+    return settings
@@ -1,9 +1,8 @@
 import os
 import time
-import json
-from urllib.parse import urlparse, unquote
 from playwright.sync_api import sync_playwright
-import requests
+from downloader import ImageDownloader, clean_filename
+from journal import MetadataJournal
 
 # Configuration
 BASE_URL = "https://pikwizard.com/s/photo/pictures/"
@@ -13,57 +12,11 @@ MAX_IMAGES = 1000
 SCROLL_DELAY = 2
 HEADLESS = False
 REQUEST_TIMEOUT = 30
+DOWNLOAD_WORKERS = 8  # Concurrent downloads
+HOST_RATE_LIMIT = 10  # Max requests per second to any one host
 
-def clean_filename(url):
-    """Create a safe filename from URL"""
-    parsed = urlparse(url)
-    filename = unquote(os.path.basename(parsed.path))
-    filename = filename.split('?')[0]
-    invalid_chars = '<>:"/\\|?*'
-    for char in invalid_chars:
-        filename = filename.replace(char, '_')
-    if '.' not in filename[-6:]:
-        filename += '.jpg'
-    return filename
-
-def download_image(img_url, referer, download_dir):
-    """Download image with retry logic"""
-    filename = clean_filename(img_url)
-    save_path = os.path.join(download_dir, filename)
-    
-    if os.path.exists(save_path):
-        return None
-    
-    for attempt in range(3):
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Referer': referer
-            }
-            
-            response = requests.get(img_url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT)
-            response.raise_for_status()
-            
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            return save_path
-        except Exception as e:
-            print(f"Attempt {attempt + 1} failed for {img_url}: {e}")
-            time.sleep((attempt + 1) * 2)
-    
-    print(f"Failed to download after 3 attempts: {img_url}")
-    return None
-
-def crawl_images():
-    """Main function to crawl and download images"""
-    if not os.path.exists(DOWNLOAD_DIR):
-        os.makedirs(DOWNLOAD_DIR)
-    
-    metadata = {}
-    alt_texts = set()
-    
+def discover_images(max_images=MAX_IMAGES):
+    """Scroll the gallery, yielding (img_url, alt_text) for each new image as soon as it appears"""
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=HEADLESS)
         context = browser.new_context(
@@ -77,12 +30,12 @@ def crawl_images():
             page.goto(BASE_URL, timeout=60000)
             time.sleep(3)
             
-            print(f"🔍 Scrolling to collect {MAX_IMAGES} images...")
+            print(f"🔍 Scrolling to collect {max_images} images...")
             collected_urls = set()
             scroll_attempts = 0
             last_height = page.evaluate("document.body.scrollHeight")
             
-            while len(collected_urls) < MAX_IMAGES and scroll_attempts < 20:
+            while len(collected_urls) < max_images and scroll_attempts < 20:
                 page.evaluate("window.scrollBy(0, window.innerHeight * 0.8)")
                 time.sleep(SCROLL_DELAY)
                 
@@ -95,49 +48,75 @@ def crawl_images():
                     scroll_attempts = 0
                     last_height = new_height
                 
-                img_elements = page.query_selector_all('img[src*="ftcdn.net"]')
-                for img in img_elements:
+                # Read everything off the page before yielding, as the consumer may take a while
+                found = []
+                for img in page.query_selector_all('img[src*="ftcdn.net"]'):
                     img_url = img.get_attribute('src')
-                    if img_url and img_url not in collected_urls:
+                    if img_url and img_url not in collected_urls and len(collected_urls) < max_images:
                         collected_urls.add(img_url)
-                        alt_text = img.get_attribute('alt') or ''
-                        alt_texts.add(alt_text)
-                        if len(collected_urls) >= MAX_IMAGES:
-                            break
+                        found.append((img_url, img.get_attribute('alt') or ''))
                 
                 print(f"📸 Total images found: {len(collected_urls)}")
-            
-            print(f"\n⬇️ Downloading {len(collected_urls)} images...")
-            for idx, img_url in enumerate(collected_urls, 1):
-                local_path = download_image(img_url, BASE_URL, DOWNLOAD_DIR)
+                yield from found
+        finally:
+            context.close()
+            browser.close()
+
+def crawl_images():
+    """Main function to crawl and download images"""
+    if not os.path.exists(DOWNLOAD_DIR):
+        os.makedirs(DOWNLOAD_DIR)
+    
+    # Entries from earlier, possibly interrupted, runs are kept and not downloaded again
+    journal = MetadataJournal(METADATA_FILE)
+    metadata = journal.load()
+    known_urls = {data.get('source_url') for data in metadata.values()}
+    
+    try:
+        alt_by_url = dict(discover_images())
+        
+        # URLs sharing a filename would be saved over each other, so only the first is fetched
+        pending = {}
+        for url in alt_by_url:
+            if url not in known_urls:
+                pending.setdefault(clean_filename(url), url)
+        pending_urls = list(pending.values())
+        print(f"\n⬇️ Downloading {len(pending_urls)} images "
+              f"({len(alt_by_url) - len(pending_urls)} already in metadata)...")
+        # The pool and its connections are released even if a download or the journal fails
+        with ImageDownloader(DOWNLOAD_DIR, workers=DOWNLOAD_WORKERS,
+                             per_host_rate=HOST_RATE_LIMIT, timeout=REQUEST_TIMEOUT) as downloader:
+            downloads = downloader.download_all(pending_urls, BASE_URL)
+            # A file already on disk but not in metadata was saved by a run that died before
+            # journaling it, so it is recorded now rather than skipped
+            for idx, (img_url, local_path, _, skipped) in enumerate(downloads, 1):
                 if not local_path:
                     continue
                 
-                alt_text = next((img.get_attribute('alt') for img in img_elements 
-                               if img.get_attribute('src') == img_url), '')
-                
-                metadata[os.path.basename(local_path)] = {
+                entry = {
                     'source_url': img_url,
                     'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
-                    'alt_text': alt_text,
+                    'alt_text': alt_by_url.get(img_url, ''),
                     'analyzed': False  # Flag to indicate if analysis has been done
                 }
+                metadata[os.path.basename(local_path)] = entry
+                journal.append(os.path.basename(local_path), entry)
                 
-                print(f"✅ Downloaded {idx}/{len(collected_urls)}: {os.path.basename(local_path)}")
-                time.sleep(0.5)
-            
-            # Save metadata
-            with open(METADATA_FILE, 'w') as f:
-                json.dump(metadata, f, indent=2)
-            
-            print(f"\n🎉 Successfully downloaded {len(metadata)} images")
-            print(f"💾 Metadata saved to {METADATA_FILE}")
-            
-        except Exception as e:
-            print(f"🔥 Error: {e}")
-        finally:
-            context.close()
-            browser.close()
+                action = "Recovered" if skipped else "Downloaded"
+                print(f"✅ {action} {idx}/{len(pending_urls)}: {os.path.basename(local_path)}")
+
+        stats = downloader.stats()
+        print(f"⚡ {stats['images_per_sec']:.1f} images/sec, "
+              f"{stats['bytes_per_sec'] / 1024:.0f} KiB/sec ({stats['failed']} failed)")
+        
+        # Fold the journal into metadata.json
+        journal.compact()
+        
+        print(f"\n🎉 Successfully downloaded {stats['downloaded']} images ({len(metadata)} in metadata)")
+        print(f"💾 Metadata saved to {METADATA_FILE}")
+        
+    except Exception as e:
+        print(f"🔥 Error: {e}")
 
 if __name__ == "__main__":
     print("🚀 Starting PikWizard Image Crawler")
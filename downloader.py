@@ -0,0 +1,184 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, unquote
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36')
+
+# Statuses worth retrying; anything else in 4xx is a permanent failure
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Images get the mode open() would give them, not the 0600 of their mkstemp staging file
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+
+def clean_filename(url):
+    """Create a safe filename from URL"""
+    parsed = urlparse(url)
+    filename = unquote(os.path.basename(parsed.path))
+    filename = filename.split('?')[0]
+    invalid_chars = '<>:"/\\|?*'
+    for char in invalid_chars:
+        filename = filename.replace(char, '_')
+    if '.' not in filename[-6:]:
+        filename += '.jpg'
+    return filename
+
+
+class HostRateLimiter:
+    """Spaces requests to the same host at least 1 / rate seconds apart, across threads."""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        """Block until the next request slot for host."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ImageDownloader:
+    """Concurrent image downloader sharing one pooled HTTP session.
+
+    Downloads run on a thread pool, each host is rate limited on its own,
+    failed requests are retried with jittered exponential backoff, and bodies
+    are streamed to a uniquely named .part file that is renamed into place
+    once complete, so an interrupted run never leaves a truncated image
+    behind and concurrent downloads of one name never mix their bytes.
+    """
+
+    def __init__(self, download_dir, workers=8, per_host_rate=None, retries=3, backoff=0.5,
+                 timeout=30, chunk_size=65536):
+        self.download_dir = download_dir
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.rate_limiter = HostRateLimiter(per_host_rate)
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self.downloaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Release pooled connections."""
+        self.session.close()
+
+    def download(self, img_url, referer=None):
+        """Download one image. Returns (save_path, bytes, skipped), or (None, 0, False) if it failed.
+
+        A file already on disk is not fetched again; its path comes back with
+        skipped set, so callers can still record it if an earlier run was
+        interrupted before it could.
+        """
+        save_path = os.path.join(self.download_dir, clean_filename(img_url))
+        if os.path.exists(save_path):
+            self._count(skipped=1)
+            return save_path, 0, True
+
+        host = urlparse(img_url).netloc
+        headers = {'Referer': referer} if referer else None
+        for attempt in range(self.retries):
+            self.rate_limiter.wait(host)
+            try:
+                size = self._fetch(img_url, headers, save_path)
+                self._count(downloaded=1, size=size)
+                return save_path, size, False
+            except requests.HTTPError as e:
+                if e.response.status_code not in RETRY_STATUSES:
+                    print(f"Giving up on {img_url}: {e}")
+                    break
+                print(f"Attempt {attempt + 1} failed for {img_url}: {e}")
+            except (requests.RequestException, OSError) as e:
+                print(f"Attempt {attempt + 1} failed for {img_url}: {e}")
+            if attempt + 1 < self.retries:
+                # Full jitter keeps retrying workers from hitting the host in lockstep
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+        else:
+            print(f"Failed to download after {self.retries} attempts: {img_url}")
+
+        self._count(failed=1)
+        return None, 0, False
+
+    def _fetch(self, img_url, headers, save_path):
+        fd, partial_path = tempfile.mkstemp(prefix=f".{os.path.basename(save_path)}.", suffix='.part',
+                                            dir=self.download_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f, \
+                    self.session.get(img_url, headers=headers, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                size = 0
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    size += len(chunk)
+            os.chmod(partial_path, FILE_MODE)
+            os.replace(partial_path, save_path)
+            return size
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+
+    def _count(self, downloaded=0, skipped=0, failed=0, size=0):
+        with self._lock:
+            self.downloaded += downloaded
+            self.skipped += skipped
+            self.failed += failed
+            self.bytes += size
+
+    def download_all(self, img_urls, referer=None):
+        """Download urls concurrently, yielding (img_url, save_path, bytes, skipped) as each finishes."""
+        os.makedirs(self.download_dir, exist_ok=True)
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self.download, url, referer): url for url in img_urls}
+                for future in as_completed(futures):
+                    yield (futures[future],) + future.result()
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def stats(self):
+        """Counters and throughput as a plain dict."""
+        with self._lock:
+            return {
+                'downloaded': self.downloaded,
+                'skipped': self.skipped,
+                'failed': self.failed,
+                'bytes': self.bytes,
+                'seconds': self.elapsed,
+                'images_per_sec': self.downloaded / self.elapsed if self.elapsed else 0.0,
+                'bytes_per_sec': self.bytes / self.elapsed if self.elapsed else 0.0,
+            }
@@ -0,0 +1,469 @@
+import calendar
+import json
+import os
+from collections.abc import Sequence
+from datetime import datetime
+import numpy as np
+
+# Containers holding more values than this store them as a 2**16-bit bitmap instead of a sorted array
+ARRAY_LIMIT = 4096
+CONTAINER_BITS = 1 << 16
+
+# Doc ids of images with no (parseable) crawl timestamp sort before every real one
+NO_TIMESTAMP = np.iinfo(np.int64).min
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATE_FORMAT = '%Y-%m-%d'
+
+BITMAP_ARRAYS = ('bitmap_offsets', 'keys', 'cardinalities', 'data_offsets', 'data')
+COLUMNS = ('timestamps', 'models', 'detection_offsets', 'detection_classes', 'detection_confidences')
+DERIVED = ('class_offsets', 'class_docs', 'class_confidences', 'time_order', 'sorted_times')
+
+
+def _bitmap_words(lows):
+    """Container bitmap (little-endian uint16 words) with the given low halves set."""
+    bits = np.zeros(CONTAINER_BITS, dtype=bool)
+    bits[lows] = True
+    return np.packbits(bits, bitorder='little').view('<u2')
+
+
+def _bitmap_lows(words):
+    """Ascending low halves set in a container bitmap."""
+    return np.flatnonzero(np.unpackbits(np.asarray(words, dtype='<u2').view(np.uint8), bitorder='little'))
+
+
+def _container(lows):
+    """(cardinality, payload) for ascending low halves, in whichever representation is smaller."""
+    if len(lows) > ARRAY_LIMIT:
+        return len(lows), _bitmap_words(lows)
+    return len(lows), np.asarray(lows, dtype=np.uint16)
+
+
+def _and(a, b):
+    (card_a, payload_a), (card_b, payload_b) = a, b
+    if card_a > ARRAY_LIMIT and card_b > ARRAY_LIMIT:
+        words = payload_a & payload_b
+        return _container(_bitmap_lows(words)) if np.count_nonzero(words) else (0, None)
+    if card_a > ARRAY_LIMIT:
+        (card_a, payload_a), (card_b, payload_b) = b, a
+    if card_b > ARRAY_LIMIT:
+        # Test each array value's bit in the other container's bitmap
+        lows = payload_a.astype(np.int64)
+        return _container(lows[(payload_b[lows >> 4] >> (lows & 15)) & 1 == 1])
+    return _container(np.intersect1d(payload_a, payload_b, assume_unique=True))
+
+
+def _or(a, b):
+    (card_a, payload_a), (card_b, payload_b) = a, b
+    if card_a > ARRAY_LIMIT and card_b > ARRAY_LIMIT:
+        words = payload_a | payload_b
+        return int(np.unpackbits(words.view(np.uint8)).sum()), words
+    if card_a > ARRAY_LIMIT or card_b > ARRAY_LIMIT:
+        words, lows = (payload_a, payload_b) if card_a > ARRAY_LIMIT else (payload_b, payload_a)
+        words = words.copy()
+        lows = lows.astype(np.int64)
+        np.bitwise_or.at(words, lows >> 4, (1 << (lows & 15)).astype('<u2'))
+        return int(np.unpackbits(words.view(np.uint8)).sum()), words
+    return _container(np.union1d(payload_a, payload_b))
+
+
+class Bitmap:
+    """Set of doc ids as roaring-style containers.
+
+    Doc ids are split by their high 16 bits into containers. A container
+    holds its low halves as a sorted uint16 array while it has at most
+    ARRAY_LIMIT of them, and as a 65536-bit bitmap once it has more, so
+    sparse facets cost two bytes per image and dense ones one bit. Every
+    payload lives in one flat uint16 `data` array with container offsets,
+    which snapshots memory-map. Intersections and unions work container
+    by container and never expand to one entry per doc id.
+    """
+
+    def __init__(self, keys, cardinalities, offsets, data):
+        self.keys = keys
+        self.cardinalities = cardinalities
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_sorted(cls, doc_ids):
+        """Bitmap of ascending, duplicate-free doc ids."""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        highs = doc_ids >> 16
+        keys, starts = np.unique(highs, return_index=True)
+        bounds = np.append(starts, len(doc_ids)).tolist()
+        return cls.from_containers(keys.tolist(), [_container(doc_ids[start:end] & 0xffff)
+                                                   for start, end in zip(bounds, bounds[1:])])
+
+    @classmethod
+    def from_containers(cls, keys, containers):
+        """Bitmap from ascending keys and their (cardinality, payload) containers; empty ones are dropped."""
+        kept = [(key, card, payload) for key, (card, payload) in zip(keys, containers) if card]
+        offsets = np.zeros(len(kept) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(payload) for _, _, payload in kept])
+        return cls(np.array([key for key, _, _ in kept], dtype=np.int64),
+                   np.array([card for _, card, _ in kept], dtype=np.int64), offsets,
+                   np.concatenate([payload for _, _, payload in kept]) if kept else np.zeros(0, dtype=np.uint16))
+
+    def __len__(self):
+        return int(np.sum(self.cardinalities))
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ('keys', 'cardinalities', 'offsets', 'data'))
+
+    def containers(self):
+        """{key: (cardinality, payload)} of every container."""
+        offsets = self.offsets.tolist()
+        return {key: (card, self.data[start:end]) for key, card, start, end in
+                zip(self.keys.tolist(), self.cardinalities.tolist(), offsets, offsets[1:])}
+
+    def to_array(self):
+        """Ascending doc ids."""
+        parts = []
+        for key, (card, payload) in self.containers().items():
+            lows = _bitmap_lows(payload) if card > ARRAY_LIMIT else payload.astype(np.int64)
+            parts.append((key << 16) + lows)
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    def mask(self, size):
+        """Boolean array of `size` doc ids, true for members."""
+        mask = np.zeros(size, dtype=bool)
+        mask[self.to_array()] = True
+        return mask
+
+    def __and__(self, other):
+        mine, theirs = self.containers(), other.containers()
+        keys = sorted(mine.keys() & theirs.keys())
+        return Bitmap.from_containers(keys, [_and(mine[key], theirs[key]) for key in keys])
+
+    def __or__(self, other):
+        mine, theirs = self.containers(), other.containers()
+        keys = sorted(mine.keys() | theirs.keys())
+        return Bitmap.from_containers(keys, [_or(mine[key], theirs[key]) if key in mine and key in theirs
+                                             else mine.get(key) or theirs[key] for key in keys])
+
+    def __eq__(self, other):
+        return isinstance(other, Bitmap) and np.array_equal(self.to_array(), other.to_array())
+
+
+class BitmapSet(Sequence):
+    """Many bitmaps in shared flat arrays, for snapshots.
+
+    Bitmap i owns containers bitmap_offsets[i]:bitmap_offsets[i + 1], and
+    indexing returns it as a Bitmap over slices of the shared arrays.
+    """
+
+    def __init__(self, bitmap_offsets, keys, cardinalities, data_offsets, data):
+        self.bitmap_offsets = bitmap_offsets
+        self.keys = keys
+        self.cardinalities = cardinalities
+        self.data_offsets = data_offsets
+        self.data = data
+
+    @classmethod
+    def build(cls, bitmaps):
+        """Pack an iterable of Bitmaps."""
+        bitmaps = list(bitmaps)
+        bitmap_offsets = np.zeros(len(bitmaps) + 1, dtype=np.int64)
+        bitmap_offsets[1:] = np.cumsum([len(bitmap.keys) for bitmap in bitmaps])
+        data_offsets = np.zeros(int(bitmap_offsets[-1]) + 1, dtype=np.int64)
+        data_offsets[1:] = np.cumsum(np.concatenate([np.diff(bitmap.offsets) for bitmap in bitmaps])
+                                     if bitmaps else [])
+        return cls(bitmap_offsets,
+                   np.concatenate([bitmap.keys for bitmap in bitmaps] or [np.zeros(0, dtype=np.int64)]),
+                   np.concatenate([bitmap.cardinalities for bitmap in bitmaps] or [np.zeros(0, dtype=np.int64)]),
+                   data_offsets,
+                   np.concatenate([bitmap.data for bitmap in bitmaps] or [np.zeros(0, dtype=np.uint16)]))
+
+    @classmethod
+    def load(cls, directory, name, mmap_mode='r'):
+        """Open arrays written by save() under the same name."""
+        return cls(*(np.load(os.path.join(directory, f"bitmaps_{name}_{array}.npy"), mmap_mode=mmap_mode)
+                     for array in BITMAP_ARRAYS))
+
+    def save(self, directory, name):
+        """Write every array as a bitmaps_<name>_*.npy file."""
+        for array in BITMAP_ARRAYS:
+            np.save(os.path.join(directory, f"bitmaps_{name}_{array}.npy"), getattr(self, array))
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, array).nbytes for array in BITMAP_ARRAYS)
+
+    def __len__(self):
+        return len(self.bitmap_offsets) - 1
+
+    def __getitem__(self, i):
+        first, last = int(self.bitmap_offsets[i]), int(self.bitmap_offsets[i + 1])
+        start, end = int(self.data_offsets[first]), int(self.data_offsets[last])
+        return Bitmap(self.keys[first:last], self.cardinalities[first:last],
+                      self.data_offsets[first:last + 1] - start, self.data[start:end])
+
+
+def parse_time(text, end=False):
+    """Seconds since the epoch of a metadata timestamp or a bare date, whose end is its last second
+    with end=True. Timestamps are compared as written, so no time zone is applied."""
+    try:
+        return calendar.timegm(datetime.strptime(text, TIMESTAMP_FORMAT).timetuple())
+    except ValueError:
+        day = calendar.timegm(datetime.strptime(text, DATE_FORMAT).timetuple())
+        return day + 24 * 3600 - 1 if end else day
+
+
+def facet_record(data):
+    """Filterable fields of a metadata.json entry: (timestamp, model, {object class: best confidence})."""
+    try:
+        timestamp = parse_time(data['timestamp']) if data.get('timestamp') else None
+    except ValueError:
+        timestamp = None
+    analysis = data.get('analysis') or {}
+    objects = {}
+    for detection in analysis.get('detections') or ():
+        name, confidence = detection['class'], float(detection['confidence'])
+        objects[name] = max(objects.get(name, confidence), confidence)
+    return timestamp, analysis.get('model') or '', objects
+
+
+class FacetFilter:
+    """Restriction of results to images with given detected objects, captioning model and crawl time.
+
+    Several objects or models match images with any of them, and the
+    fields given must all match. min_conf applies to the objects given,
+    or to any detection when no object is. since and until are inclusive
+    bounds in seconds since the epoch (see parse_time).
+    """
+
+    def __init__(self, objects=(), min_conf=None, models=(), since=None, until=None):
+        self.objects = tuple(sorted(set(objects)))
+        self.min_conf = min_conf
+        self.models = tuple(sorted(set(models)))
+        self.since = since
+        self.until = until
+
+    @property
+    def key(self):
+        """Hashable form, for result cache keys."""
+        return self.objects, self.min_conf, self.models, self.since, self.until
+
+    def __bool__(self):
+        return any(value not in (None, ()) for value in self.key)
+
+    def __eq__(self, other):
+        return isinstance(other, FacetFilter) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"FacetFilter{self.key!r}"
+
+
+class FacetIndex:
+    """Detected objects, captioning model and crawl time of every image, as bitmaps for filtering.
+
+    The per-document columns are the source of truth: a timestamp and a
+    model id per image, and each image's detected classes with their best
+    confidence as a CSR list. Built from them are one Bitmap per object
+    class and per model, the class lists inverted (doc ids and
+    confidences per class, for min_conf), and doc ids in timestamp order
+    for date ranges. select() turns a FacetFilter into the Bitmap of
+    matching doc ids, which search intersects before scoring.
+    """
+
+    def __init__(self, class_names, model_names, timestamps, models, detection_offsets, detection_classes,
+                 detection_confidences, class_offsets=None, class_docs=None, class_confidences=None,
+                 time_order=None, sorted_times=None, object_bitmaps=None, model_bitmaps=None):
+        self.class_names = class_names
+        self.model_names = model_names
+        self.class_ids = {name: class_id for class_id, name in enumerate(class_names)}
+        self.model_ids = {name: model_id for model_id, name in enumerate(model_names)}
+        self.timestamps = timestamps
+        self.models = models
+        self.detection_offsets = detection_offsets
+        self.detection_classes = detection_classes
+        self.detection_confidences = detection_confidences
+
+        if class_offsets is None:
+            # Entries of each class together, in doc id order within a class
+            order = np.argsort(detection_classes, kind='stable')
+            doc_of_entry = np.repeat(np.arange(len(timestamps), dtype=np.int32), np.diff(detection_offsets))
+            class_offsets = np.zeros(len(class_names) + 1, dtype=np.int64)
+            class_offsets[1:] = np.cumsum(np.bincount(detection_classes, minlength=len(class_names)))
+            class_docs, class_confidences = doc_of_entry[order], detection_confidences[order]
+        self.class_offsets = class_offsets
+        self.class_docs = class_docs
+        self.class_confidences = class_confidences
+
+        if time_order is None:
+            time_order = np.argsort(timestamps, kind='stable').astype(np.int32)
+            sorted_times = np.asarray(timestamps)[time_order]
+        self.time_order = time_order
+        self.sorted_times = sorted_times
+
+        if object_bitmaps is None:
+            object_bitmaps = BitmapSet.build(Bitmap.from_sorted(self.class_postings(class_id)[0])
+                                             for class_id in range(len(class_names)))
+            model_bitmaps = BitmapSet.build(Bitmap.from_sorted(np.flatnonzero(np.asarray(models) == model_id))
+                                            for model_id in range(len(model_names)))
+        self.object_bitmaps = object_bitmaps
+        self.model_bitmaps = model_bitmaps
+
+    @classmethod
+    def build(cls, entries):
+        """Index metadata.json entries, given in doc id order."""
+        return cls.from_records([facet_record(data) for data in entries])
+
+    @classmethod
+    def from_records(cls, records):
+        """Index facet_record() tuples, given in doc id order."""
+        class_names = sorted({name for _, _, objects in records for name in objects})
+        model_names = sorted({model for _, model, _ in records if model})
+        class_ids = {name: class_id for class_id, name in enumerate(class_names)}
+        model_ids = {name: model_id for model_id, name in enumerate(model_names)}
+        detections = [sorted((class_ids[name], confidence) for name, confidence in objects.items())
+                      for _, _, objects in records]
+        detection_offsets = np.zeros(len(records) + 1, dtype=np.int64)
+        detection_offsets[1:] = np.cumsum([len(entries) for entries in detections])
+        return cls(class_names, model_names,
+                   np.array([NO_TIMESTAMP if timestamp is None else timestamp for timestamp, _, _ in records],
+                            dtype=np.int64),
+                   np.array([model_ids.get(model, -1) for _, model, _ in records], dtype=np.int32),
+                   detection_offsets,
+                   np.array([class_id for entries in detections for class_id, _ in entries], dtype=np.int32),
+                   np.array([confidence for entries in detections for _, confidence in entries], dtype=np.float64))
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Open arrays written by save()."""
+        with open(os.path.join(directory, 'facet_names.json'), 'r') as f:
+            names = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f"facet_{name}.npy"), mmap_mode=mmap_mode)
+                  for name in COLUMNS + DERIVED}
+        return cls(names['objects'], names['models'], object_bitmaps=BitmapSet.load(directory, 'objects', mmap_mode),
+                   model_bitmaps=BitmapSet.load(directory, 'models', mmap_mode), **arrays)
+
+    def save(self, directory):
+        """Write the columns, the derived arrays and both bitmap sets as facet_*/bitmaps_*.npy files."""
+        for name in COLUMNS + DERIVED:
+            np.save(os.path.join(directory, f"facet_{name}.npy"), getattr(self, name))
+        self.object_bitmaps.save(directory, 'objects')
+        self.model_bitmaps.save(directory, 'models')
+        with open(os.path.join(directory, 'facet_names.json'), 'w') as f:
+            json.dump({'objects': self.class_names, 'models': self.model_names}, f)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def record(self, doc_id):
+        """facet_record() of one indexed image."""
+        timestamp = int(self.timestamps[doc_id])
+        model_id = int(self.models[doc_id])
+        start, end = self.detection_offsets[doc_id], self.detection_offsets[doc_id + 1]
+        return (None if timestamp == NO_TIMESTAMP else timestamp, self.model_names[model_id] if model_id >= 0 else '',
+                {self.class_names[class_id]: confidence for class_id, confidence in
+                 zip(self.detection_classes[start:end].tolist(), self.detection_confidences[start:end].tolist())})
+
+    def take(self, doc_ids):
+        """New index holding the given documents, in the given order."""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        starts = self.detection_offsets[doc_ids]
+        lengths = self.detection_offsets[doc_ids + 1] - starts
+        offsets = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        # Entry i of the output comes from its document's start plus its position within the document
+        entries = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return FacetIndex(self.class_names, self.model_names, np.asarray(self.timestamps)[doc_ids],
+                          np.asarray(self.models)[doc_ids], offsets, np.asarray(self.detection_classes)[entries],
+                          np.asarray(self.detection_confidences)[entries])
+
+    def concat(self, other):
+        """New index with other's documents appended after this one's."""
+        class_names = sorted(set(self.class_names).union(other.class_names))
+        model_names = sorted(set(self.model_names).union(other.model_names))
+        # Merged names stay sorted, so remapped class ids keep each document's entries in order
+        class_ids = {name: class_id for class_id, name in enumerate(class_names)}
+        model_ids = {name: model_id for model_id, name in enumerate(model_names)}
+
+        def remap(index):
+            classes = np.array([class_ids[name] for name in index.class_names], dtype=np.int32)
+            # Index -1, a missing model, maps through the appended -1
+            models = np.array([model_ids[name] for name in index.model_names] + [-1], dtype=np.int32)
+            return classes[index.detection_classes], models[index.models]
+
+        classes, models = remap(self)
+        other_classes, other_models = remap(other)
+        return FacetIndex(class_names, model_names, np.concatenate([self.timestamps, other.timestamps]),
+                          np.concatenate([models, other_models]),
+                          np.concatenate([self.detection_offsets, other.detection_offsets[1:] +
+                                          self.detection_offsets[-1]]),
+                          np.concatenate([classes, other_classes]),
+                          np.concatenate([self.detection_confidences, other.detection_confidences]))
+
+    def class_postings(self, class_id):
+        """Ascending doc ids detected with one class and their best confidence."""
+        start, end = self.class_offsets[class_id], self.class_offsets[class_id + 1]
+        return self.class_docs[start:end], self.class_confidences[start:end]
+
+    def object_bitmap(self, name, min_conf=None):
+        """Images with the object detected, at min_conf or above if given."""
+        class_id = self.class_ids.get(name)
+        if class_id is None:
+            return Bitmap.from_sorted([])
+        if min_conf is None:
+            return self.object_bitmaps[class_id]
+        docs, confidences = self.class_postings(class_id)
+        return Bitmap.from_sorted(docs[confidences >= min_conf])
+
+    def confident_bitmap(self, min_conf):
+        """Images with any detection at min_conf or above."""
+        entries = np.flatnonzero(self.detection_confidences >= min_conf)
+        doc_of_entry = np.searchsorted(self.detection_offsets, entries, side='right') - 1
+        return Bitmap.from_sorted(np.unique(doc_of_entry))
+
+    def time_bitmap(self, since=None, until=None):
+        """Images crawled between since and until, both inclusive and either open."""
+        # Images without a timestamp sort first and never match a date range
+        lo = np.searchsorted(self.sorted_times, NO_TIMESTAMP + 1 if since is None else since, side='left')
+        hi = np.searchsorted(self.sorted_times, until, side='right') if until is not None else len(self.sorted_times)
+        return Bitmap.from_sorted(np.sort(self.time_order[lo:hi]))
+
+    def select(self, facet_filter):
+        """Bitmap of the doc ids matching a FacetFilter."""
+        parts = []
+        if facet_filter.objects:
+            parts.append(self._union([self.object_bitmap(name, facet_filter.min_conf)
+                                      for name in facet_filter.objects]))
+        elif facet_filter.min_conf is not None:
+            parts.append(self.confident_bitmap(facet_filter.min_conf))
+        if facet_filter.models:
+            parts.append(self._union([self.model_bitmaps[self.model_ids[name]] if name in self.model_ids
+                                      else Bitmap.from_sorted([]) for name in facet_filter.models]))
+        if facet_filter.since is not None or facet_filter.until is not None:
+            parts.append(self.time_bitmap(facet_filter.since, facet_filter.until))
+        if not parts:
+            return Bitmap.from_sorted(np.arange(len(self)))
+        # Smallest first, so each intersection only visits containers the result can still have
+        parts.sort(key=len)
+        selection = parts[0]
+        for part in parts[1:]:
+            if not len(selection):
+                break
+            selection = selection & part
+        return selection
+
+    @staticmethod
+    def _union(bitmaps):
+        selection = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            selection = selection | bitmap
+        return selection
+
+    def counts(self, within=None):
+        """{'objects': {class: images}, 'models': {model: images}}, counting only `within` a Bitmap if given."""
+        def count(bitmap):
+            return len(bitmap if within is None else bitmap & within)
+        return {'objects': {name: count(self.object_bitmaps[class_id])
+                            for class_id, name in enumerate(self.class_names)},
+                'models': {name: count(self.model_bitmaps[model_id])
+                           for model_id, name in enumerate(self.model_names)}}
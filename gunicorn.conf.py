@@ -0,0 +1,21 @@
+import gc
+
+# Build or memory-map the index once in the master, before forking, so every worker shares its pages
+preload_app = True
+
+
+def when_ready(server):
+    """Warm the preloaded index, then keep the garbage collector from touching the objects workers inherit."""
+    if not server.cfg.preload_app:
+        return
+    from app import search_engine
+    search_engine.index.warm()
+    # Every collection writes to the headers of the objects it visits, which copies their pages
+    # into each worker; frozen objects are never visited again
+    gc.collect()
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    from app import start_worker
+    start_worker()
@@ -0,0 +1,109 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from flask import Response
+
+# Brotli is optional; without it responses are precompressed with gzip only
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content codings in order of preference when a client accepts several equally
+ENCODINGS = ('br', 'gzip')
+
+
+def compress(body, gzip_level=6, brotli_quality=5):
+    """{content-coding: bytes} of body for every coding available here."""
+    # mtime=0 keeps the gzip bytes, and so their ETag, the same in every worker
+    encoded = {'gzip': gzip.compress(body, gzip_level, mtime=0)}
+    if brotli is not None:
+        encoded['br'] = brotli.compress(body, quality=brotli_quality)
+    return encoded
+
+
+class EncodedBody:
+    """A response body with a content-derived ETag and precompressed copies.
+
+    Built once and served many times: respond() picks the coding from the
+    request's Accept-Encoding and answers 304 when the client already has
+    that representation. Each coding gets its own strong ETag, derived
+    from the content alone so every worker hands out the same ones.
+    `meta` carries whatever else the caller wants kept with the body.
+    """
+
+    def __init__(self, body, mimetype, gzip_level=6, brotli_quality=5, meta=None):
+        self.body = body
+        self.mimetype = mimetype
+        self.meta = meta
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.encoded = compress(body, gzip_level, brotli_quality)
+
+    def respond(self, request):
+        """Response in the best coding the request accepts, or 304 if its If-None-Match has it."""
+        coding = request.accept_encodings.best_match([coding for coding in ENCODINGS if coding in self.encoded])
+        body, etag = (self.encoded[coding], f"{self.etag}-{coding}") if coding else (self.body, self.etag)
+        response = Response(body, mimetype=self.mimetype)
+        if coding:
+            response.content_encoding = coding
+        response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+
+class StaticAssets:
+    """Content-hashed names for the files in some static directories.
+
+    css/style.css is published as css/style.<hash>.css, and the hash
+    changes whenever the file does, so browsers may cache every name
+    forever. Files are read, hashed and compressed once, and again only
+    when their mtime or size changes.
+    """
+
+    def __init__(self, folder, directories=('css', 'js')):
+        self.folder = folder
+        self.directories = directories
+        self._lock = threading.Lock()
+        # filename -> (stat key, hashed name, EncodedBody); hashed name -> filename
+        self._assets = {}
+        self._originals = {}
+        for directory in directories:
+            for name in sorted(os.listdir(os.path.join(folder, directory))):
+                self.url(f"{directory}/{name}")
+
+    def url(self, filename):
+        """Hashed name of a static file, or filename itself if it is not one of ours."""
+        asset = self._asset(filename)
+        return asset[1] if asset else filename
+
+    def get(self, hashed):
+        """EncodedBody of the file published under a hashed name, or None."""
+        filename = self._originals.get(hashed)
+        asset = self._asset(filename) if filename else None
+        return asset[2] if asset and asset[1] == hashed else None
+
+    def _asset(self, filename):
+        directory, _, name = filename.partition('/')
+        if directory not in self.directories or not name or '/' in name:
+            return None
+        path = os.path.join(self.folder, directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        asset = self._assets.get(filename)
+        if asset is None or asset[0] != key:
+            with open(path, 'rb') as f:
+                data = f.read()
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            # Assets compress once per change, so spend the CPU on the smallest bodies
+            body = EncodedBody(data, mimetype, gzip_level=9, brotli_quality=11)
+            root, ext = os.path.splitext(filename)
+            asset = (key, f"{root}.{body.etag[:12]}{ext}", body)
+            with self._lock:
+                self._assets[filename] = asset
+                self._originals[asset[1]] = filename
+        return asset
@@ -1,94 +1,86 @@
 import os
-import json
 import time
-import re
+from functools import lru_cache
 import numpy as np
 from PIL import Image
-import torch
-from ultralytics import YOLO
-from transformers import VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer
+from journal import MetadataJournal
+from analysis_pipeline import (AnalysisPipeline, clean_caption, generate_object_caption, hash_images,
+                               is_gibberish, needs_detection)
+from image_hashes import NearDuplicateIndex
 
 # Configuration
 DOWNLOAD_DIR = "pikwizard_images"
 METADATA_FILE = os.path.join(DOWNLOAD_DIR, "metadata.json")
+DECODE_WORKERS = os.cpu_count()  # Processes decoding images ahead of the models
+CAPTION_BATCH_SIZE = 8  # Images per captioner/detector call
+MAX_IN_FLIGHT = 64  # Decoded images allowed to queue up ahead of the captioner
 
-# Initialize models
-device = "cuda" if torch.cuda.is_available() else "cpu"
-
-# Image captioning model
-caption_model = VisionEncoderDecoderModel.from_pretrained("nlpconnect/vit-gpt2-image-captioning").to(device)
-caption_feature_extractor = ViTImageProcessor.from_pretrained("nlpconnect/vit-gpt2-image-captioning")
-caption_tokenizer = AutoTokenizer.from_pretrained("nlpconnect/vit-gpt2-image-captioning")
-
-# Object detection model (fallback)
-det_model = YOLO('yolov8n.pt')
-
-def is_gibberish(text):
-    """Check if generated caption is nonsensical"""
-    text = text.lower()
-    if len(text.split()) > 20:  # Too long
-        return True
-    if len(set(text.split())) < 3:  # Too repetitive
-        return True
-    if re.search(r'\b(\w+)\b.*\b\1\b.*\b\1\b', text):  # Repeated words
-        return True
-    return False
-
-def generate_object_caption(detections):
-    """Generate caption from detected objects"""
-    if not detections:
-        return "An image"
-    
-    objects = [d['class'] for d in detections if d['confidence'] > 0.3]
-    if not objects:
-        return "An image"
-    
-    objects = list(set(objects))  # Remove duplicates
-    if len(objects) == 1:
-        return f"An image of {objects[0]}"
-    elif len(objects) == 2:
-        return f"An image of {objects[0]} and {objects[1]}"
-    else:
-        return f"An image containing {', '.join(objects[:-1])}, and {objects[-1]}"
+CAPTION_MODEL = "nlpconnect/vit-gpt2-image-captioning"
+DETECTION_WEIGHTS = 'yolov8n.pt'
+
+# Models and their heavy libraries (torch, transformers, ultralytics) load on first use,
+# so importing this module or finding nothing to analyze stays cheap
+@lru_cache(maxsize=None)
+def caption_models():
+    """Image captioning model, feature extractor, tokenizer and device"""
+    import torch
+    from transformers import VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    caption_model = VisionEncoderDecoderModel.from_pretrained(CAPTION_MODEL).to(device)
+    caption_feature_extractor = ViTImageProcessor.from_pretrained(CAPTION_MODEL)
+    caption_tokenizer = AutoTokenizer.from_pretrained(CAPTION_MODEL)
+    return caption_model, caption_feature_extractor, caption_tokenizer, device
+
+@lru_cache(maxsize=None)
+def detection_model():
+    """Object detection model (fallback)"""
+    from ultralytics import YOLO
+    return YOLO(DETECTION_WEIGHTS)
+
+def warm_up():
+    """Load both models now rather than on the first image"""
+    caption_models()
+    detection_model()
+
+# Decoding settings shared by single-image and batched captioning
+CAPTION_GENERATION = dict(max_length=40, num_beams=3, temperature=0.9, top_p=0.9,
+                          repetition_penalty=2.0, early_stopping=True)
+
+def detections_from(result):
+    """Detection dicts from one YOLO result"""
+    names = detection_model().names
+    return [{
+        'class': names[int(cls_id)],
+        'confidence': float(conf),
+        'bbox': [float(x) for x in box]
+    } for box, conf, cls_id in zip(result.boxes.xyxy, result.boxes.conf, result.boxes.cls)]
 
 def generate_detection(pil_img):
     """Generate object detections with bounding boxes"""
     img = np.array(pil_img)
-    results = det_model(img)
+    results = detection_model()(img)
     detections = []
     for result in results:
-        for box, conf, cls_id in zip(result.boxes.xyxy, result.boxes.conf, result.boxes.cls):
-            detections.append({
-                'class': det_model.names[int(cls_id)],
-                'confidence': float(conf),
-                'bbox': [float(x) for x in box]
-            })
+        detections.extend(detections_from(result))
     return detections
 
 def generate_caption(pil_img):
     """Generate caption with fallback to object detection"""
     try:
         # First try neural caption
+        caption_model, caption_feature_extractor, caption_tokenizer, device = caption_models()
         pixel_values = caption_feature_extractor(
             images=pil_img, 
             return_tensors="pt"
         ).pixel_values.to(device)
         
-        output_ids = caption_model.generate(
-            pixel_values,
-            max_length=40,
-            num_beams=3,
-            temperature=0.9,
-            top_p=0.9,
-            repetition_penalty=2.0,
-            early_stopping=True
-        )
+        output_ids = caption_model.generate(pixel_values, **CAPTION_GENERATION)
         
         caption = caption_tokenizer.decode(output_ids[0], skip_special_tokens=True)
-        caption = re.sub(r'[^a-zA-Z0-9,.!?\'" ]+', '', caption).capitalize()
+        caption = clean_caption(caption)
         
         # If caption is generic or gibberish, use object detection
-        if caption.lower() == "an image" or is_gibberish(caption):
+        if needs_detection(caption):
             detections = generate_detection(pil_img)
             caption = generate_object_caption(detections)
             return caption, detections
@@ -116,56 +108,112 @@ def analyze_image(image_path):
     except Exception as e:
         return {'error': str(e)}
 
-def analyze_images():
+class VitGpt2Captioner:
+    """Batched ViT-GPT2 captioning for AnalysisPipeline"""
+    name = 'vit-gpt2-image-captioning'
+
+    def caption_batch(self, images):
+        caption_model, caption_feature_extractor, caption_tokenizer, device = caption_models()
+        pixel_values = caption_feature_extractor(images=images, return_tensors="pt").pixel_values.to(device)
+        output_ids = caption_model.generate(pixel_values, **CAPTION_GENERATION)
+        return caption_tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+
+class YoloDetector:
+    """Batched YOLO detection for AnalysisPipeline"""
+    name = 'YOLO'
+
+    def detect_batch(self, images):
+        results = detection_model()([np.array(img) for img in images])
+        return [detections_from(result) for result in results]
+
+def flag_near_duplicate(near_duplicates, filename, update):
+    """Mark update as a near-duplicate of an earlier image, then index its dHash"""
+    duplicate_of = near_duplicates.find(update['dhash'])
+    if duplicate_of is not None:
+        update['near_duplicate_of'] = duplicate_of
+    near_duplicates.add(filename, update['dhash'])
+    return update
+
+def near_duplicate_index(metadata):
+    """dHash index of every hashed image in metadata"""
+    near_duplicates = NearDuplicateIndex()
+    for filename, data in metadata.items():
+        if data.get('dhash'):
+            near_duplicates.add(filename, data['dhash'])
+    return near_duplicates
+
+def analysis_cache(metadata):
+    """Content hash -> analysis, so exact copies of analyzed images skip the models"""
+    return {data['content_sha256']: data['analysis'] for data in metadata.values()
+            if data.get('analysis') and 'content_sha256' in data}
+
+def analyze_images(captioner=None, detector=None, preload=False):
     """Analyze all downloaded images"""
-    if not os.path.exists(METADATA_FILE):
+    # Results already journaled by an interrupted run count as analyzed
+    journal = MetadataJournal(METADATA_FILE)
+    metadata = journal.load()
+    if not metadata:
         print("Error: No metadata file found. Please run the crawler first.")
         return
     
-    with open(METADATA_FILE, 'r') as f:
-        metadata = json.load(f)
-    
     print(f"\n🔍 Analyzing {len(metadata)} images...")
     
     processed_count = 0
     start_time = time.time()
     
-    for filename, data in metadata.items():
-        if data.get('analyzed', False):
-            continue
-            
-        image_path = os.path.join(DOWNLOAD_DIR, filename)
-        if not os.path.exists(image_path):
+    near_duplicates = near_duplicate_index(metadata)
+    
+    # Images analyzed before hashing was added only need decoding, not the models
+    unhashed = [(filename, os.path.join(DOWNLOAD_DIR, filename)) for filename, data in metadata.items()
+                if data.get('analyzed', False) and 'content_sha256' not in data
+                and os.path.exists(os.path.join(DOWNLOAD_DIR, filename))]
+    if unhashed:
+        for filename, hashes in hash_images(unhashed, DECODE_WORKERS):
+            if hashes:
+                update = flag_near_duplicate(near_duplicates, filename, hashes)
+                metadata[filename].update(update)
+                journal.append(filename, update)
+        print(f"#️⃣ Hashed {len(unhashed)} previously analyzed images")
+    
+    pending = [(filename, os.path.join(DOWNLOAD_DIR, filename)) for filename, data in metadata.items()
+               if not data.get('analyzed', False) and os.path.exists(os.path.join(DOWNLOAD_DIR, filename))]
+    if not pending:
+        # Nothing to do, so never load the models
+        if os.path.exists(journal.path):
+            journal.compact()
+        print("✅ Every image is already analyzed")
+        return
+    if preload and captioner is None and detector is None:
+        warm_up()
+    
+    pipeline = AnalysisPipeline(captioner or VitGpt2Captioner(), detector or YoloDetector(),
+                                workers=DECODE_WORKERS, batch_size=CAPTION_BATCH_SIZE,
+                                max_in_flight=MAX_IN_FLIGHT, cache=analysis_cache(metadata))
+    
+    for filename, analysis, hashes in pipeline.run(pending):
+        if 'error' in analysis:
+            print(f"⚠️ Failed to process {filename}: {analysis['error']}")
             continue
         
-        try:
-            # Analyze the image
-            analysis = analyze_image(image_path)
-            
-            if 'error' in analysis:
-                print(f"⚠️ Failed to process {filename}: {analysis['error']}")
-                continue
-                
-            data['analysis'] = analysis
-            data['analyzed'] = True
-            processed_count += 1
-            
-            print(f"✅ Processed {processed_count}: {analysis['caption']}")
-            if analysis.get('detections'):
-                print(f"   Detected objects: {', '.join(d['class'] for d in analysis['detections'])}")
-            
-            # Save progress periodically
-            if processed_count % 10 == 0:
-                with open(METADATA_FILE, 'w') as f:
-                    json.dump(metadata, f, indent=2)
-                    
-        except Exception as e:
-            print(f"⚠️ Unexpected error processing {filename}: {str(e)}")
-            continue
+        update = flag_near_duplicate(near_duplicates, filename, dict(hashes, analysis=analysis, analyzed=True))
+        metadata[filename].update(update)
+        journal.append(filename, update)
+        processed_count += 1
+        
+        print(f"✅ Processed {processed_count}: {analysis['caption']}")
+        if analysis.get('detections'):
+            print(f"   Detected objects: {', '.join(d['class'] for d in analysis['detections'])}")
+        if 'near_duplicate_of' in update:
+            print(f"   Near-duplicate of {update['near_duplicate_of']}")
+    
+    stats = pipeline.stats()
+    for stage in pipeline.STAGES:
+        print(f"📊 {stage:<8} {stats[stage]['images']:6d} images   {stats[stage]['images_per_sec']:8.1f} images/sec")
+    print(f"♻️ Reused {stats['cached']['images']} analyses of identical images, "
+          f"saving about {stats['cached']['saved_seconds']:.1f}s of inference")
     
-    # Final save
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    # Fold the journal into metadata.json
+    journal.compact()
     
     total_time = (time.time() - start_time) / 60
     print(f"\n🎉 Successfully analyzed {processed_count} images")
@@ -179,5 +227,5 @@ if __name__ == "__main__":
     print("- Falls back to YOLO object detection when needed")
     print("- Updates metadata with analysis results")
     
-    analyze_images()
+    analyze_images(preload=True)
     print("✅ Analysis completed successfully!")
\ No newline at end of file
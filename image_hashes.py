@@ -0,0 +1,82 @@
+import hashlib
+from collections import defaultdict
+import numpy as np
+from PIL import Image
+
+# Hamming distance between dHashes at or below which two images count as near-duplicates
+NEAR_DUPLICATE_DISTANCE = 4
+
+
+def content_hash(image):
+    """SHA-256 of the decoded pixels, so re-saved or renamed copies of an image match."""
+    sha = hashlib.sha256(f"{image.mode} {image.width}x{image.height}".encode())
+    sha.update(image.tobytes())
+    return sha.hexdigest()
+
+
+def dhash(image, hash_size=8):
+    """64-bit difference hash as 16 hex digits: whether each pixel is brighter than its right neighbour."""
+    pixels = np.asarray(image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16)
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes().hex()
+
+
+def hamming(a, b):
+    """Number of differing bits between two hex hashes."""
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+class NearDuplicateIndex:
+    """Hamming-distance lookup over dHashes by multi-index hashing.
+
+    Hashes are cut into distance + 1 bands. Two hashes within `distance`
+    bits must agree exactly on at least one band, so a lookup only compares
+    against hashes sharing a band instead of scanning every image.
+    """
+
+    def __init__(self, distance=NEAR_DUPLICATE_DISTANCE, bits=64):
+        self.distance = distance
+        edges = [bits * i // (distance + 1) for i in range(distance + 2)]
+        self.bands = [(start, (1 << (end - start)) - 1) for start, end in zip(edges, edges[1:])]
+        self.buckets = [defaultdict(list) for _ in self.bands]
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _band_keys(self, value):
+        return [(value >> shift) & mask for shift, mask in self.bands]
+
+    def add(self, key, hex_hash):
+        """Index hex_hash under key."""
+        value = int(hex_hash, 16)
+        position = len(self.entries)
+        self.entries.append((key, value))
+        for buckets, band in zip(self.buckets, self._band_keys(value)):
+            buckets[band].append(position)
+
+    def find(self, hex_hash):
+        """Key of the closest indexed hash within distance (earliest added on ties), or None."""
+        value = int(hex_hash, 16)
+        best = None
+        for buckets, band in zip(self.buckets, self._band_keys(value)):
+            for position in buckets.get(band, ()):
+                distance = bin(self.entries[position][1] ^ value).count('1')
+                if distance <= self.distance and (best is None or (distance, position) < best):
+                    best = (distance, position)
+        return None if best is None else self.entries[best[1]][0]
+
+
+def collapse_near_duplicates(hex_hashes, distance=NEAR_DUPLICATE_DISTANCE):
+    """Positions to keep from a ranked list so no kept image is a near-duplicate of a better one.
+
+    Empty hashes (images never hashed) are always kept.
+    """
+    seen = NearDuplicateIndex(distance)
+    keep = []
+    for position, hex_hash in enumerate(hex_hashes):
+        if hex_hash:
+            if seen.find(hex_hash) is not None:
+                continue
+            seen.add(position, hex_hash)
+        keep.append(position)
+    return keep
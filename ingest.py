@@ -0,0 +1,364 @@
+import argparse
+import os
+import queue
+import threading
+import time
+from itertools import chain
+from analysis_pipeline import FLUSH, AnalysisPipeline
+from downloader import clean_filename
+from image_analyser import analysis_cache, flag_near_duplicate, near_duplicate_index
+from journal import MetadataJournal
+
+# Each queue bounds how far a stage may run ahead of the next; a stage blocks when its output queue is full
+DISCOVERED_QUEUE = 256  # Image URLs found but not yet downloading; when full, the crawler stops scrolling
+DOWNLOADED_QUEUE = 64  # Images on disk waiting for the analyser
+ANALYZED_QUEUE = 256  # Analyzed images waiting to be indexed
+BATCH_TIMEOUT = 0.5  # Seconds the analyser waits to fill a caption batch before running a partial one
+INDEX_BATCH_SIZE = 64  # Most images merged into the search index at once
+INDEX_INTERVAL = 0.5  # Seconds the indexer waits to fill a batch
+PUBLISH_INTERVAL = 30  # Seconds between compacting metadata.json and saving a snapshot for running servers
+
+# Ends a stage's input
+DONE = object()
+
+
+class Stopped(Exception):
+    """Raised inside a stage when another stage failed or the run was interrupted."""
+
+
+def percentiles(values):
+    """Count, p50, p95 and max of a list of seconds."""
+    if not values:
+        return {'images': 0, 'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+    values = sorted(values)
+    return {'images': len(values), 'p50': values[len(values) // 2],
+            'p95': values[min(len(values) - 1, int(len(values) * 0.95))], 'max': values[-1]}
+
+
+class IngestPipeline:
+    """Streaming discover -> download -> analyze -> index pipeline.
+
+    Each stage runs on its own thread (downloads on downloader.workers
+    threads) and hands images to the next over a bounded queue, so an image
+    is downloaded as soon as it is discovered, analyzed once on disk and
+    searchable once analyzed, while a slow stage holds back the ones before
+    it instead of piling up work. Every change is journaled as it happens;
+    engine (an ImageSearchEngine, optional) gets each batch of analyzed
+    images through add_documents(), and publish() is called after the
+    journal is compacted, every publish_interval seconds and at the end.
+
+    The source yields (img_url, alt_text) pairs and the downloader and
+    analysis pipeline are passed in, so a local site and stand-in models
+    can replace the real ones. Latencies are measured from discovery.
+    """
+
+    STAGES = ('downloaded', 'analyzed', 'searchable')
+
+    def __init__(self, downloader, analysis, metadata_file, engine=None, referer=None, publish=None,
+                 discovered_queue=DISCOVERED_QUEUE, downloaded_queue=DOWNLOADED_QUEUE,
+                 analyzed_queue=ANALYZED_QUEUE, batch_timeout=BATCH_TIMEOUT, index_batch_size=INDEX_BATCH_SIZE,
+                 index_interval=INDEX_INTERVAL, publish_interval=PUBLISH_INTERVAL, progress=None):
+        self.downloader = downloader
+        self.analysis = analysis
+        self.journal = MetadataJournal(metadata_file)
+        self.engine = engine
+        self.referer = referer
+        self.publish = publish
+        self.discovered = queue.Queue(discovered_queue)
+        self.downloaded = queue.Queue(downloaded_queue)
+        self.analyzed = queue.Queue(analyzed_queue)
+        self.batch_timeout = batch_timeout
+        self.index_batch_size = index_batch_size
+        self.index_interval = index_interval
+        self.publish_interval = publish_interval
+        self.progress = progress
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.errors = []
+        self.metadata = {}
+        self.near_duplicates = None
+        self.discovered_at = {}
+        self.latencies = {stage: [] for stage in self.STAGES}
+        self.counters = {'discovered': 0, 'known': 0, 'resumed': 0, 'download_failed': 0,
+                         'analysis_failed': 0, 'published': 0}
+        self.elapsed = 0.0
+
+    def run(self, source):
+        """Ingest every image source yields, returning stats() once all of them are searchable."""
+        self.metadata = self.journal.load()
+        known = {data.get('source_url') for data in self.metadata.values()}
+        # Images downloaded by an interrupted run go straight to the analyser
+        resumed = [(filename, os.path.join(self.downloader.download_dir, filename))
+                   for filename, data in self.metadata.items() if not data.get('analyzed', False)
+                   and os.path.exists(os.path.join(self.downloader.download_dir, filename))]
+        self.counters['resumed'] = len(resumed)
+        self.analysis.cache.update(analysis_cache(self.metadata))
+        self.near_duplicates = near_duplicate_index(self.metadata)
+        os.makedirs(self.downloader.download_dir, exist_ok=True)
+
+        downloaders = [self._thread(self._download) for _ in range(self.downloader.workers)]
+        threads = [self._thread(self._discover, source, known, len(downloaders)),
+                   self._thread(self._analyze, resumed, downloaders),
+                   self._thread(self._index)] + downloaders
+        start = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.2)
+        except KeyboardInterrupt:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            raise
+        finally:
+            self.elapsed += time.perf_counter() - start
+            # Nothing journaled is lost, but fold it in even when a stage failed
+            if self._stop.is_set():
+                with self._lock:
+                    self.journal.compact()
+        if self.errors:
+            raise self.errors[0]
+        return self.stats()
+
+    def _thread(self, work, *args):
+        def stage():
+            try:
+                work(*args)
+            except Stopped:
+                pass
+            except BaseException as e:
+                self.errors.append(e)
+                self._stop.set()
+        return threading.Thread(target=stage, name=f"ingest-{work.__name__.strip('_')}", daemon=True)
+
+    def _put(self, stage_queue, item):
+        while True:
+            if self._stop.is_set():
+                raise Stopped()
+            try:
+                stage_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, stage_queue, timeout=None):
+        """Next item; raises queue.Empty once timeout passes, or Stopped."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._stop.is_set():
+                raise Stopped()
+            wait = 0.1 if deadline is None else min(0.1, deadline - time.monotonic())
+            try:
+                return stage_queue.get(timeout=max(wait, 0))
+            except queue.Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+
+    def _journal(self, filename, data):
+        # Appends and compaction share the lock, as compaction would drop records appended meanwhile
+        with self._lock:
+            self.metadata.setdefault(filename, {}).update(data)
+            self.journal.append(filename, data)
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def _mark(self, stage, filename):
+        with self._lock:
+            discovered_at = self.discovered_at.get(filename)
+            if discovered_at is not None:
+                self.latencies[stage].append(time.monotonic() - discovered_at)
+        if self.progress:
+            self.progress(stage, filename)
+
+    def _discover(self, source, known, downloaders):
+        try:
+            # Filenames taken so far; a second URL saved under one would overwrite the first image
+            seen = set()
+            for img_url, alt_text in source:
+                filename = clean_filename(img_url)
+                if img_url in known or filename in seen:
+                    self._count('known', img_url in known)
+                    continue
+                seen.add(filename)
+                with self._lock:
+                    self.discovered_at[filename] = time.monotonic()
+                self._count('discovered')
+                self._put(self.discovered, (img_url, alt_text))
+        except Stopped:
+            raise
+        except Exception as e:
+            # The crawler failing ends discovery; what it found is still ingested before run() raises
+            self.errors.append(e)
+        finally:
+            if not self._stop.is_set():
+                for _ in range(downloaders):
+                    self._put(self.discovered, DONE)
+
+    def _download(self):
+        while True:
+            item = self._get(self.discovered)
+            if item is DONE:
+                return
+            img_url, alt_text = item
+            # A file already on disk has no metadata entry yet (e.g. copied in), so it is journaled too
+            save_path, _, _ = self.downloader.download(img_url, self.referer)
+            if save_path is None:
+                self._count('download_failed')
+                continue
+            filename = os.path.basename(save_path)
+            self._journal(filename, {
+                'source_url': img_url,
+                'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+                'alt_text': alt_text,
+                'analyzed': False
+            })
+            self._mark('downloaded', filename)
+            self._put(self.downloaded, (filename, save_path))
+
+    def _analyze(self, resumed, downloaders):
+        try:
+            for filename, analysis, hashes in self.analysis.run(chain(resumed, self._analysis_input(downloaders))):
+                if 'error' in analysis:
+                    print(f"⚠️ Failed to process {filename}: {analysis['error']}")
+                    self._count('analysis_failed')
+                    continue
+                update = flag_near_duplicate(self.near_duplicates, filename,
+                                             dict(hashes, analysis=analysis, analyzed=True))
+                self._journal(filename, update)
+                self._mark('analyzed', filename)
+                self._put(self.analyzed, filename)
+        finally:
+            if not self._stop.is_set():
+                self._put(self.analyzed, DONE)
+
+    def _analysis_input(self, downloaders):
+        # Downloads finish in any order, so the input ends once every download thread has
+        while True:
+            try:
+                item = self._get(self.downloaded, self.batch_timeout)
+            except queue.Empty:
+                # Checked in this order, nothing can be put between the last look and returning
+                if not any(thread.is_alive() for thread in downloaders) and self.downloaded.empty():
+                    return
+                # Nothing more for a while: caption what is waiting rather than hold it for a full batch
+                yield FLUSH
+                continue
+            yield item
+
+    def _index(self):
+        batch = []
+        last_published = time.monotonic()
+        while True:
+            try:
+                item = self._get(self.analyzed, self.index_interval if batch else None)
+            except queue.Empty:
+                item = None
+            if item is not None and item is not DONE:
+                batch.append(item)
+                if len(batch) < self.index_batch_size:
+                    continue
+            if batch:
+                self._index_batch(batch)
+                batch = []
+            if item is DONE or time.monotonic() - last_published >= self.publish_interval:
+                self._publish()
+                last_published = time.monotonic()
+            if item is DONE:
+                return
+
+    def _index_batch(self, filenames):
+        if self.engine is not None:
+            with self._lock:
+                surrogates = {filename: dict(self.metadata[filename]) for filename in filenames}
+            self.engine.add_documents(surrogates)
+        for filename in filenames:
+            self._mark('searchable', filename)
+
+    def _publish(self):
+        with self._lock:
+            self.journal.compact()
+        if self.publish:
+            self.publish()
+        self._count('published')
+
+    def stats(self):
+        """Stage counts, latency since discovery per stage, and the end-to-end rate."""
+        with self._lock:
+            stats = {stage: percentiles(latencies) for stage, latencies in self.latencies.items()}
+        stats.update(self.counters)
+        searchable = stats['searchable']['images']
+        stats['total'] = {'images': searchable, 'seconds': self.elapsed,
+                          'images_per_sec': searchable / self.elapsed if self.elapsed else 0.0}
+        return stats
+
+
+if __name__ == "__main__":
+    import nltk
+    import crawler
+    import image_analyser
+    from config import load_settings
+    from downloader import ImageDownloader
+    from irsystem import ImageSearchEngine, engine_options
+
+    parser = argparse.ArgumentParser(description="Crawl, download, analyze and index images as a stream")
+    parser.add_argument('--max-images', type=int, default=crawler.MAX_IMAGES)
+    parser.add_argument('--download-workers', type=int, default=crawler.DOWNLOAD_WORKERS)
+    parser.add_argument('--decode-workers', type=int, default=image_analyser.DECODE_WORKERS)
+    parser.add_argument('--batch-size', type=int, default=image_analyser.CAPTION_BATCH_SIZE)
+    parser.add_argument('--batch-timeout', type=float, default=BATCH_TIMEOUT)
+    parser.add_argument('--discovered-queue', type=int, default=DISCOVERED_QUEUE)
+    parser.add_argument('--downloaded-queue', type=int, default=DOWNLOADED_QUEUE)
+    parser.add_argument('--analyzed-queue', type=int, default=ANALYZED_QUEUE)
+    parser.add_argument('--index-batch-size', type=int, default=INDEX_BATCH_SIZE)
+    parser.add_argument('--publish-interval', type=float, default=PUBLISH_INTERVAL)
+    args = parser.parse_args()
+
+    for resource in ['stopwords', 'wordnet']:
+        nltk.download(resource, quiet=True)
+
+    print("🚀 Starting streaming ingest")
+    # The app's settings, so the snapshots published here are the ones its workers reload
+    settings = load_settings()
+    metadata_file = settings['METADATA_FILE']
+    journal = MetadataJournal(metadata_file)
+    if not os.path.exists(metadata_file):
+        os.makedirs(os.path.dirname(metadata_file), exist_ok=True)
+        journal.compact()
+    engine = ImageSearchEngine(**engine_options(settings))
+    image_analyser.warm_up()
+
+    def publish():
+        # Running servers poll for a new snapshot (see app.watch_index) and swap it in
+        engine.refresh_from_metadata()
+        engine.save_snapshot()
+
+    def progress(stage, filename):
+        if stage == 'searchable':
+            print(f"✅ Searchable: {filename}")
+
+    downloader = ImageDownloader(os.path.dirname(metadata_file), workers=args.download_workers,
+                                 per_host_rate=crawler.HOST_RATE_LIMIT, timeout=crawler.REQUEST_TIMEOUT)
+    # Spawned decode workers: forking while download threads run is unsafe
+    analysis = AnalysisPipeline(image_analyser.VitGpt2Captioner(), image_analyser.YoloDetector(),
+                                workers=args.decode_workers, batch_size=args.batch_size,
+                                max_in_flight=image_analyser.MAX_IN_FLIGHT, mp_context='spawn')
+    pipeline = IngestPipeline(downloader, analysis, metadata_file, engine=engine, referer=crawler.BASE_URL,
+                              publish=publish, discovered_queue=args.discovered_queue,
+                              downloaded_queue=args.downloaded_queue, analyzed_queue=args.analyzed_queue,
+                              batch_timeout=args.batch_timeout, index_batch_size=args.index_batch_size,
+                              publish_interval=args.publish_interval, progress=progress)
+    with downloader:
+        stats = pipeline.run(crawler.discover_images(args.max_images))
+
+    print(f"\n🎉 {stats['searchable']['images']} new images searchable ({stats['known']} already known, "
+          f"{stats['resumed']} resumed, {stats['download_failed']} downloads and "
+          f"{stats['analysis_failed']} analyses failed)")
+    for stage in pipeline.STAGES:
+        print(f"📊 {stage:<10} p50 {stats[stage]['p50']:6.1f}s   p95 {stats[stage]['p95']:6.1f}s   "
+              f"max {stats[stage]['max']:6.1f}s after discovery")
+    print(f"⚡ {stats['total']['images_per_sec']:.2f} images/sec over {stats['total']['seconds'] / 60:.2f} minutes")
@@ -0,0 +1,239 @@
+import bisect
+import collections
+import contextvars
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets, Prometheus client defaults plus finer low end
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Search stages timed by stage(), in pipeline order
+STAGES = ('analysis', 'postings', 'scoring', 'ranking', 'assembly')
+
+_trace = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    """Seconds spent in each stage while a traced call ran.
+
+    Stages timed on shard threads add up across threads, so with parallel
+    shards postings and scoring can exceed the wall time.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def tracing():
+    """Collect the stage() timings of everything run inside into a new Trace."""
+    trace = Trace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def stage(name):
+    """Time the block as one stage of the current trace; does nothing when no trace is active."""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start)
+
+
+def propagate(fn):
+    """fn run in a copy of the caller's context, so work handed to a thread pool joins the caller's trace."""
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(fn, *args)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+
+class Counter:
+    """Monotonic counter per label set."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram per label set, in the Prometheus layout."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, then the sum of observations
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", dict(labels, le=format_value(bound)), cumulative))
+            samples.append((f"{self.name}_sum", labels, counts[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    """Metrics of this process rendered in the Prometheus text exposition format.
+
+    Collectors are called at scrape time for values kept elsewhere, such as
+    the query cache counters. Each gunicorn worker has its own registry.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, collect):
+        """Register collect(), returning (name, kind, documentation, [(labels, value), ...]) tuples."""
+        self.collectors.append(collect)
+        return collect
+
+    def render(self):
+        lines = []
+        families = [(metric.name, metric.kind, metric.documentation, metric.samples()) for metric in self.metrics]
+        for collect in self.collectors:
+            families.extend((name, kind, documentation, [(name, labels, value) for labels, value in samples])
+                            for name, kind, documentation, samples in collect())
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{sample}{format_labels(labels)} {format_value(value)}" for sample, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+class SlowQueryProfiler:
+    """Sampling profiler that keeps the stacks of requests slower than a threshold.
+
+    While a profiled request runs, a background thread samples its stack
+    every `interval` seconds. When the request finishes above `threshold`
+    seconds, the samples are written to `directory` as collapsed stacks
+    (one "outer;...;inner count" line per distinct stack), the input of
+    flamegraph.pl and speedscope. Faster requests are simply dropped.
+    """
+
+    def __init__(self, threshold, directory, interval=0.005):
+        self.threshold = threshold
+        self.directory = directory
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def start(self, thread_id=None):
+        """Begin sampling a thread, the calling one by default."""
+        with self._lock:
+            self._active[thread_id or threading.get_ident()] = collections.Counter()
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, name='slow-query-profiler', daemon=True)
+                self._sampler.start()
+
+    def stop(self, duration, label, thread_id=None):
+        """Stop sampling a thread; returns the written profile's path if the request was slow, else None."""
+        thread_id = thread_id or threading.get_ident()
+        with self._lock:
+            stacks = self._active.pop(thread_id, None)
+        if stacks is None or duration < self.threshold or not stacks:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        safe_label = ''.join(c if c.isalnum() or c in '-_' else '_' for c in label)
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{duration * 1000:.0f}ms-"
+                                            f"{safe_label}-{thread_id}.folded")
+        with open(path, 'w') as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        return path
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                thread_ids = list(self._active)
+            if not thread_ids:
+                continue
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                with self._lock:
+                    stacks = self._active.get(thread_id)
+                    if stacks is not None:
+                        stacks[';'.join(reversed(stack))] += 1
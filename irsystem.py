@@ -1,105 +1,274 @@
 import json
-import re
 import math
+import os
+import hashlib
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 import numpy as np
-from collections import defaultdict
-from nltk.stem import PorterStemmer, WordNetLemmatizer
-from nltk.corpus import stopwords
-# from sentence_transformers import SentenceTransformer, util
-from config import IMAGE_FOLDER, METADATA_FILE
+from collections import Counter, defaultdict
+from collections.abc import Mapping
+from config import IMAGE_FOLDER, METADATA_FILE, INDEX_DIR, load_settings
+from scoring import CSRScorer, ShardedScorer, rank_scores, reciprocal_rank_fusion, select_top_k
+from query_cache import QueryCache
+from analyzer import TextAnalyzer
+from metadata_store import MetadataStore, MetadataSubset
+from image_hashes import collapse_near_duplicates
+from vector_index import HashingEmbedder, SentenceTransformerEmbedder, VectorIndex
+from postings import CompressedPostings
+from facets import FacetIndex, facet_record
+from instrumentation import stage, tracing
+from suggest import PrefixIndex, QueryLog, document_frequencies, SUGGEST_LIMIT
+from analyzer import PUNCTUATION
 
-class ImageSearchEngine:
-    def __init__(self):
-        # Initialize text processing tools
-        self.stemmer = PorterStemmer()
-        self.lemmatizer = WordNetLemmatizer()
-        self.stop_words = set(stopwords.words('english'))
-        
-        # Load models
-        # self.model = SentenceTransformer('paraphrase-mpnet-base-v2')
-        
-        # Load and process image surrogates
-        self.image_metadata = []
-        self.processed_texts = []
-        self._load_surrogates()
-        
-        # Build indexes
-        self.inverted_index, self.doc_frequency = self._build_inverted_index()
-        self.total_images = len(self.processed_texts)
-        self.doc_lengths = self._compute_document_lengths()
-        
-        # Precompute embeddings
-        # self.embeddings = self._compute_embeddings()
+# Ranking methods accepted by search_batch() and the web routes
+SEARCH_METHODS = ('vsm', 'bm25', 'semantic', 'hybrid')
 
-    def _load_surrogates(self):
-        """Load and process image surrogates from JSON file."""
-        with open(METADATA_FILE, 'r') as f:
-            surrogates = json.load(f)
-        
-        for filename, data in surrogates.items():
-            # Store complete metadata
-            self.image_metadata.append({
-                'filename': filename,
-                'source_url': data['source_url'],
-                'alt_text': data['alt_text'],
-                'caption': data['analysis']['caption']
-            })
-            
-            # Combine alt text and BLIP caption for search
-            combined_text = f"{data['alt_text']} {data['analysis']['caption']}"
-            self.processed_texts.append(self._prepare_text(combined_text))
+# Filter selections (matching doc ids) kept per engine, for paging through filtered results
+SELECTION_CACHE_SIZE = 64
 
-    def _prepare_text(self, text):
-        """Clean and process text for indexing."""
-        cleaned = re.sub(r'[^\w\s]', '', text.lower())
-        tokens = cleaned.split()
-        
-        processed = []
-        for token in tokens:
-            if token not in self.stop_words:
-                lemma = self.lemmatizer.lemmatize(token)
-                stemmed = self.stemmer.stem(lemma)
-                processed.append(stemmed)
-        return processed
-
-    def _build_inverted_index(self):
-        """Build inverted index from processed documents."""
-        inverted_index = defaultdict(list)
-        doc_frequency = defaultdict(int)
+# Bump whenever the on-disk snapshot layout changes
+SNAPSHOT_VERSION = 9
 
-        for doc_id, doc in enumerate(self.processed_texts):
-            term_freq = defaultdict(int)
-            for term in doc:
-                term_freq[term] += 1
 
-            for term, freq in term_freq.items():
-                inverted_index[term].append((doc_id, freq))
-                doc_frequency[term] += 1
+def engine_options(config):
+    """ImageSearchEngine keyword arguments from app settings (see config.load_settings).
 
-        return inverted_index, doc_frequency
+    The app and the snapshot builders both construct engines from this, so
+    a prebuilt snapshot has the embedder, dtype, postings format and
+    directories the app checks for.
+    """
+    return {
+        'cache_size': config['QUERY_CACHE_SIZE'],
+        'cache_ttl': config['QUERY_CACHE_TTL'],
+        'embedder': SentenceTransformerEmbedder(config['EMBEDDING_MODEL']) if config['EMBEDDING_MODEL'] else None,
+        'vector_dtype': config['EMBEDDING_DTYPE'],
+        'shards': config['INDEX_SHARDS'],
+        'compress_postings': config['COMPRESS_POSTINGS'],
+        'metadata_file': config['METADATA_FILE'],
+        'index_dir': config['INDEX_DIR'],
+    }
 
-    def _compute_document_lengths(self):
-        """Precompute document lengths for cosine similarity."""
-        lengths = [0.0] * self.total_images
-        for term, postings in self.inverted_index.items():
-            for doc_id, term_freq in postings:
-                lengths[doc_id] += (term_freq ** 2)
-        return [math.sqrt(length) for length in lengths]
-
-    # def _compute_embeddings(self):
-    #     """Precompute embeddings for all images."""
-    #     doc_texts = [' '.join(doc) for doc in self.processed_texts]
-    #     return self.model.encode(doc_texts, show_progress_bar=True)
-
-    def search_vsm(self, query):
-        """Vector Space Model search with proper cosine similarity normalization."""
-        processed_query = self._prepare_text(query)
-        
+
+def metadata_digest(path=METADATA_FILE):
+    """SHA-256 of the metadata file, used to key index snapshots."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def snapshot_path(digest, index_dir=INDEX_DIR):
+    """Directory holding the snapshot generation for a given metadata digest."""
+    return os.path.join(index_dir, f"v{SNAPSHOT_VERSION}-{digest[:16]}")
+
+
+def surrogate_record(filename, data):
+    """Metadata kept per indexed image, from a metadata.json entry."""
+    return {
+        'filename': filename,
+        'source_url': data['source_url'],
+        'alt_text': data['alt_text'],
+        'caption': data['analysis']['caption'],
+        'dhash': data.get('dhash', '')
+    }
+
+
+def surrogate_text(data):
+    """Combine alt text and BLIP caption for search."""
+    return f"{data['alt_text']} {data['analysis']['caption']}"
+
+
+def record_text(record):
+    """surrogate_text() of an indexed metadata record."""
+    return f"{record['alt_text']} {record['caption']}"
+
+
+class PostingsView(Mapping):
+    """Read-only term -> [(doc_id, freq), ...] view over postings(term_id) -> (doc ids, freqs)."""
+
+    def __init__(self, vocabulary, postings):
+        self.vocabulary = vocabulary
+        self.postings = postings
+
+    def __getitem__(self, term):
+        docs, freqs = self.postings(self.vocabulary[term])
+        return list(zip(docs.tolist(), freqs.tolist()))
+
+    def __contains__(self, term):
+        return term in self.vocabulary
+
+    def __iter__(self):
+        return iter(self.vocabulary)
+
+    def __len__(self):
+        return len(self.vocabulary)
+
+
+class DocFrequencyView(Mapping):
+    """Read-only term -> document frequency view over the vocabulary and CSR term offsets."""
+
+    def __init__(self, vocabulary, term_offsets):
+        self.vocabulary = vocabulary
+        self.term_offsets = term_offsets
+
+    def __getitem__(self, term):
+        term_id = self.vocabulary[term]
+        return int(self.term_offsets[term_id + 1] - self.term_offsets[term_id])
+
+    def __contains__(self, term):
+        return term in self.vocabulary
+
+    def __iter__(self):
+        return iter(self.vocabulary)
+
+    def __len__(self):
+        return len(self.vocabulary)
+
+
+class IndexGeneration:
+    """One immutable version of the index and the documents it covers.
+
+    Updates build a new generation and swap it in, so a query that grabbed
+    a generation keeps seeing consistent postings, statistics and metadata.
+    With shards > 1 the numpy backend scores contiguous doc id shards on
+    `executor` and merges their top k. With `compressed` postings the flat
+    posting arrays are not kept and lists are decoded as queries need them.
+    `suggestions` holds the documents' surface words by document frequency
+    for autocomplete, and `facets` their detected objects, model and crawl
+    time as bitmaps; rankers given the doc ids a filter selected only read
+    and score those documents.
+    """
+
+    def __init__(self, number, terms, term_offsets, posting_docs, posting_freqs, doc_token_counts, doc_lengths,
+                 image_metadata, vectors, term_max_impacts=None, shards=1, executor=None, compressed=None,
+                 suggestions=None, facets=None):
+        self.number = number
+        self.suggestions = suggestions
+        self.facets = facets
+        self.terms = terms
+        self.vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+        self.term_offsets = term_offsets
+        self.compressed = compressed
+        self.posting_docs = None if compressed is not None else posting_docs
+        self.posting_freqs = None if compressed is not None else posting_freqs
+        self.doc_token_counts = doc_token_counts
+        self.doc_lengths = doc_lengths
+        self.total_images = len(doc_token_counts)
+        self.image_metadata = image_metadata
+        self.vectors = vectors
+
+        self.inverted_index = PostingsView(self.vocabulary, self.postings)
+        # A view rather than another dict entry per term, which each forked worker would end up copying
+        self.doc_frequency = DocFrequencyView(self.vocabulary, term_offsets)
+        if shards > 1:
+            if posting_docs is None:
+                posting_docs, posting_freqs = compressed.decode_all()
+            self.scorer = ShardedScorer(term_offsets, posting_docs, posting_freqs, doc_token_counts, doc_lengths,
+                                        shards, term_max_impacts, executor, compress=compressed is not None)
+        else:
+            self.scorer = CSRScorer(term_offsets, self.posting_docs, self.posting_freqs, doc_token_counts,
+                                    doc_lengths, term_max_impacts, compressed=compressed)
+
+    def postings(self, term_id):
+        """Doc ids and frequencies of one term."""
+        if self.compressed is not None:
+            return self.compressed.postings(term_id)
+        start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+        return self.posting_docs[start:end], self.posting_freqs[start:end]
+
+    def posting_arrays(self):
+        """Flat CSR (posting_docs, posting_freqs), decoded if the postings are compressed."""
+        if self.compressed is not None:
+            return self.compressed.decode_all()
+        return self.posting_docs, self.posting_freqs
+
+    @cached_property
+    def doc_ids_by_filename(self):
+        """Hash index from filename to doc id, built on first lookup."""
+        filenames = self.image_metadata.column('filename')
+        return dict(zip(filenames, range(len(filenames))))
+
+    def warm(self, k1=1.5, b=0.75):
+        """Build what the first queries would otherwise build, e.g. in a server process before it forks workers."""
+        self.doc_ids_by_filename
+        for scorer in getattr(self.scorer, 'shards', [self.scorer]):
+            scorer.bm25_max_impacts(k1, b)
+
+    def select(self, facet_filter):
+        """Ascending doc ids of the images matching a FacetFilter."""
+        return self.facets.select(facet_filter).to_array()
+
+    def restrict(self, scorer, doc_ids):
+        """`scorer`, or the generation's own, limited to doc_ids unless that is None or it already is."""
+        scorer = scorer or self.scorer
+        return scorer if doc_ids is None or scorer.allowed is doc_ids else scorer.restricted(doc_ids)
+
+    @staticmethod
+    def rank_within(scores, top_k, doc_ids):
+        """rank_scores() of a dense score vector, over doc_ids only unless that is None."""
+        if doc_ids is None:
+            return rank_scores(scores, top_k)
+        return select_top_k(doc_ids, np.asarray(scores, dtype=np.float64)[doc_ids], top_k)
+
+    def get_image(self, filename):
+        """Metadata for one image by filename, or None if it is not indexed."""
+        doc_id = self.doc_ids_by_filename.get(filename)
+        return None if doc_id is None else self.image_metadata[doc_id]
+
+    def assemble_results(self, doc_ids, scores):
+        """Pair ranked doc ids with their metadata and score."""
+        with stage('assembly'):
+            return [(self.image_metadata[idx], score) for idx, score in zip(doc_ids.tolist(), scores.tolist())]
+
+    def iter_results(self, doc_ids, scores):
+        """assemble_results() one result at a time, for streaming long result lists."""
+        for idx, score in zip(doc_ids.tolist(), scores.tolist()):
+            yield self.image_metadata[idx], score
+
+    def collapse_duplicates(self, rank, top_k):
+        """Ranked (doc_ids, scores) from rank(k), keeping only the best-ranked of each set of near-duplicate images."""
+        # Collapsing removes results, so rank past top_k and widen until enough survive
+        fetch = None if top_k is None else 2 * top_k + 16
+        while True:
+            doc_ids, scores = rank(fetch)
+            with stage('ranking'):
+                keep = collapse_near_duplicates([self.image_metadata.value('dhash', doc_id)
+                                                 for doc_id in doc_ids.tolist()])[:top_k]
+            if fetch is None or len(keep) == top_k or len(doc_ids) < fetch:
+                return doc_ids[keep], scores[keep]
+            fetch *= 4
+
+    def rank_vsm(self, processed_query, top_k, scoring, scorer=None, doc_ids=None):
+        """Ranked (doc_ids, scores) for an analyzed VSM query, on `scorer` if given (e.g. a batch copy).
+
+        Given ascending doc_ids, only those documents are ranked.
+        """
+        query_vector = self.vsm_query_vector(processed_query)
+        if scoring == 'numpy':
+            return self.restrict(scorer, doc_ids).vsm_top_k(self.vsm_query_weights(query_vector), top_k)
+        with stage('scoring'):
+            scores = self.score_vsm_python(query_vector)
+        with stage('ranking'):
+            return self.rank_within(scores, top_k, doc_ids)
+
+    def score_vsm(self, processed_query, scoring):
+        """Cosine similarity of every document to an analyzed query, indexed by doc id."""
+        query_vector = self.vsm_query_vector(processed_query)
+        if scoring == 'numpy':
+            return self.scorer.vsm_scores(self.vsm_query_weights(query_vector))
+        return self.score_vsm_python(query_vector)
+
+    def vsm_query_vector(self, processed_query):
+        """Normalized tf-idf weights of the query terms found in the index."""
         # Calculate query vector (tf-idf weights)
-        query_terms = set(processed_query)  # Get unique terms
+        query_terms = sorted(set(processed_query))  # Get unique terms in a stable order
         query_vector = {}
         query_length = 0.0
-        
+
         for term in query_terms:
             if term in self.inverted_index:
                 # Calculate tf-idf for query terms
@@ -108,63 +277,748 @@ class ImageSearchEngine:
                 idf = math.log(self.total_images / (df + 1))
                 query_vector[term] = tf * idf
                 query_length += (query_vector[term] ** 2)
-        
+
         query_length = math.sqrt(query_length)
-        
+
         # Normalize query vector
         if query_length > 0:
             for term in query_vector:
                 query_vector[term] /= query_length
-        
-        # Calculate document scores
+
+        return query_vector
+
+    def vsm_query_weights(self, query_vector):
+        """Query vector as (term_id, weight, idf) triples for the CSR scorer."""
+        return [(self.vocabulary[term], weight, self.vsm_idf(term)) for term, weight in query_vector.items()]
+
+    def vsm_idf(self, term):
+        """Inverse document frequency used by the VSM weights."""
+        return math.log(self.total_images / (self.doc_frequency[term] + 1))
+
+    def score_vsm_python(self, query_vector):
+        """Reference VSM scoring loop over the postings view."""
         scores = [0.0] * self.total_images
-        
+
         for term in query_vector:
             if term in self.inverted_index:
                 for doc_id, term_freq in self.inverted_index[term]:
                     # Calculate tf-idf for document term
-                    tf = term_freq / len(self.processed_texts[doc_id])
-                    df = self.doc_frequency[term]
-                    idf = math.log(self.total_images / (df + 1))
+                    tf = term_freq / int(self.doc_token_counts[doc_id])
+                    idf = self.vsm_idf(term)
                     doc_weight = tf * idf
-                    
+
                     # Normalize by document length (already precomputed in self.doc_lengths)
-                    if self.doc_lengths[doc_id] > 0:
-                        doc_weight /= self.doc_lengths[doc_id]
-                    
+                    doc_length = float(self.doc_lengths[doc_id])
+                    if doc_length > 0:
+                        doc_weight /= doc_length
+
                     scores[doc_id] += query_vector[term] * doc_weight
-        
-        ranked_indices = np.argsort(scores)[::-1]
-        return [(self.image_metadata[idx], scores[idx]) for idx in ranked_indices if scores[idx] > 0]
+        return scores
+
+    def rank_semantic(self, query_vector, top_k, nprobe=None, doc_ids=None):
+        """Ranked (doc_ids, scores) by embedding similarity to an embedded query, among doc_ids if given."""
+        # Matrix scoring and top-k selection happen in one call, so both count as scoring
+        with stage('scoring'):
+            return self.vectors.search(query_vector, top_k, nprobe, doc_ids)
+
+    def rank_bm25(self, processed_query, k1, b, top_k, scoring, scorer=None, doc_ids=None):
+        """Ranked (doc_ids, scores) for an analyzed BM25 query, on `scorer` if given (e.g. a batch copy).
+
+        Given ascending doc_ids, only those documents are ranked.
+        """
+        query_terms = self.bm25_query_terms(processed_query)
+        if scoring == 'numpy':
+            return self.restrict(scorer, doc_ids).bm25_top_k(self.bm25_query_ids(query_terms), k1, b, top_k)
+        with stage('scoring'):
+            scores = self.score_bm25_python(query_terms, k1, b)
+        with stage('ranking'):
+            return self.rank_within(scores, top_k, doc_ids)
+
+    def score_bm25(self, processed_query, k1, b, scoring):
+        """BM25 score of every document for an analyzed query, indexed by doc id."""
+        query_terms = self.bm25_query_terms(processed_query)
+        if scoring == 'numpy':
+            return self.scorer.bm25_scores(self.bm25_query_ids(query_terms), k1, b)
+        return self.score_bm25_python(query_terms, k1, b)
 
-    def search_bm25(self, query, k1=1.5, b=0.75):
-        """BM25 search."""
-        processed_query = self._prepare_text(query)
-        avg_doc_len = np.mean([len(doc) for doc in self.processed_texts])
+    def bm25_query_terms(self, processed_query):
+        """(term, idf) for each indexed query token, repeats included."""
+        return [(term, self.bm25_idf(term)) for term in processed_query
+                if term in self.inverted_index]
+
+    def bm25_query_ids(self, query_terms):
+        """Query terms as (term_id, idf) pairs for the CSR scorer."""
+        return [(self.vocabulary[term], idf) for term, idf in query_terms]
+
+    def bm25_idf(self, term):
+        """Robertson-Sparck Jones IDF used by BM25."""
+        df = self.doc_frequency[term]
+        return math.log((self.total_images - df + 0.5) / (df + 0.5))
+
+    def score_bm25_python(self, query_terms, k1, b):
+        """Reference BM25 scoring loop over the postings view."""
+        avg_doc_len = self.scorer.avg_doc_len
         scores = [0.0] * self.total_images
 
-        for term in processed_query:
-            if term in self.inverted_index:
-                df = self.doc_frequency[term]
-                idf = math.log((self.total_images - df + 0.5) / (df + 0.5))
+        for term, idf in query_terms:
+            for doc_id, term_freq in self.inverted_index[term]:
+                doc_len = int(self.doc_token_counts[doc_id])
+                numerator = term_freq * (k1 + 1)
+                denominator = term_freq + k1 * (1 - b + b * (doc_len / avg_doc_len))
+                scores[doc_id] += idf * (numerator / denominator)
+        return scores
 
-                for doc_id, term_freq in self.inverted_index[term]:
-                    doc_len = len(self.processed_texts[doc_id])
-                    numerator = term_freq * (k1 + 1)
-                    denominator = term_freq + k1 * (1 - b + b * (doc_len / avg_doc_len))
-                    scores[doc_id] += idf * (numerator / denominator)
+
+def _current_index(name):
+    return property(lambda self: getattr(self.index, name),
+                    doc=f"`{name}` of the current index generation.")
+
+
+class ImageSearchEngine:
+    image_metadata = _current_index('image_metadata')
+    total_images = _current_index('total_images')
+    terms = _current_index('terms')
+    vocabulary = _current_index('vocabulary')
+    inverted_index = _current_index('inverted_index')
+    doc_frequency = _current_index('doc_frequency')
+    term_offsets = _current_index('term_offsets')
+    posting_docs = _current_index('posting_docs')
+    posting_freqs = _current_index('posting_freqs')
+    doc_token_counts = _current_index('doc_token_counts')
+    doc_lengths = _current_index('doc_lengths')
+    scorer = _current_index('scorer')
+    vectors = _current_index('vectors')
+    index_generation = _current_index('number')
+
+    def __init__(self, use_snapshot=True, scoring='numpy', cache_size=1024, cache_ttl=None, embedder=None,
+                 vector_dtype='int8', nlist=None, shards=1, compress_postings=False, metadata_file=METADATA_FILE,
+                 index_dir=INDEX_DIR):
+        # Metadata indexed, and where its snapshots live
+        self.metadata_file = metadata_file
+        self.index_dir = index_dir
+        
+        # Initialize text processing tools
+        self.analyzer = TextAnalyzer()
+        
+        # 'numpy' scores with the vectorized CSR backend, 'python' with the
+        # reference per-posting loops
+        self.scoring = scoring
+        
+        # Ranked results keyed by analyzed query, method parameters and index generation
+        self.result_cache = QueryCache(cache_size, cache_ttl)
+        # Doc ids matching each recent filter, keyed by filter and index generation
+        self.selection_cache = QueryCache(min(cache_size, SELECTION_CACHE_SIZE))
+        self.index = None
+        self._update_lock = threading.Lock()
+        
+        # Postings split into this many doc id shards, scored on parallel threads
+        # (numpy releases the GIL inside the gathers and scatter-adds)
+        self.shards = shards
+        self.shard_pool = ThreadPoolExecutor(shards, thread_name_prefix='shard') if shards > 1 else None
+        
+        # Searched queries, offered back as autocomplete suggestions
+        self.query_log = QueryLog()
+        
+        # Called as hook(method, {stage: seconds}) after every search, e.g. to export stage latencies
+        self.stage_hooks = []
+        
+        # Keep postings delta + varint coded instead of as flat int32 arrays
+        self.compress_postings = compress_postings
         
-        ranked_indices = np.argsort(scores)[::-1]
-        return [(self.image_metadata[idx], scores[idx]) for idx in ranked_indices if scores[idx] > 0]
+        # Embeds documents and queries for semantic search; the hashing
+        # embedder runs offline, anything with embed(texts) and a name fits
+        self.embedder = embedder or HashingEmbedder()
+        self.vector_dtype = vector_dtype
+        self.nlist = nlist
+        
+        # Load the prebuilt index if it matches metadata.json, otherwise
+        # process image surrogates and build the indexes from scratch
+        self._metadata_stat = None
+        self.metadata_digest = self._current_digest()
+        self.loaded_from_snapshot = use_snapshot and self._load_snapshot()
+        if not self.loaded_from_snapshot:
+            image_metadata, processed_texts, facets = self._load_surrogates()
+            self._build_inverted_index(image_metadata, processed_texts, facets)
+
+    def _current_digest(self):
+        """metadata_digest() of the metadata file, rehashed only when its size or mtime changed."""
+        stat = os.stat(self.metadata_file)
+        key = (stat.st_mtime_ns, stat.st_size)
+        if self._metadata_stat is None or self._metadata_stat[0] != key:
+            self._metadata_stat = (key, metadata_digest(self.metadata_file))
+        return self._metadata_stat[1]
+
+    def after_fork(self):
+        """Recreate the shard threads in a forked child, which inherits the pool but none of its threads."""
+        if self.shards > 1:
+            self.shard_pool = ThreadPoolExecutor(self.shards, thread_name_prefix='shard')
+            self.index.scorer.executor = self.shard_pool
 
-    # def search_semantic(self, query):
-    #     """Semantic search."""
-    #     query_embedding = self.model.encode([query])[0]
-    #     scores = util.cos_sim(query_embedding, self.embeddings).squeeze().tolist()
+    def reload_snapshot(self):
+        """Swap in the snapshot of the metadata file if it changed and a snapshot for it exists.
+
+        Meant to be polled by each server worker: `python irsystem.py`
+        writes the snapshot once, and every worker memory-maps it and swaps
+        the new generation in without restarting. Returns whether it did.
+        """
+        digest = self._current_digest()
+        if digest == self.metadata_digest:
+            return False
+        with self._update_lock:
+            previous, self.metadata_digest = self.metadata_digest, digest
+            if not self._load_snapshot():
+                self.metadata_digest = previous
+                return False
+        self.loaded_from_snapshot = True
+        self.index.warm()
+        return True
+
+    def _load_surrogates(self):
+        """Load and process image surrogates from JSON file."""
+        with open(self.metadata_file, 'r') as f:
+            surrogates = json.load(f)
         
-    #     ranked_indices = np.argsort(scores)[::-1]
-    #     return [(self.image_metadata[idx], scores[idx]) for idx in ranked_indices if scores[idx] > 0]
+        # Entries the analyser has not captioned yet are picked up by refresh_from_metadata later
+        image_metadata = []
+        combined_texts = []
+        facet_records = []
+        for filename, data in surrogates.items():
+            if not data.get('analysis'):
+                continue
+            # Store complete metadata
+            image_metadata.append(surrogate_record(filename, data))
+            
+            # Combine alt text and BLIP caption for search
+            combined_texts.append(surrogate_text(data))
+            
+            # Detected objects, model and crawl time, for filtering
+            facet_records.append(facet_record(data))
+        return image_metadata, self.analyzer.analyze_batch(combined_texts), FacetIndex.from_records(facet_records)
+
+    def _prepare_text(self, text):
+        """Clean and process text for indexing."""
+        with stage('analysis'):
+            return self.analyzer.analyze(text)
+
+    def _build_inverted_index(self, image_metadata, processed_texts, facets):
+        """Build inverted index from processed documents."""
+        postings = defaultdict(list)
+
+        for doc_id, doc in enumerate(processed_texts):
+            term_freq = defaultdict(int)
+            for term in doc:
+                term_freq[term] += 1
+
+            for term, freq in term_freq.items():
+                postings[term].append((doc_id, freq))
+
+        # Flatten into CSR arrays: postings for term_id live in
+        # posting_docs/posting_freqs[term_offsets[term_id]:term_offsets[term_id + 1]]
+        terms = sorted(postings)
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        total = int(term_offsets[-1])
+        posting_docs = np.fromiter((doc_id for term in terms for doc_id, _ in postings[term]),
+                                   dtype=np.int32, count=total)
+        posting_freqs = np.fromiter((freq for term in terms for _, freq in postings[term]),
+                                    dtype=np.int32, count=total)
+        doc_token_counts = np.array([len(doc) for doc in processed_texts], dtype=np.int32)
+
+        self._attach_index(terms, term_offsets, posting_docs, posting_freqs, doc_token_counts,
+                           self._compute_document_lengths(posting_docs, posting_freqs, len(processed_texts)),
+                           MetadataStore.from_records(image_metadata),
+                           VectorIndex.build(self._embed([record_text(record) for record in image_metadata]),
+                                             self.vector_dtype, self.nlist),
+                           facets=facets)
+
+    def _embed(self, texts):
+        """float32 embeddings of texts, shaped (len(texts), dim) even when empty."""
+        if not texts:
+            return np.zeros((0, self.embedder.embed(['']).shape[1]), dtype=np.float32)
+        with stage('analysis'):
+            return self.embedder.embed(texts)
+
+    def _attach_index(self, terms, term_offsets, posting_docs, posting_freqs, doc_token_counts, doc_lengths,
+                      image_metadata, vectors, term_max_impacts=None, compressed=None, suggestions=None,
+                      facets=None):
+        """Install a new index generation, whether built, loaded from a snapshot or merged."""
+        number = self.index.number + 1 if self.index is not None else 1
+        if self.compress_postings and compressed is None:
+            compressed = CompressedPostings.encode(term_offsets, posting_docs, posting_freqs)
+        if suggestions is None:
+            texts = (f"{alt_text} {caption}" for alt_text, caption in
+                     zip(image_metadata.column('alt_text'), image_metadata.column('caption')))
+            suggestions = PrefixIndex.build(document_frequencies(texts, self.analyzer.stop_words))
+        self.index = IndexGeneration(number, terms, term_offsets, posting_docs, posting_freqs, doc_token_counts,
+                                     doc_lengths, image_metadata, vectors, term_max_impacts,
+                                     self.shards, self.shard_pool, compressed, suggestions, facets)
+
+        # Cached rankings and selections belong to the previous generation
+        self.result_cache.clear()
+        self.selection_cache.clear()
+
+    @staticmethod
+    def _compute_document_lengths(posting_docs, posting_freqs, total_images):
+        """Precompute document lengths for cosine similarity."""
+        squared = posting_freqs.astype(np.float64) ** 2
+        return np.sqrt(np.bincount(posting_docs, weights=squared, minlength=total_images))
+
+    def add_documents(self, surrogates):
+        """Index metadata.json-style {filename: entry} items; known filenames are updated."""
+        self._apply_changes(surrogates, ())
+        self.metadata_digest = None
+
+    def update_document(self, filename, data):
+        """Re-index one image from its metadata.json entry."""
+        self.add_documents({filename: data})
+
+    def remove_documents(self, filenames):
+        """Drop images from the index."""
+        self._apply_changes({}, filenames)
+        self.metadata_digest = None
+
+    def refresh_from_metadata(self, path=None):
+        """Apply new, changed and removed analyzed entries from metadata.json. Returns (upserted, removed)."""
+        path = path or self.metadata_file
+        digest = self._current_digest() if path == self.metadata_file else metadata_digest(path)
+        if digest == self.metadata_digest:
+            return 0, 0
+        with open(path, 'r') as f:
+            surrogates = json.load(f)
+
+        index = self.index
+        upserts = {}
+        for filename, data in surrogates.items():
+            if not data.get('analysis'):
+                continue
+            doc_id = index.doc_ids_by_filename.get(filename)
+            if doc_id is None or index.image_metadata[doc_id] != surrogate_record(filename, data) or \
+                    index.facets.record(doc_id) != facet_record(data):
+                upserts[filename] = data
+        removals = [filename for filename in index.doc_ids_by_filename
+                    if not surrogates.get(filename, {}).get('analysis')]
+
+        self._apply_changes(upserts, removals)
+        self.metadata_digest = digest
+        return len(upserts), len(removals)
+
+    def _apply_changes(self, upserts, removals):
+        """Merge changed documents into a copy of the index and swap it in.
+
+        Existing documents keep their order and new ones are appended, so the
+        result matches a full rebuild over the same documents. Postings are
+        merged with vectorized sorts rather than patched in place, which costs
+        O(postings) per batch but never exposes a half-updated index.
+        """
+        with self._update_lock:
+            index = self.index
+            old_ids = index.doc_ids_by_filename
+
+            # Removed documents disappear; updated ones keep their slot but lose their postings
+            deleted = np.zeros(index.total_images, dtype=bool)
+            deleted[[old_ids[filename] for filename in removals if filename in old_ids]] = True
+            stale = deleted.copy()
+            stale[[old_ids[filename] for filename in upserts if filename in old_ids]] = True
+
+            kept_docs = np.flatnonzero(~deleted)
+            new_doc_ids = np.cumsum(~deleted) - 1
+            # Rows of kept + changed records, in final doc id order
+            rows = np.arange(len(kept_docs))
+            appended_rows = []
+            changed_records = []
+            doc_token_counts = [int(count) for count in index.doc_token_counts[kept_docs]]
+
+            # Analyze changed documents and place them at their old slot or at the end
+            filenames = list(upserts)
+            processed_texts = self.analyzer.analyze_batch([surrogate_text(upserts[name]) for name in filenames])
+            changed_docs = []
+            for filename, doc in zip(filenames, processed_texts):
+                record = surrogate_record(filename, upserts[filename])
+                row = len(kept_docs) + len(changed_records)
+                changed_records.append(record)
+                if filename in old_ids:
+                    doc_id = int(new_doc_ids[old_ids[filename]])
+                    rows[doc_id] = row
+                    doc_token_counts[doc_id] = len(doc)
+                else:
+                    doc_id = len(doc_token_counts)
+                    appended_rows.append(row)
+                    doc_token_counts.append(len(doc))
+                changed_docs.append((doc_id, doc))
+            total_images = len(doc_token_counts)
+            order = np.concatenate([rows, np.array(appended_rows, dtype=np.int64)])
+            image_metadata = index.image_metadata.take(kept_docs).concat(
+                MetadataStore.from_records(changed_records)).take(order)
+            vectors = index.vectors.take(kept_docs).extend(
+                self._embed([record_text(record) for record in changed_records])).take(order)
+            facets = index.facets.take(kept_docs).concat(
+                FacetIndex.from_records([facet_record(upserts[name]) for name in filenames])).take(order)
+
+            # Autocomplete words lose the old texts of removed and updated documents and gain the new ones
+            word_changes = document_frequencies((record_text(record) for record in changed_records),
+                                                self.analyzer.stop_words)
+            word_changes.subtract(document_frequencies((record_text(index.image_metadata[doc_id])
+                                                        for doc_id in np.flatnonzero(stale).tolist()),
+                                                       self.analyzer.stop_words))
+            suggestions = index.suggestions.updated(word_changes)
+
+            # Merged vocabulary, with old term ids mapped to their new positions
+            new_postings = [(term, doc_id, freq) for doc_id, doc in changed_docs for term, freq in Counter(doc).items()]
+            terms = sorted(set(index.terms).union(term for term, _, _ in new_postings))
+            term_ids = {term: term_id for term_id, term in enumerate(terms)}
+            old_term_ids = np.array([term_ids[term] for term in index.terms], dtype=np.int64)
+
+            # Sort keys (term id, doc id) for the surviving postings are already ascending,
+            # so a stable sort of both runs is a linear merge
+            old_docs, old_freqs = index.posting_arrays()
+            keep = ~stale[old_docs]
+            old_terms_per_posting = np.repeat(old_term_ids, np.diff(index.term_offsets))[keep]
+            keys = np.concatenate([
+                old_terms_per_posting * total_images + new_doc_ids[old_docs[keep]],
+                np.array([term_ids[term] * total_images + doc_id for term, doc_id, _ in new_postings], dtype=np.int64),
+            ])
+            freqs = np.concatenate([old_freqs[keep],
+                                    np.array([freq for _, _, freq in new_postings], dtype=np.int32)])
+            order = np.argsort(keys, kind='stable')
+            keys, posting_freqs = keys[order], freqs[order]
+            posting_term_ids = keys // total_images if total_images else keys
+            posting_docs = (keys - posting_term_ids * total_images).astype(np.int32)
+
+            # Terms whose last posting went away are dropped, as a rebuild would
+            postings_per_term = np.bincount(posting_term_ids, minlength=len(terms))
+            live_terms = np.flatnonzero(postings_per_term)
+            term_offsets = np.zeros(len(live_terms) + 1, dtype=np.int64)
+            term_offsets[1:] = np.cumsum(postings_per_term[live_terms])
+
+            self._attach_index([terms[term_id] for term_id in live_terms.tolist()], term_offsets,
+                               posting_docs, posting_freqs.astype(np.int32),
+                               np.array(doc_token_counts, dtype=np.int32),
+                               self._compute_document_lengths(posting_docs, posting_freqs, total_images),
+                               image_metadata, vectors, suggestions=suggestions, facets=facets)
+
+    def save_snapshot(self, index_dir=None):
+        """Write the index to a versioned snapshot directory keyed by the metadata digest."""
+        index_dir = index_dir or self.index_dir
+        if self.metadata_digest is None:
+            raise ValueError("Index was edited directly and no longer matches metadata.json; "
+                             "use refresh_from_metadata() or rebuild before saving a snapshot")
+        index = self.index
+        target = snapshot_path(self.metadata_digest, index_dir)
+        os.makedirs(index_dir, exist_ok=True)
+
+        # Write into a scratch directory and rename it into place so that
+        # workers starting concurrently never see a half-written snapshot
+        staging = tempfile.mkdtemp(prefix='.staging-', dir=index_dir)
+        try:
+            np.save(os.path.join(staging, 'term_offsets.npy'), index.term_offsets)
+            if index.compressed is not None:
+                index.compressed.save(staging)
+            else:
+                np.save(os.path.join(staging, 'posting_docs.npy'), index.posting_docs)
+                np.save(os.path.join(staging, 'posting_freqs.npy'), index.posting_freqs)
+            np.save(os.path.join(staging, 'doc_token_counts.npy'), index.doc_token_counts)
+            np.save(os.path.join(staging, 'doc_lengths.npy'), index.doc_lengths)
+            np.save(os.path.join(staging, 'term_max_impacts.npy'), index.scorer.term_max_impacts)
+            with open(os.path.join(staging, 'terms.json'), 'w') as f:
+                json.dump(index.terms, f)
+            index.image_metadata.save(staging)
+            index.vectors.save(staging)
+            index.suggestions.save(staging, 'words')
+            index.facets.save(staging)
+            with open(os.path.join(staging, 'analyzer_memo.json'), 'w') as f:
+                json.dump(self.analyzer.memo, f)
+            with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+                json.dump({
+                    'version': SNAPSHOT_VERSION,
+                    'metadata_sha256': self.metadata_digest,
+                    'num_docs': index.total_images,
+                    'num_terms': len(index.terms),
+                    'num_postings': int(index.term_offsets[-1]),
+                    'postings_format': self.postings_format,
+                    'embedder': self.embedder.name,
+                    'embedding_dtype': index.vectors.dtype,
+                }, f, indent=2)
+
+            if self._snapshot_usable(target):
+                shutil.rmtree(staging)
+            else:
+                if os.path.isdir(target):
+                    # Same metadata but other embedding settings; move it aside so the rename can land
+                    retired = tempfile.mkdtemp(prefix='.retired-', dir=index_dir)
+                    os.rename(target, os.path.join(retired, 'snapshot'))
+                    shutil.rmtree(retired, ignore_errors=True)
+                os.rename(staging, target)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        # Drop generations built from older metadata
+        for name in os.listdir(index_dir):
+            path = os.path.join(index_dir, name)
+            if path != target and not name.startswith('.') and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+        return target
+
+    @property
+    def postings_format(self):
+        """How postings are held and snapshotted: 'varint' blocks or flat 'csr' arrays."""
+        return 'varint' if self.compress_postings else 'csr'
+
+    def _snapshot_usable(self, path):
+        """Whether the snapshot at path was written for this metadata, layout and embedding settings."""
+        try:
+            with open(os.path.join(path, 'manifest.json'), 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        # Embeddings from another model are not comparable with this one's queries
+        return (manifest.get('version') == SNAPSHOT_VERSION and manifest.get('metadata_sha256') == self.metadata_digest
+                and manifest.get('embedder') == self.embedder.name
+                and manifest.get('embedding_dtype') == self.vector_dtype
+                and manifest.get('postings_format') == self.postings_format)
+
+    def _load_snapshot(self):
+        """Memory-map a snapshot matching the current metadata. Returns False if none is usable."""
+        path = snapshot_path(self.metadata_digest, self.index_dir)
+        if not self._snapshot_usable(path):
+            return False
+        try:
+            # Read-only mmaps let every worker share the same page cache
+            names = ['term_offsets', 'doc_token_counts', 'doc_lengths', 'term_max_impacts']
+            if self.compress_postings:
+                arrays = {'posting_docs': None, 'posting_freqs': None, 'compressed': CompressedPostings.load(path)}
+            else:
+                arrays = {}
+                names += ['posting_docs', 'posting_freqs']
+            arrays.update((name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')) for name in names)
+            with open(os.path.join(path, 'terms.json'), 'r') as f:
+                terms = json.load(f)
+            image_metadata = MetadataStore.load(path)
+            vectors = VectorIndex.load(path)
+            suggestions = PrefixIndex.load(path, 'words')
+            facets = FacetIndex.load(path)
+            with open(os.path.join(path, 'analyzer_memo.json'), 'r') as f:
+                self.analyzer.warm(json.load(f))
+        except (OSError, ValueError):
+            return False
+
+        self._attach_index(terms, image_metadata=image_metadata, vectors=vectors, suggestions=suggestions,
+                           facets=facets, **arrays)
+        return True
+
+    def search_vsm(self, query, top_k=None, collapse=False, stream=False, filters=None):
+        """Vector Space Model search with proper cosine similarity normalization.
+
+        With a FacetFilter only the images it selects are scored.
+        """
+        index = self.index
+        return self._traced('vsm', lambda: self._results(
+            index, self._ranked_vsm(index, self._prepare_text(query), top_k, collapse, filters=filters), stream))
+
+    def _ranked_vsm(self, index, processed_query, top_k, collapse, scorer=None, filters=None):
+        def compute():
+            doc_ids = self._selection(index, filters)
+            return self._rank(index, lambda k: index.rank_vsm(processed_query, k, self.scoring, scorer, doc_ids),
+                              top_k, collapse)
+
+        # The query vector depends only on term counts, so word order is not part of the key
+        key = ('vsm', tuple(sorted(Counter(processed_query).items())), top_k, self.scoring, index.number, collapse,
+               filters.key if filters else None)
+        return self.result_cache.get_or_compute(key, compute)
+
+    def _selection(self, index, filters):
+        """Ascending doc ids a FacetFilter selects in an index generation, or None to rank every document."""
+        if not filters:
+            return None
+        return self.selection_cache.get_or_compute((filters.key, index.number), lambda: index.select(filters))
+
+    def _traced(self, method, search):
+        """search(), with the time it spent in each stage handed to every stage hook."""
+        if not self.stage_hooks:
+            return search()
+        with tracing() as trace:
+            results = search()
+        for hook in self.stage_hooks:
+            hook(method, trace.stages)
+        return results
+
+    @staticmethod
+    def _rank(index, rank, top_k, collapse):
+        """Ranked (doc_ids, scores) from rank(k), with near-duplicates collapsed if asked."""
+        return index.collapse_duplicates(rank, top_k) if collapse else rank(top_k)
+
+    @staticmethod
+    def _results(index, ranked, stream):
+        """Result list for ranked (doc_ids, scores), or an iterator that assembles them lazily."""
+        return index.iter_results(*ranked) if stream else index.assemble_results(*ranked)
+
+    def score_vsm(self, query):
+        """Cosine similarity of every document to the query, indexed by doc id."""
+        return self.index.score_vsm(self._prepare_text(query), self.scoring)
+
+    def search_bm25(self, query, k1=1.5, b=0.75, top_k=None, collapse=False, stream=False, filters=None):
+        """BM25 search, over the images a FacetFilter selects if one is given."""
+        index = self.index
+        return self._traced('bm25', lambda: self._results(
+            index, self._ranked_bm25(index, self._prepare_text(query), k1, b, top_k, collapse, filters=filters),
+            stream))
+
+    def _ranked_bm25(self, index, processed_query, k1, b, top_k, collapse, scorer=None, filters=None):
+        def compute():
+            doc_ids = self._selection(index, filters)
+            return self._rank(index, lambda k: index.rank_bm25(processed_query, k1, b, k, self.scoring, scorer,
+                                                               doc_ids), top_k, collapse)
+
+        # Repeated terms count twice and term order fixes the summation order, so key on the sequence
+        key = ('bm25', tuple(processed_query), k1, b, top_k, self.scoring, index.number, collapse,
+               filters.key if filters else None)
+        return self.result_cache.get_or_compute(key, compute)
+
+    def score_bm25(self, query, k1=1.5, b=0.75):
+        """BM25 score of every document for the query, indexed by doc id."""
+        return self.index.score_bm25(self._prepare_text(query), k1, b, self.scoring)
+
+    def search_semantic(self, query, top_k=None, collapse=False, nprobe=None, stream=False, filters=None):
+        """Semantic search by embedding similarity; nprobe searches only that many IVF lists.
+
+        With a FacetFilter only the embeddings of the images it selects are read.
+        """
+        index = self.index
+        return self._traced('semantic', lambda: self._results(
+            index, self._ranked_semantic(index, query, top_k, collapse, nprobe, filters=filters), stream))
+
+    def _ranked_semantic(self, index, query, top_k, collapse, nprobe, query_vector=None, filters=None):
+        def compute():
+            vector = self._embed([query])[0] if query_vector is None else query_vector
+            doc_ids = self._selection(index, filters)
+            return self._rank(index, lambda k: index.rank_semantic(vector, k, nprobe, doc_ids), top_k, collapse)
+
+        key = ('semantic', query, self.embedder.name, top_k, nprobe, index.number, collapse,
+               filters.key if filters else None)
+        return self.result_cache.get_or_compute(key, compute)
+
+    def search_hybrid(self, query, k1=1.5, b=0.75, top_k=None, collapse=False, rrf_k=60, depth=100, nprobe=None,
+                      stream=False, filters=None):
+        """BM25 and semantic rankings fused with reciprocal rank fusion.
+
+        Each ranking is cut at max(depth, k) before fusing, so a document
+        ranked deep in both lists can be missing from a long result list.
+        With a FacetFilter both rankings cover only the images it selects.
+        """
+        index = self.index
+        return self._traced('hybrid', lambda: self._results(
+            index, self._ranked_hybrid(index, query, self._prepare_text(query), k1, b, top_k, collapse, rrf_k, depth,
+                                       nprobe, filters=filters), stream))
+
+    def _ranked_hybrid(self, index, query, processed_query, k1, b, top_k, collapse, rrf_k, depth, nprobe,
+                       query_vector=None, scorer=None, filters=None):
+        def compute():
+            vector = self._embed([query])[0] if query_vector is None else query_vector
+            doc_ids = self._selection(index, filters)
+            # Restricted once here rather than on every widening in _rank
+            restricted = index.restrict(scorer, doc_ids)
+
+            def rank(k):
+                cut = None if k is None else max(depth, k)
+                lexical, _ = index.rank_bm25(processed_query, k1, b, cut, self.scoring, restricted, doc_ids)
+                semantic, _ = index.rank_semantic(vector, cut, nprobe, doc_ids)
+                with stage('ranking'):
+                    return reciprocal_rank_fusion([lexical, semantic], rrf_k, k)
+
+            return self._rank(index, rank, top_k, collapse)
+
+        key = ('hybrid', query, tuple(processed_query), k1, b, self.embedder.name, rrf_k, depth, nprobe, top_k,
+               self.scoring, index.number, collapse, filters.key if filters else None)
+        return self.result_cache.get_or_compute(key, compute)
+
+    def search_batch(self, queries, method='vsm', top_k=None, collapse=False, nprobe=None, stream=False,
+                     filters=None):
+        """Rank many queries with one method against the same index generation.
+
+        Queries are analyzed (and embedded) in one pass, repeated queries
+        are ranked once, and each query term's postings are read, or
+        decoded, once for the whole batch. Returns a result list per query,
+        or lazy iterators with stream=True. Results and cache entries are
+        the same as the single-query methods'. A FacetFilter applies to
+        every query of the batch.
+        """
+        if method not in SEARCH_METHODS:
+            raise ValueError(f"Unknown search method {method!r}")
+        return self._traced(f"{method}_batch", lambda: self._search_batch(queries, method, top_k, collapse, nprobe,
+                                                                          stream, filters))
+
+    def _search_batch(self, queries, method, top_k, collapse, nprobe, stream, filters):
+        index = self.index
+        unique = list(dict.fromkeys(queries))
+        with stage('analysis'):
+            processed = dict(zip(unique, self.analyzer.analyze_batch(unique)))
+        vectors = dict(zip(unique, self._embed(unique))) if method in ('semantic', 'hybrid') else {}
+        # The filter is the same for every query, so its restriction is applied once to the shared scorer
+        doc_ids = self._selection(index, filters)
+        scorer = index.restrict(index.scorer.batch(), doc_ids)
+
+        ranked = {}
+        for query in unique:
+            if method == 'vsm':
+                ranked[query] = self._ranked_vsm(index, processed[query], top_k, collapse, scorer, filters)
+            elif method == 'bm25':
+                ranked[query] = self._ranked_bm25(index, processed[query], 1.5, 0.75, top_k, collapse, scorer,
+                                                  filters)
+            elif method == 'semantic':
+                ranked[query] = self._ranked_semantic(index, query, top_k, collapse, nprobe, vectors[query], filters)
+            else:
+                ranked[query] = self._ranked_hybrid(index, query, processed[query], 1.5, 0.75, top_k, collapse,
+                                                    60, 100, nprobe, vectors[query], scorer, filters)
+        return [self._results(index, ranked[query], stream) for query in queries]
+
+    def suggest(self, text, limit=SUGGEST_LIMIT):
+        """Completions of partly typed query text.
+
+        Popular past queries starting with the text come first, then the
+        text with its last word completed from the indexed words, most
+        frequent first. Nothing is completed after a trailing space.
+        """
+        words = text.lower().split()
+        typed = ' '.join(words) + (' ' if words and text[-1].isspace() else '')
+        suggestions = [query for query, _ in self.query_log.complete(typed, limit)] if words else []
+        partial = PUNCTUATION.sub('', words[-1]) if words and not text[-1].isspace() else ''
+        if partial:
+            head = ' '.join(words[:-1])
+            for word, _ in self.index.suggestions.complete(partial, limit):
+                completion = f"{head} {word}" if head else word
+                if completion not in suggestions:
+                    suggestions.append(completion)
+        return suggestions[:limit]
+
+    def get_all_images(self, filters=None):
+        """Get all images with their metadata, or only those a FacetFilter selects, in gallery order.
+
+        Filtered browsing intersects bitmaps and reads the selected records
+        lazily; nothing is scored.
+        """
+        index = self.index
+        if not filters:
+            return index.image_metadata
+        return MetadataSubset(index.image_metadata, self._selection(index, filters))
+
+    def facet_counts(self, filters=None):
+        """Images per detected object and per model, among those a FacetFilter selects if one is given."""
+        index = self.index
+        return index.facets.counts(index.facets.select(filters) if filters else None)
+
+    def get_image(self, filename):
+        """Metadata for one image by filename, or None if it is not indexed."""
+        return self.index.get_image(filename)
+
+
+if __name__ == "__main__":
+    import nltk
+    nltk.download('stopwords', quiet=True)
+    nltk.download('wordnet', quiet=True)
 
-    def get_all_images(self):
-        """Get all images with their metadata."""
-        return self.image_metadata
\ No newline at end of file
+    print("🚀 Building search index snapshot")
+    # Same settings as the app, VISUAL_VOYAGER_SETTINGS included, or it would not accept the snapshot
+    engine = ImageSearchEngine(use_snapshot=False, **engine_options(load_settings()))
+    path = engine.save_snapshot()
+    print(f"📚 Indexed {engine.total_images} images, {len(engine.terms)} terms")
+    print(f"💾 Snapshot saved to {path}")
@@ -0,0 +1,99 @@
+import json
+import os
+import tempfile
+
+
+def journal_path(metadata_file):
+    """Journal that sits next to a metadata file."""
+    return os.path.splitext(metadata_file)[0] + '.journal.jsonl'
+
+
+class MetadataJournal:
+    """Append-only JSON Lines journal of changes to metadata.json.
+
+    The crawler and analyser append one {"filename": ..., "data": {...}}
+    record per image instead of rewriting the whole metadata file, so a
+    write costs O(record) and an interrupted run loses at most the record
+    being written. load() replays the journal over the last compacted
+    metadata.json, and compact() folds it back in with an atomic rename.
+    Compaction assumes no other process is appending at the same time.
+    """
+
+    def __init__(self, metadata_file):
+        self.metadata_file = metadata_file
+        self.path = journal_path(metadata_file)
+        # Whether the journal may still end in a torn line from an earlier crash
+        self._check_tail = True
+
+    def load(self):
+        """Current {filename: entry} state: the metadata file plus every journaled change."""
+        metadata = {}
+        if os.path.exists(self.metadata_file):
+            with open(self.metadata_file, 'r') as f:
+                metadata = json.load(f)
+        for filename, data in self.records():
+            metadata.setdefault(filename, {}).update(data)
+        return metadata
+
+    def records(self):
+        """Journaled (filename, data) changes in write order."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    filename, data = record['filename'], record['data']
+                except (ValueError, KeyError, TypeError):
+                    # A crash mid-append leaves a torn line; records before and after it are intact
+                    continue
+                yield filename, data
+
+    def append(self, filename, data):
+        """Merge data into filename's entry by appending one journal record."""
+        line = json.dumps({'filename': filename, 'data': data}, separators=(',', ':')) + '\n'
+        if self._check_tail:
+            # Start on a fresh line after a torn one, or this record would be glued onto it and lost too
+            if self._torn_tail():
+                line = '\n' + line
+            self._check_tail = False
+        # One write() on an O_APPEND descriptor keeps records whole even with two tools appending
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    def _torn_tail(self):
+        """Whether the journal ends part-way through a line."""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    return False
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) != b'\n'
+        except FileNotFoundError:
+            return False
+
+    def compact(self):
+        """Rewrite the metadata file with all journaled changes applied, then drop the journal."""
+        metadata = self.load()
+        directory = os.path.dirname(os.path.abspath(self.metadata_file))
+        fd, staging = tempfile.mkstemp(prefix='.metadata-', suffix='.json', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(metadata, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(staging, self.metadata_file)
+        except BaseException:
+            if os.path.exists(staging):
+                os.remove(staging)
+            raise
+
+        # Replaying the journal over the new file is a no-op, so a crash before this is harmless
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._check_tail = False
+        return metadata
@@ -0,0 +1,111 @@
+import os
+from collections.abc import Sequence
+import numpy as np
+
+FIELDS = ('filename', 'source_url', 'alt_text', 'caption', 'dhash')
+
+
+class MetadataStore(Sequence):
+    """Columnar per-image metadata, indexed by doc id.
+
+    Each field is stored as one UTF-8 byte blob plus an offsets array, so a
+    million records cost a handful of arrays instead of a million dicts, and
+    a snapshot can memory-map them directly. Indexing returns the same dict
+    shape the templates have always used.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._length = len(columns[FIELDS[0]][1]) - 1
+
+    @classmethod
+    def from_records(cls, records):
+        """Build a store from an iterable of metadata dicts."""
+        records = list(records)
+        columns = {}
+        for field in FIELDS:
+            encoded = [record[field].encode('utf-8') for record in records]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(value) for value in encoded])
+            columns[field] = (np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+        return cls(columns)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Open columns written by save()."""
+        return cls({field: (np.load(os.path.join(directory, f"documents_{field}.npy"), mmap_mode=mmap_mode),
+                            np.load(os.path.join(directory, f"documents_{field}_offsets.npy"), mmap_mode=mmap_mode))
+                    for field in FIELDS})
+
+    def save(self, directory):
+        """Write each column as a blob and an offsets .npy file."""
+        for field, (blob, offsets) in self.columns.items():
+            np.save(os.path.join(directory, f"documents_{field}.npy"), blob)
+            np.save(os.path.join(directory, f"documents_{field}_offsets.npy"), offsets)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, doc_id):
+        if isinstance(doc_id, slice):
+            return [self[i] for i in range(*doc_id.indices(self._length))]
+        if doc_id < 0:
+            doc_id += self._length
+        if not 0 <= doc_id < self._length:
+            raise IndexError(doc_id)
+        return {field: self.value(field, doc_id) for field in FIELDS}
+
+    def value(self, field, doc_id):
+        """A single field of one record."""
+        blob, offsets = self.columns[field]
+        return bytes(blob[offsets[doc_id]:offsets[doc_id + 1]]).decode('utf-8')
+
+    def column(self, field):
+        """Every value of one field, in doc id order."""
+        blob, offsets = self.columns[field]
+        data = bytes(blob)
+        bounds = offsets.tolist()
+        text = data.decode('utf-8')
+        if len(text) == len(data):
+            # Pure ASCII, so byte offsets are character offsets and one decode suffices
+            return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+        return [data[start:end].decode('utf-8') for start, end in zip(bounds, bounds[1:])]
+
+    def take(self, doc_ids):
+        """New store holding the given records, in the given order."""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        columns = {}
+        for field, (blob, offsets) in self.columns.items():
+            starts, lengths = offsets[doc_ids], offsets[doc_ids + 1] - offsets[doc_ids]
+            new_offsets = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+            new_offsets[1:] = np.cumsum(lengths)
+            # Byte i of the output comes from its record's start plus its position within the record
+            positions = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+            columns[field] = (np.asarray(blob)[positions], new_offsets)
+        return MetadataStore(columns)
+
+    def concat(self, other):
+        """New store with other's records appended after this one's."""
+        columns = {}
+        for field in FIELDS:
+            blob, offsets = self.columns[field]
+            other_blob, other_offsets = other.columns[field]
+            columns[field] = (np.concatenate([blob, other_blob]),
+                              np.concatenate([offsets, other_offsets[1:] + offsets[-1]]))
+        return MetadataStore(columns)
+
+
+class MetadataSubset(Sequence):
+    """Records of the given doc ids of a MetadataStore, in the given order, read only when indexed."""
+
+    def __init__(self, store, doc_ids):
+        self.store = store
+        self.doc_ids = doc_ids
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.store[doc_id] for doc_id in self.doc_ids[i].tolist()]
+        return self.store[int(self.doc_ids[i])]
@@ -0,0 +1,185 @@
+import os
+import numpy as np
+
+# Postings per block; each block can be decoded on its own and skipped by its last doc id
+BLOCK_SIZE = 128
+
+ARRAYS = ('term_offsets', 'term_blocks', 'block_postings', 'block_last_doc',
+          'block_doc_bytes', 'block_freq_bytes', 'doc_bytes', 'freq_bytes')
+
+
+def varint_encode(values):
+    """LEB128 bytes of non-negative integers and the byte offset where each value starts."""
+    values = np.asarray(values, dtype=np.int64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for bits in (7, 14, 21, 28, 35):
+        lengths += values >= (1 << bits)
+    starts = np.zeros(len(values) + 1, dtype=np.int64)
+    starts[1:] = np.cumsum(lengths)
+    blob = np.empty(int(starts[-1]), dtype=np.uint8)
+    for j in range(int(lengths.max()) if len(values) else 0):
+        present = np.flatnonzero(lengths > j)
+        byte = (values[present] >> (7 * j)) & 0x7f
+        byte |= np.where(lengths[present] > j + 1, 0x80, 0)
+        blob[starts[present] + j] = byte
+    return blob, starts
+
+
+def varint_decode(blob):
+    """Integers from a run of LEB128 bytes."""
+    blob = np.asarray(blob)
+    if not len(blob) or blob.max() < 0x80:
+        # Every value fits in one byte, the common case for gaps in dense lists and for frequencies
+        return blob.astype(np.int64)
+    ends = blob < 0x80
+    starts = np.flatnonzero(np.concatenate([[True], ends[:-1]]))
+    value_ids = np.cumsum(ends) - ends
+    shifts = 7 * (np.arange(len(blob)) - starts[value_ids])
+    return np.add.reduceat((blob & 0x7f).astype(np.int64) << shifts, starts)
+
+
+def byte_ranges(starts, ends):
+    """Concatenated positions of the ranges [starts[i], ends[i])."""
+    lengths = ends - starts
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    return np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+
+
+class CompressedPostings:
+    """Postings lists as delta + varint coded blocks with skip pointers.
+
+    Doc ids of each term are stored as gaps from the previous doc id, and
+    both gaps and frequencies as LEB128 varints in two parallel byte blobs.
+    Every BLOCK_SIZE postings form a block whose byte offsets and last doc
+    id are kept, so a block decodes on its own (from the previous block's
+    last doc id) and a conjunctive query only decodes the blocks that can
+    hold its candidates. Decoding is vectorized over whole runs of blocks.
+    """
+
+    def __init__(self, term_offsets, term_blocks, block_postings, block_last_doc,
+                 block_doc_bytes, block_freq_bytes, doc_bytes, freq_bytes):
+        self.term_offsets = term_offsets
+        self.term_blocks = term_blocks
+        self.block_postings = block_postings
+        self.block_last_doc = block_last_doc
+        self.block_doc_bytes = block_doc_bytes
+        self.block_freq_bytes = block_freq_bytes
+        self.doc_bytes = doc_bytes
+        self.freq_bytes = freq_bytes
+        self.block_starts_term = np.zeros(len(block_postings) - 1, dtype=bool)
+        self.block_starts_term[term_blocks[:-1][np.diff(term_blocks) > 0]] = True
+
+    @classmethod
+    def encode(cls, term_offsets, posting_docs, posting_freqs, block_size=BLOCK_SIZE):
+        """Compress CSR postings whose doc ids ascend within each term."""
+        term_offsets = np.asarray(term_offsets, dtype=np.int64)
+        docs = np.asarray(posting_docs, dtype=np.int64)
+        counts = np.diff(term_offsets)
+
+        # Gap from the previous posting of the same term; a term's first doc id is its own gap
+        previous = np.zeros(len(docs), dtype=np.int64)
+        previous[1:] = docs[:-1]
+        previous[term_offsets[:-1][counts > 0]] = 0
+        doc_bytes, doc_starts = varint_encode(docs - previous)
+        freq_bytes, freq_starts = varint_encode(posting_freqs)
+
+        # Blocks restart at every term so a block never spans two lists
+        blocks_per_term = -(-counts // block_size)
+        term_blocks = np.zeros(len(counts) + 1, dtype=np.int64)
+        term_blocks[1:] = np.cumsum(blocks_per_term)
+        block_terms = np.repeat(np.arange(len(counts)), blocks_per_term)
+        block_postings = np.empty(int(term_blocks[-1]) + 1, dtype=np.int64)
+        block_postings[:-1] = term_offsets[block_terms] + (np.arange(len(block_terms)) -
+                                                           term_blocks[block_terms]) * block_size
+        block_postings[-1] = len(docs)
+        return cls(term_offsets, term_blocks, block_postings,
+                   np.asarray(posting_docs, dtype=np.int32)[block_postings[1:] - 1] if len(docs)
+                   else np.zeros(0, dtype=np.int32),
+                   doc_starts[block_postings], freq_starts[block_postings], doc_bytes, freq_bytes)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Open arrays written by save()."""
+        return cls(*(np.load(os.path.join(directory, f"postings_{name}.npy"), mmap_mode=mmap_mode)
+                     for name in ARRAYS))
+
+    def save(self, directory):
+        """Write every array as a postings_*.npy file."""
+        for name in ARRAYS:
+            np.save(os.path.join(directory, f"postings_{name}.npy"), getattr(self, name))
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ARRAYS)
+
+    def __len__(self):
+        return int(self.term_offsets[-1])
+
+    def decode_blocks(self, blocks):
+        """Doc ids and frequencies of the given ascending block ids, concatenated."""
+        blocks = np.asarray(blocks, dtype=np.int64)
+        if not len(blocks):
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        if blocks[-1] - blocks[0] == len(blocks) - 1:
+            # A contiguous run of blocks is one contiguous run of bytes
+            first, last = blocks[0], blocks[-1] + 1
+            gaps = varint_decode(self.doc_bytes[self.block_doc_bytes[first]:self.block_doc_bytes[last]])
+            freqs = varint_decode(self.freq_bytes[self.block_freq_bytes[first]:self.block_freq_bytes[last]])
+        else:
+            gaps = varint_decode(np.asarray(self.doc_bytes)[
+                byte_ranges(self.block_doc_bytes[blocks], self.block_doc_bytes[blocks + 1])])
+            freqs = varint_decode(np.asarray(self.freq_bytes)[
+                byte_ranges(self.block_freq_bytes[blocks], self.block_freq_bytes[blocks + 1])])
+
+        # Prefix sums restart at each block from the last doc id of the block before it in the same term
+        lengths = self.block_postings[blocks + 1] - self.block_postings[blocks]
+        starts = np.zeros(len(blocks), dtype=np.int64)
+        starts[1:] = np.cumsum(lengths)[:-1]
+        sums = np.cumsum(gaps)
+        before = np.where(starts > 0, sums[starts - 1], 0)
+        bases = np.where(self.block_starts_term[blocks], 0, self.block_last_doc[np.maximum(blocks - 1, 0)])
+        return (sums - np.repeat(before - bases, lengths)).astype(np.int32), freqs.astype(np.int32)
+
+    def postings(self, term_id):
+        """Doc ids and frequencies of one term."""
+        first, last = self.term_blocks[term_id], self.term_blocks[term_id + 1]
+        # A whole list is one run of gaps starting from zero, so a single prefix sum restores it
+        gaps = varint_decode(self.doc_bytes[self.block_doc_bytes[first]:self.block_doc_bytes[last]])
+        freqs = varint_decode(self.freq_bytes[self.block_freq_bytes[first]:self.block_freq_bytes[last]])
+        return np.cumsum(gaps).astype(np.int32), freqs.astype(np.int32)
+
+    def decode_all(self):
+        """Every term's postings as flat CSR (posting_docs, posting_freqs) arrays."""
+        return self.decode_blocks(np.arange(len(self.block_postings) - 1))
+
+    def postings_among(self, term_id, candidates):
+        """Postings of one term whose doc ids are among ascending candidates, decoding only blocks that can match."""
+        first, last = self.term_blocks[term_id], self.term_blocks[term_id + 1]
+        # Skip pointers: the first block whose last doc id reaches each candidate is the only one that can hold it
+        hits = np.searchsorted(self.block_last_doc[first:last], candidates)
+        hits = hits[hits < last - first]
+        # Candidates ascend, so equal hits are adjacent
+        blocks = hits[np.concatenate([[True], hits[1:] != hits[:-1]])] + first if len(hits) else hits
+        if 2 * len(blocks) > last - first:
+            # Most blocks are needed anyway, and one contiguous decode is cheaper than gathering them
+            docs, freqs = self.postings(term_id)
+        else:
+            docs, freqs = self.decode_blocks(blocks)
+        if not len(docs) or not len(candidates):
+            return docs[:0], freqs[:0]
+        positions = np.minimum(np.searchsorted(candidates, docs), len(candidates) - 1)
+        keep = candidates[positions] == docs
+        return docs[keep], freqs[keep]
+
+    def intersect(self, term_ids):
+        """Ascending doc ids found in every given term's postings, decoding only blocks that can match."""
+        term_ids = sorted(term_ids, key=lambda term_id: self.term_offsets[term_id + 1] - self.term_offsets[term_id])
+        if not term_ids:
+            return np.zeros(0, dtype=np.int32)
+        candidates = self.postings(term_ids[0])[0]
+        for term_id in term_ids[1:]:
+            if not len(candidates):
+                break
+            candidates = self.postings_among(term_id, candidates)[0]
+        return candidates
@@ -0,0 +1,386 @@
+import copy
+from functools import partial
+import numpy as np
+from postings import CompressedPostings
+from instrumentation import stage, propagate
+
+# Relative tolerance when comparing upper bounds against partial scores,
+# which are summed in a different order than the final scores
+BOUND_SLACK = 1e-9
+
+
+class CSRScorer:
+    """Vectorized VSM/BM25 scoring over the CSR postings arrays.
+
+    Per-document statistics are precomputed once so that scoring a query is a
+    handful of gathers and scatter-adds per query term. Arithmetic is done in
+    float64 in the same order as the reference loops in ImageSearchEngine, so
+    scores match them bit for bit.
+
+    Top-k queries use MaxScore-style dynamic pruning: terms are scored in
+    decreasing order of their upper-bound impact until the k-th best partial
+    score exceeds what the remaining terms could add, and only the surviving
+    candidates are looked up in the remaining postings lists. Partial scores
+    are kept sparse, for the documents met so far, so a step costs the length
+    of its postings list rather than the corpus size.
+
+    Given `compressed` postings instead of the flat arrays, each query term's
+    list is decoded when it is scored. Copies made by restricted() only read
+    the postings of an allowed set of documents, so filtered-out documents
+    are never scored.
+    """
+
+    # Postings read so far, on copies made by batch()
+    _postings_memo = None
+
+    # Ascending doc ids (and, over flat postings, their mask) on copies made by restricted()
+    allowed = None
+    _allowed_mask = None
+
+    def __init__(self, term_offsets, posting_docs, posting_freqs, doc_token_counts, doc_lengths,
+                 term_max_impacts=None, avg_doc_len=None, compressed=None):
+        self.term_offsets = term_offsets
+        self.posting_docs = posting_docs
+        self.posting_freqs = posting_freqs
+        self.compressed = compressed
+        self.total_images = len(doc_token_counts)
+
+        self.doc_token_counts = np.asarray(doc_token_counts, dtype=np.float64)
+        self.doc_lengths = np.asarray(doc_lengths, dtype=np.float64)
+        if avg_doc_len is None:
+            avg_doc_len = np.mean(doc_token_counts) if self.total_images else 0.0
+        self.avg_doc_len = avg_doc_len
+        self._length_factors = {}
+        self._bm25_max_impacts = {}
+
+        if term_max_impacts is None:
+            term_max_impacts = vsm_max_impacts(term_offsets, *self.all_postings(), doc_token_counts, doc_lengths)
+        self.term_max_impacts = term_max_impacts
+
+    def batch(self):
+        """Copy of this scorer that reads each term's postings only once, for ranking a batch of queries."""
+        scorer = copy.copy(self)
+        scorer._postings_memo = {}
+        return scorer
+
+    def restricted(self, doc_ids):
+        """Copy of this scorer that only sees the given ascending doc ids, e.g. the matches of a filter."""
+        scorer = copy.copy(self)
+        scorer.allowed = doc_ids
+        if self.compressed is None:
+            scorer._allowed_mask = np.zeros(self.total_images, dtype=bool)
+            scorer._allowed_mask[doc_ids] = True
+        if self._postings_memo is not None:
+            scorer._postings_memo = {}
+        return scorer
+
+    def postings(self, term_id):
+        """Doc ids and frequencies for a term, only of the allowed documents on a restricted() copy."""
+        memo = self._postings_memo
+        if memo is not None and term_id in memo:
+            return memo[term_id]
+        if self.compressed is not None:
+            # Skip pointers leave out the blocks holding none of the allowed documents
+            postings = self.compressed.postings(term_id) if self.allowed is None else \
+                self.compressed.postings_among(term_id, self.allowed)
+        else:
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            postings = self.posting_docs[start:end], self.posting_freqs[start:end]
+            if self._allowed_mask is not None:
+                keep = self._allowed_mask[postings[0]]
+                postings = postings[0][keep], postings[1][keep]
+        if memo is not None:
+            memo[term_id] = postings
+        return postings
+
+    def all_postings(self):
+        """Flat (posting_docs, posting_freqs), decoded for the occasion when only compressed lists are kept."""
+        if self.compressed is not None:
+            return self.compressed.decode_all()
+        return self.posting_docs, self.posting_freqs
+
+    def bm25_length_factors(self, k1, b):
+        """Per-document k1 * (1 - b + b * len / avg_len), cached per (k1, b)."""
+        key = (k1, b)
+        factors = self._length_factors.get(key)
+        if factors is None:
+            factors = k1 * (1 - b + b * (self.doc_token_counts / self.avg_doc_len))
+            self._length_factors[key] = factors
+        return factors
+
+    def bm25_max_impacts(self, k1, b):
+        """Per-term maximum of the BM25 tf saturation, cached per (k1, b)."""
+        key = (k1, b)
+        impacts = self._bm25_max_impacts.get(key)
+        if impacts is None:
+            factors = self.bm25_length_factors(k1, b)
+            posting_docs, posting_freqs = self.all_postings()
+            saturation = (posting_freqs * (k1 + 1)) / (posting_freqs + factors[posting_docs])
+            impacts = segment_max(saturation, self.term_offsets)
+            self._bm25_max_impacts[key] = impacts
+        return impacts
+
+    def _vsm_impact(self, weight, idf, docs, freqs):
+        doc_weights = (freqs / self.doc_token_counts[docs]) * idf
+        doc_weights /= self.doc_lengths[docs]
+        return weight * doc_weights
+
+    def _bm25_impact(self, idf, k1, b, docs, freqs):
+        numerator = freqs * (k1 + 1)
+        denominator = freqs + self.bm25_length_factors(k1, b)[docs]
+        return idf * (numerator / denominator)
+
+    def _vsm_terms(self, query_weights):
+        return [(term_id, partial(self._vsm_impact, weight, idf),
+                 weight * idf * self.term_max_impacts[term_id])
+                for term_id, weight, idf in query_weights]
+
+    def _bm25_terms(self, query_terms, k1, b):
+        max_impacts = self.bm25_max_impacts(k1, b)
+        return [(term_id, partial(self._bm25_impact, idf, k1, b), idf * max_impacts[term_id])
+                for term_id, idf in query_terms]
+
+    def _accumulate(self, terms):
+        scores = np.zeros(self.total_images, dtype=np.float64)
+        for term_id, impact, _ in terms:
+            with stage('postings'):
+                docs, freqs = self.postings(term_id)
+            with stage('scoring'):
+                scores[docs] += impact(docs, freqs)
+        return scores
+
+    def vsm_scores(self, query_weights):
+        """Cosine scores for a normalized query given as [(term_id, weight, idf), ...]."""
+        return self._accumulate(self._vsm_terms(query_weights))
+
+    def bm25_scores(self, query_terms, k1, b):
+        """BM25 scores for a query given as [(term_id, idf), ...], repeats included."""
+        return self._accumulate(self._bm25_terms(query_terms, k1, b))
+
+    def vsm_top_k(self, query_weights, top_k=None):
+        """Ranked (doc_ids, scores) for a VSM query, pruned when top_k is given."""
+        # Query and document weights share the idf factor, so impacts are never negative
+        return self._top_k(self._vsm_terms(query_weights), top_k, prunable=True)
+
+    def bm25_top_k(self, query_terms, k1, b, top_k=None):
+        """Ranked (doc_ids, scores) for a BM25 query, pruned when top_k is given."""
+        # Terms in more than half the corpus have negative idf, which breaks the bounds
+        prunable = all(idf >= 0 for _, idf in query_terms)
+        return self._top_k(self._bm25_terms(query_terms, k1, b), top_k, prunable)
+
+    def _top_k(self, terms, top_k, prunable):
+        if top_k is None or not prunable:
+            scores = self._accumulate(terms)
+            with stage('ranking'):
+                return rank_scores(scores, top_k)
+        if top_k <= 0 or not terms:
+            return select_top_k(np.zeros(0, dtype=np.int64), np.zeros(0), top_k)
+
+        # Score terms with the largest bounds first until nothing outside the
+        # current candidates can reach the k-th best score
+        order = sorted(range(len(terms)), key=lambda i: terms[i][2], reverse=True)
+        seen_docs, seen_scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        threshold = rest = 0.0
+        for step, i in enumerate(order):
+            term_id, impact, _ = terms[i]
+            with stage('postings'):
+                docs, freqs = self.postings(term_id)
+            with stage('scoring'):
+                seen_docs, seen_scores = add_sparse(seen_docs, seen_scores, docs, impact(docs, freqs))
+
+                rest = sum(terms[j][2] for j in order[step + 1:])
+                # Zero partial scores only lower the k-th best, so the bound stays safe
+                if len(seen_scores) >= top_k:
+                    threshold = np.partition(seen_scores, len(seen_scores) - top_k)[len(seen_scores) - top_k]
+                    if rest < threshold * (1 - BOUND_SLACK):
+                        break
+
+        cutoff = max(threshold - rest - threshold * BOUND_SLACK, 0.0)
+        candidates = seen_docs[(seen_scores > 0) & (seen_scores >= cutoff)]
+
+        # Exact scores for the survivors, summed in query order like _accumulate
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        for term_id, impact, _ in terms:
+            with stage('postings'):
+                docs, freqs = self.postings(term_id)
+                in_postings, in_candidates = intersect_sorted(docs, candidates)
+            with stage('scoring'):
+                scores[in_candidates] += impact(docs[in_postings], freqs[in_postings])
+        with stage('ranking'):
+            return select_top_k(candidates, scores, top_k)
+
+
+class ShardedScorer:
+    """CSRScorer interface over documents split into contiguous doc id shards.
+
+    Each shard holds the postings and per-document statistics of its own
+    doc id range and is scored by its own CSRScorer, on `executor` when one
+    is given. Corpus-wide statistics are merged before scoring: idf weights
+    arrive in the query from the global document frequencies, and the BM25
+    average length is the sum of the shards' token totals over all
+    documents. Every document therefore gets exactly its unsharded score,
+    and per-shard top-k lists merge into the unsharded top-k.
+    """
+
+    # Ascending doc ids on copies made by restricted()
+    allowed = None
+
+    def __init__(self, term_offsets, posting_docs, posting_freqs, doc_token_counts, doc_lengths, shards,
+                 term_max_impacts=None, executor=None, compress=False):
+        self.total_images = len(doc_token_counts)
+        self.executor = executor
+        shards = max(min(shards, self.total_images), 1)
+        self.bounds = np.linspace(0, self.total_images, shards + 1).astype(np.int64)
+
+        # Integer token totals sum exactly, so the merged average equals np.mean over all documents
+        token_totals = [int(np.sum(doc_token_counts[start:end], dtype=np.int64))
+                        for start, end in zip(self.bounds[:-1], self.bounds[1:])]
+        self.avg_doc_len = np.float64(sum(token_totals)) / self.total_images if self.total_images else 0.0
+
+        # Stable sort by shard keeps each shard's postings in term, then doc id order
+        num_terms = len(term_offsets) - 1
+        term_ids = np.repeat(np.arange(num_terms), np.diff(term_offsets))
+        posting_shards = np.searchsorted(self.bounds, posting_docs, side='right') - 1
+        order = np.argsort(posting_shards, kind='stable')
+        shard_starts = np.zeros(shards + 1, dtype=np.int64)
+        shard_starts[1:] = np.cumsum(np.bincount(posting_shards, minlength=shards))
+
+        self.shards = []
+        for shard, (start, end) in enumerate(zip(self.bounds[:-1], self.bounds[1:])):
+            postings = order[shard_starts[shard]:shard_starts[shard + 1]]
+            offsets = np.zeros(num_terms + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(np.bincount(term_ids[postings], minlength=num_terms))
+            docs, freqs = (posting_docs[postings] - start).astype(np.int32), posting_freqs[postings]
+            compressed = CompressedPostings.encode(offsets, docs, freqs) if compress else None
+            self.shards.append(CSRScorer(offsets, None if compress else docs, None if compress else freqs,
+                                         doc_token_counts[start:end], doc_lengths[start:end],
+                                         avg_doc_len=self.avg_doc_len, compressed=compressed))
+
+        if term_max_impacts is None:
+            term_max_impacts = np.max([shard.term_max_impacts for shard in self.shards], axis=0)
+        self.term_max_impacts = term_max_impacts
+
+    def batch(self):
+        """Copy whose shards each read a term's postings only once, for ranking a batch of queries."""
+        scorer = copy.copy(self)
+        scorer.shards = [shard.batch() for shard in self.shards]
+        return scorer
+
+    def restricted(self, doc_ids):
+        """Copy whose shards only see the given ascending doc ids."""
+        scorer = copy.copy(self)
+        scorer.allowed = doc_ids
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        cuts = np.searchsorted(doc_ids, self.bounds).tolist()
+        scorer.shards = [shard.restricted(doc_ids[lo:hi] - start)
+                         for shard, lo, hi, start in zip(self.shards, cuts, cuts[1:], self.bounds.tolist())]
+        return scorer
+
+    def _map(self, score):
+        if self.executor is None or len(self.shards) == 1:
+            return [score(shard) for shard in self.shards]
+        return list(self.executor.map(propagate(score), self.shards))
+
+    def _merge(self, ranked, top_k):
+        with stage('ranking'):
+            doc_ids = np.concatenate([doc_ids + start
+                                      for (doc_ids, _), start in zip(ranked, self.bounds[:-1].tolist())])
+            scores = np.concatenate([scores for _, scores in ranked])
+            # select_top_k breaks ties by position, so restore doc id order first
+            order = np.argsort(doc_ids, kind='stable')
+            return select_top_k(doc_ids[order], scores[order], top_k)
+
+    def vsm_scores(self, query_weights):
+        """Cosine scores for a normalized query given as [(term_id, weight, idf), ...]."""
+        return np.concatenate(self._map(lambda shard: shard.vsm_scores(query_weights)))
+
+    def bm25_scores(self, query_terms, k1, b):
+        """BM25 scores for a query given as [(term_id, idf), ...], repeats included."""
+        return np.concatenate(self._map(lambda shard: shard.bm25_scores(query_terms, k1, b)))
+
+    def vsm_top_k(self, query_weights, top_k=None):
+        """Ranked (doc_ids, scores) for a VSM query, merged from each shard's top k."""
+        return self._merge(self._map(lambda shard: shard.vsm_top_k(query_weights, top_k)), top_k)
+
+    def bm25_top_k(self, query_terms, k1, b, top_k=None):
+        """Ranked (doc_ids, scores) for a BM25 query, merged from each shard's top k."""
+        return self._merge(self._map(lambda shard: shard.bm25_top_k(query_terms, k1, b, top_k)), top_k)
+
+
+def segment_max(values, offsets):
+    """Maximum of values within each CSR segment, 0 for empty segments."""
+    maxima = np.zeros(len(offsets) - 1, dtype=np.float64)
+    nonempty = np.flatnonzero(np.diff(offsets) > 0)
+    if len(nonempty):
+        maxima[nonempty] = np.maximum.reduceat(values, offsets[:-1][nonempty])
+    return maxima
+
+
+def vsm_max_impacts(term_offsets, posting_docs, posting_freqs, doc_token_counts, doc_lengths):
+    """Per-term maximum of tf / doc_len / doc_norm, the idf-free part of a VSM document weight."""
+    counts = np.asarray(doc_token_counts, dtype=np.float64)
+    norms = np.asarray(doc_lengths, dtype=np.float64)
+    impacts = (posting_freqs / counts[posting_docs]) / norms[posting_docs]
+    return segment_max(impacts, term_offsets)
+
+
+def intersect_sorted(a, b):
+    """Positions in a and in b of the values both sorted, duplicate-free arrays share."""
+    if len(a) > len(b):
+        in_b, in_a = intersect_sorted(b, a)
+        return in_a, in_b
+    if not len(a):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(b, a), len(b) - 1)
+    hit = b[pos] == a
+    return np.flatnonzero(hit), pos[hit]
+
+
+def add_sparse(doc_ids, scores, docs, values):
+    """Sum of two sparse vectors given as ascending (doc ids, values) pairs, without a dense copy."""
+    if not len(doc_ids):
+        return docs, values
+    in_docs, in_ids = intersect_sorted(docs, doc_ids)
+    scores[in_ids] += values[in_docs]
+    fresh = np.ones(len(docs), dtype=bool)
+    fresh[in_docs] = False
+    if not fresh.any():
+        return doc_ids, scores
+    # Insertion points of sorted new ids into sorted old ones keep the result sorted
+    positions = np.searchsorted(doc_ids, docs[fresh])
+    return np.insert(doc_ids, positions, docs[fresh]), np.insert(scores, positions, values[fresh])
+
+
+def select_top_k(doc_ids, scores, top_k=None):
+    """Rank ascending doc_ids by score, keeping positive scores only; ties go to the lower doc id."""
+    positive = scores > 0
+    doc_ids, scores = doc_ids[positive], scores[positive]
+    if top_k is not None and top_k < len(scores):
+        if top_k <= 0:
+            return doc_ids[:0], scores[:0]
+        # Keep everything tied with the k-th best so the stable sort settles the boundary
+        kth = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+        keep = scores >= kth
+        doc_ids, scores = doc_ids[keep], scores[keep]
+    order = np.argsort(-scores, kind='stable')[:top_k]
+    return doc_ids[order], scores[order]
+
+
+def rank_scores(scores, top_k=None):
+    """Ranked (doc_ids, scores) from a dense score vector indexed by doc id."""
+    scores = np.asarray(scores, dtype=np.float64)
+    candidates = np.flatnonzero(scores > 0)
+    return select_top_k(candidates, scores[candidates], top_k)
+
+
+def rank(scores, top_k=None):
+    """Doc ids with a positive score, best first; ties go to the lower doc id."""
+    return rank_scores(scores, top_k)[0]
+
+
+def reciprocal_rank_fusion(rankings, k=60, top_k=None):
+    """Fuse ranked doc id arrays by summing 1 / (k + rank) per document; ties go to the lower doc id."""
+    doc_ids = np.concatenate([np.asarray(ranking, dtype=np.int64) for ranking in rankings])
+    weights = np.concatenate([1.0 / (k + np.arange(1, len(ranking) + 1)) for ranking in rankings])
+    fused_ids, positions = np.unique(doc_ids, return_inverse=True)
+    return select_top_k(fused_ids, np.bincount(positions, weights=weights, minlength=len(fused_ids)), top_k)
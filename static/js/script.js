@@ -140,4 +140,40 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Initialize forms with the current method
     updateFormsWithMethod(initialMethod);
-});
\ No newline at end of file
+});
+document.addEventListener('DOMContentLoaded', function() {
+    // Autocomplete: fill the search box's datalist from /api/suggest as the user types
+    document.querySelectorAll('.search-input[data-suggest-url]').forEach(input => {
+        const datalist = document.getElementById(input.getAttribute('list'));
+        let timer = null;
+        let controller = null;
+        
+        input.addEventListener('input', function() {
+            clearTimeout(timer);
+            const text = input.value;
+            if (!text.trim()) {
+                datalist.innerHTML = '';
+                return;
+            }
+            
+            // Wait for a pause in typing, and drop answers to prefixes the user has already moved past
+            timer = setTimeout(() => {
+                if (controller) {
+                    controller.abort();
+                }
+                controller = new AbortController();
+                fetch(`${input.dataset.suggestUrl}?q=${encodeURIComponent(text)}`, {signal: controller.signal})
+                    .then(response => response.json())
+                    .then(data => {
+                        datalist.innerHTML = '';
+                        data.suggestions.forEach(suggestion => {
+                            const option = document.createElement('option');
+                            option.value = suggestion;
+                            datalist.appendChild(option);
+                        });
+                    })
+                    .catch(() => {});
+            }, 120);
+        });
+    });
+});
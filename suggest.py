@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from collections import Counter
+import numpy as np
+from analyzer import PUNCTUATION
+
+# Suggestions returned when no limit is given
+SUGGEST_LIMIT = 10
+
+# Prefix ranges longer than this have their top suggestions memoized (short prefixes of big vocabularies)
+MEMO_RANGE = 4096
+
+ARRAYS = ('blob', 'offsets', 'weights')
+
+
+def surface_words(text, stop_words):
+    """Distinct lowercased words of a text as the analyzer splits them, before stemming, minus stopwords."""
+    return set(PUNCTUATION.sub('', text.lower()).split()) - stop_words
+
+
+def document_frequencies(texts, stop_words):
+    """Number of texts each surface word appears in."""
+    counts = Counter()
+    for text in texts:
+        counts.update(surface_words(text, stop_words))
+    return counts
+
+
+class PrefixIndex:
+    """Weighted words sorted for prefix lookups by binary search.
+
+    Words are stored newline-terminated in one UTF-8 blob with byte
+    offsets, next to an int64 weight each, so a million words cost a few
+    flat arrays that snapshots memory-map. UTF-8 byte order is code point
+    order, so the words matching a prefix are one contiguous range, and the
+    best-weighted of a range are picked with a partial sort.
+    """
+
+    def __init__(self, blob, offsets, weights):
+        self.blob = blob
+        self.offsets = offsets
+        self.weights = weights
+        self._memo = {}
+
+    @classmethod
+    def build(cls, weights):
+        """Index a {word: weight} mapping; words with no positive weight are left out."""
+        words = sorted(word for word, weight in weights.items() if weight > 0)
+        encoded = [word.encode('utf-8') + b'\n' for word in words]
+        offsets = np.zeros(len(words) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(word) for word in encoded])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets,
+                   np.array([weights[word] for word in words], dtype=np.int64))
+
+    @classmethod
+    def load(cls, directory, name, mmap_mode='r'):
+        """Open arrays written by save() under the same name."""
+        return cls(*(np.load(os.path.join(directory, f"suggest_{name}_{array}.npy"), mmap_mode=mmap_mode)
+                     for array in ARRAYS))
+
+    def save(self, directory, name):
+        """Write every array as a suggest_<name>_*.npy file."""
+        for array in ARRAYS:
+            np.save(os.path.join(directory, f"suggest_{name}_{array}.npy"), getattr(self, array))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, array).nbytes for array in ARRAYS)
+
+    def _key(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1] - 1].tobytes()
+
+    def word(self, i):
+        return self._key(i).decode('utf-8')
+
+    def words(self):
+        """Every word, in sorted order."""
+        return bytes(self.blob).decode('utf-8').split('\n')[:-1]
+
+    def as_dict(self):
+        return dict(zip(self.words(), self.weights.tolist()))
+
+    def _lower_bound(self, key):
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def prefix_range(self, prefix):
+        """Positions [lo, hi) of the words starting with prefix."""
+        key = prefix.encode('utf-8')
+        # No UTF-8 sequence contains 0xff, so it sorts after every continuation of the prefix
+        return self._lower_bound(key), self._lower_bound(key + b'\xff')
+
+    def complete(self, prefix, limit=SUGGEST_LIMIT):
+        """Up to limit (word, weight) pairs starting with prefix, heaviest first, ties in word order."""
+        lo, hi = self.prefix_range(prefix)
+        if hi - lo > MEMO_RANGE:
+            memoized = self._memo.get((lo, hi, limit))
+            if memoized is None:
+                memoized = self._memo[(lo, hi, limit)] = self._top(lo, hi, limit)
+            return memoized
+        return self._top(lo, hi, limit)
+
+    def _top(self, lo, hi, limit):
+        weights = np.asarray(self.weights[lo:hi])
+        if limit < len(weights):
+            # Everything tied with the limit-th weight stays, so the stable sort settles ties by word order
+            kth = np.partition(weights, len(weights) - limit)[len(weights) - limit]
+            candidates = np.flatnonzero(weights >= kth)
+        else:
+            candidates = np.arange(len(weights))
+        best = candidates[np.argsort(-weights[candidates], kind='stable')[:limit]]
+        return [(self.word(lo + i), int(weights[i])) for i in best.tolist()]
+
+    def updated(self, deltas):
+        """New index with each word's weight changed by deltas[word]; words left at zero are dropped."""
+        weights = Counter(self.as_dict())
+        weights.update(deltas)
+        return PrefixIndex.build(weights)
+
+
+class QueryLog:
+    """Counts of searched queries, for suggesting popular queries by prefix.
+
+    Lookups go to a PrefixIndex of the counts that is rebuilt at most every
+    `refresh` seconds, so recording stays a dict update and a lookup never
+    scans the log. Beyond max_entries the least searched half is dropped.
+    """
+
+    def __init__(self, max_entries=10000, refresh=60):
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.counts = Counter()
+        self._index = PrefixIndex.build({})
+        self._built = 0.0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def record(self, query):
+        query = ' '.join(query.lower().split())
+        if not query:
+            return
+        with self._lock:
+            self.counts[query] += 1
+            self._dirty = True
+            if len(self.counts) > self.max_entries:
+                self.counts = Counter(dict(self.counts.most_common(self.max_entries // 2)))
+
+    def complete(self, prefix, limit=SUGGEST_LIMIT):
+        """Up to limit (query, count) pairs starting with prefix, most searched first."""
+        if self._dirty and time.monotonic() - self._built >= self.refresh:
+            with self._lock:
+                self._index = PrefixIndex.build(self.counts)
+                self._built = time.monotonic()
+                self._dirty = False
+        return self._index.complete(prefix, limit)
@@ -0,0 +1,121 @@
+import json
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+import numpy as np
+from config import METADATA_FILE
+
+# Corpus sizes the benchmark suite runs at by default
+SCALES = (10_000, 100_000, 1_000_000)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class FieldModel:
+    """Word and length distribution of one text field (alt text or caption) in the real metadata.
+
+    Words are drawn by their observed frequency and texts get lengths drawn
+    from the observed lengths. Words seen only once in the real corpus are
+    the ones a bigger corpus keeps adding, so that share of draws is spent
+    on made-up words from a heavy-tailed pool instead, and the vocabulary
+    keeps growing with the corpus as real vocabularies do.
+    """
+
+    def __init__(self, texts):
+        token_lists = [text.split() for text in texts]
+        counts = Counter(token for tokens in token_lists for token in tokens)
+        self.words = list(counts)
+        frequencies = np.array([counts[word] for word in self.words], dtype=np.float64)
+        self.probabilities = frequencies / frequencies.sum()
+        self.lengths = np.array([len(tokens) for tokens in token_lists if tokens] or [1])
+        self.novel_rate = sum(1 for count in counts.values() if count == 1) / max(frequencies.sum(), 1)
+
+    def sample(self, rng, count):
+        """`count` synthetic texts."""
+        lengths = rng.choice(self.lengths, count)
+        draws = rng.choice(len(self.words), int(lengths.sum()), p=self.probabilities)
+        novel = np.flatnonzero(rng.random(len(draws)) < self.novel_rate)
+        tokens = np.array(self.words, dtype=object)[draws]
+        # A new word is an existing one with a Zipf-distributed suffix, so a few new words recur often
+        tokens[novel] = [f"{word}{alphabetic(suffix)}" for word, suffix in
+                         zip(tokens[novel].tolist(), rng.zipf(1.5, len(novel)).tolist())]
+        ends = np.cumsum(lengths)
+        return [' '.join(tokens[end - length:end]) for end, length in zip(ends.tolist(), lengths.tolist())]
+
+
+def alphabetic(number):
+    """Lowercase letters spelling a positive integer in base 26, so suffixed words stay words."""
+    letters = ''
+    while number:
+        number, digit = divmod(number - 1, 26)
+        letters = chr(ord('a') + digit) + letters
+    return letters
+
+
+def generate(count, metadata=None, seed=0):
+    """metadata.json-shaped dict of `count` synthetic analyzed images.
+
+    Alt texts and captions follow the real fields' word and length
+    distributions; detections, model and timestamps are copied from a random
+    real entry, with the timestamp shifted by up to a year.
+    """
+    if metadata is None:
+        with open(METADATA_FILE, 'r') as f:
+            metadata = json.load(f)
+    templates = [data for data in metadata.values() if data.get('analysis')]
+    rng = np.random.default_rng(seed)
+    picker = random.Random(seed)
+    alt_texts = FieldModel(data['alt_text'] for data in templates).sample(rng, count)
+    captions = FieldModel(data['analysis']['caption'] for data in templates).sample(rng, count)
+    shifts = rng.integers(0, 365 * 24 * 3600, count).tolist()
+
+    corpus = {}
+    for i in range(count):
+        template = picker.choice(templates)
+        filename = f"synthetic_{i:07d}.jpg"
+        timestamp = datetime.strptime(template['timestamp'], TIMESTAMP_FORMAT) - timedelta(seconds=shifts[i])
+        corpus[filename] = {
+            'source_url': f"https://example.invalid/synthetic/{filename}",
+            'timestamp': timestamp.strftime(TIMESTAMP_FORMAT),
+            'alt_text': alt_texts[i],
+            'analyzed': True,
+            'analysis': dict(template['analysis'], caption=captions[i]),
+        }
+    return corpus
+
+
+def write(path, count, metadata=None, seed=0):
+    """Generate a synthetic corpus and write it to path as metadata.json."""
+    corpus = generate(count, metadata, seed)
+    with open(path, 'w') as f:
+        json.dump(corpus, f)
+    return corpus
+
+
+def vocabulary_queries(corpus, count, seed=0):
+    """One to three word queries drawn from the corpus' alt text words, weighted by document frequency."""
+    document_frequency = Counter(word for data in corpus.values() for word in set(data['alt_text'].lower().split()))
+    words = list(document_frequency)
+    weights = [document_frequency[word] for word in words]
+    rng = random.Random(seed)
+    return [' '.join(rng.choices(words, weights, k=rng.randint(1, 3))) for _ in range(count)]
+
+
+def load_queries(path):
+    """Queries from a log: JSON lines with a "query" field, or one plain-text query per line."""
+    queries = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                queries.append(line)
+                continue
+            if isinstance(entry, dict) and entry.get('query'):
+                queries.append(entry['query'])
+            elif isinstance(entry, str):
+                queries.append(entry)
+    return queries
@@ -0,0 +1,119 @@
+"""Local stand-ins for the network and the models, shared by the tests and benchmark.py."""
+import io
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+
+
+def image_bytes(number, size):
+    """Deterministic payload for the stand-in image `number`."""
+    return (number.to_bytes(4, 'big') * (size // 4 + 1))[:size]
+
+
+def serve_images(size, latency, fail_every, payload=None, truncate=()):
+    """Local stand-in image host serving /<anything>/<number>.jpg.
+
+    Every fail_every-th image answers 503 on its first request, images
+    numbered in `truncate` drop the connection halfway through their body,
+    and names that are not numbers answer 404. `server.requests` records
+    (path, time.monotonic()) for every request.
+    """
+    payload = payload or image_bytes
+    failed_once = set()
+    lock = threading.Lock()
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            with lock:
+                requests.append((self.path, time.monotonic()))
+            time.sleep(latency)
+            try:
+                number = int(os.path.splitext(os.path.basename(self.path))[0])
+            except ValueError:
+                self._empty(404)
+                return
+            with lock:
+                fail = fail_every and number % fail_every == 0 and number not in failed_once
+                failed_once.add(number)
+            if fail:
+                self._empty(503)
+                return
+            body = payload(number, size)
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if number in truncate:
+                self.wfile.write(body[:len(body) // 2])
+                self.close_connection = True
+                return
+            self.wfile.write(body)
+
+        def _empty(self, status):
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.requests = requests
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def jpeg_bytes(number, size):
+    """A small JPEG of a colour unique to `number`, so every stand-in image gets its own analysis."""
+    buffer = io.BytesIO()
+    colour = (number * 37 % 256, number * 91 % 256, number * 151 % 256)
+    Image.new('RGB', (size, size), colour).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def scrolling_source(urls, per_scroll, scroll_delay, discovered_at):
+    """Stand-in crawler: per_scroll new images appear after every scroll_delay seconds."""
+    for start in range(0, len(urls), per_scroll):
+        time.sleep(scroll_delay)
+        for url in urls[start:start + per_scroll]:
+            discovered_at[url] = time.monotonic()
+            yield url, f"stand-in alt text {start}"
+
+
+class StandInCaptioner:
+    """Captions from the mean colour, costing a fixed overhead per call plus a per-image time."""
+    name = 'stand-in captioner'
+
+    def __init__(self, call_cost, image_cost):
+        self.call_cost = call_cost
+        self.image_cost = image_cost
+
+    def caption_batch(self, images):
+        time.sleep(self.call_cost + self.image_cost * len(images))
+        captions = []
+        for image in images:
+            red, green, blue = image.resize((1, 1)).getpixel((0, 0))
+            # Every fifth colour gets a generic caption so the detector stage sees traffic
+            captions.append("an image" if (red + green + blue) % 5 == 0 else
+                            f"a picture in shades of {red // 32} {green // 32} {blue // 32}")
+        return captions
+
+
+class StandInDetector:
+    """One box per image, with the same cost model as StandInCaptioner."""
+    name = 'stand-in detector'
+
+    def __init__(self, call_cost, image_cost):
+        self.call_cost = call_cost
+        self.image_cost = image_cost
+
+    def detect_batch(self, images):
+        time.sleep(self.call_cost + self.image_cost * len(images))
+        return [[{'class': 'frame', 'confidence': 0.9, 'bbox': [0.0, 0.0, float(image.width), float(image.height)]}]
+                for image in images]
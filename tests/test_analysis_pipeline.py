@@ -0,0 +1,40 @@
+import pytest
+from analysis_pipeline import AnalysisPipeline
+from stand_ins import StandInCaptioner, StandInDetector, jpeg_bytes
+
+
+@pytest.fixture
+def items(tmp_path):
+    items = []
+    for number in range(1, 21):
+        path = tmp_path / f"{number}.jpg"
+        path.write_bytes(jpeg_bytes(number, 16))
+        items.append((f"{number}.jpg", str(path)))
+    return items
+
+
+def analyze(items, workers, batch_size):
+    pipeline = AnalysisPipeline(StandInCaptioner(0, 0), StandInDetector(0, 0), workers=workers,
+                                batch_size=batch_size, max_in_flight=8)
+    return {key: (analysis, hashes) for key, analysis, hashes in pipeline.run(items)}
+
+
+def test_batched_and_pooled_match_serial(items):
+    serial = analyze(items, 0, 1)
+    assert len(serial) == len(items)
+    # The stand-in captioner sends some images on to the detector
+    assert any(analysis['detections'] for analysis, _ in serial.values())
+    assert analyze(items, 0, 8) == serial
+    assert analyze(items, 2, 8) == serial
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_decode_failure_marks_only_that_image(items, tmp_path, workers):
+    broken = tmp_path / 'broken.jpg'
+    broken.write_bytes(b'not an image')
+    serial = analyze(items, 0, 1)
+    results = analyze(items[:7] + [('broken.jpg', str(broken))] + items[7:], workers, 4)
+
+    analysis, hashes = results.pop('broken.jpg')
+    assert 'error' in analysis and hashes is None
+    assert results == serial
@@ -0,0 +1,79 @@
+import os
+import pytest
+from downloader import ImageDownloader
+from stand_ins import image_bytes, serve_images
+
+SIZE = 4096
+
+
+@pytest.fixture
+def host():
+    server = serve_images(SIZE, 0, 0, truncate={13})
+    yield server
+    server.shutdown()
+
+
+def url(server, name):
+    return f"http://127.0.0.1:{server.server_address[1]}/img/{name}"
+
+
+def part_files(directory):
+    return [name for name in os.listdir(directory) if name.endswith('.part')]
+
+
+def test_transient_503_is_retried(tmp_path):
+    server = serve_images(SIZE, 0, 1)  # every image answers 503 once
+    try:
+        with ImageDownloader(str(tmp_path), backoff=0.01) as downloader:
+            save_path, size, skipped = downloader.download(url(server, '7.jpg'))
+        assert (size, skipped) == (SIZE, False)
+        with open(save_path, 'rb') as f:
+            assert f.read() == image_bytes(7, SIZE)
+        assert len(server.requests) == 2
+        assert downloader.stats()['failed'] == 0
+    finally:
+        server.shutdown()
+
+
+def test_permanent_404_is_not_retried(tmp_path, host):
+    with ImageDownloader(str(tmp_path), retries=3, backoff=0.01) as downloader:
+        assert downloader.download(url(host, 'missing.jpg')) == (None, 0, False)
+    assert len(host.requests) == 1
+    assert downloader.stats()['failed'] == 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_per_host_rate_is_respected(tmp_path, host):
+    rate, count = 20, 8
+    with ImageDownloader(str(tmp_path), workers=4, per_host_rate=rate) as downloader:
+        results = list(downloader.download_all([url(host, f"{number}.jpg") for number in range(1, count + 1)]))
+    assert all(save_path for _, save_path, _, _ in results)
+    times = sorted(moment for _, moment in host.requests)
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    # Slots are 1 / rate apart; allow for scheduling jitter on individual gaps, not on the total
+    assert times[-1] - times[0] >= (count - 1) / rate * 0.95
+    assert min(gaps) >= 1 / rate * 0.5
+
+
+def test_part_files_never_become_final_names(tmp_path, host):
+    urls = [url(host, f"{number}.jpg") for number in (11, 12, 13, 14)]
+    with ImageDownloader(str(tmp_path), workers=4, retries=2, backoff=0.01) as downloader:
+        results = {img_url: save_path for img_url, save_path, _, _ in downloader.download_all(urls)}
+
+    # Image 13 is cut off on every attempt, so it must not appear at all
+    assert results[url(host, '13.jpg')] is None
+    assert sum(path.endswith('/13.jpg') for path, _ in host.requests) == 2
+    assert sorted(os.listdir(tmp_path)) == ['11.jpg', '12.jpg', '14.jpg']
+    for number in (11, 12, 14):
+        with open(os.path.join(tmp_path, f"{number}.jpg"), 'rb') as f:
+            assert f.read() == image_bytes(number, SIZE)
+    assert part_files(tmp_path) == []
+
+
+def test_existing_file_is_returned_as_skipped(tmp_path, host):
+    with ImageDownloader(str(tmp_path)) as downloader:
+        first = downloader.download(url(host, '5.jpg'))
+        second = downloader.download(url(host, '5.jpg'))
+    assert first == (os.path.join(tmp_path, '5.jpg'), SIZE, False)
+    assert second == (os.path.join(tmp_path, '5.jpg'), 0, True)
+    assert len(host.requests) == 1
@@ -0,0 +1,114 @@
+import json
+from functools import lru_cache
+import nltk
+import pytest
+from analysis_pipeline import AnalysisPipeline
+from downloader import ImageDownloader
+from ingest import IngestPipeline
+from irsystem import ImageSearchEngine
+from journal import MetadataJournal
+from stand_ins import StandInCaptioner, StandInDetector, jpeg_bytes, scrolling_source, serve_images
+
+nltk.download('stopwords', quiet=True)
+nltk.download('wordnet', quiet=True)
+
+IMAGES = 30
+
+
+@pytest.fixture(scope='module')
+def host():
+    server = serve_images(16, 0.01, 0, payload=lru_cache(maxsize=None)(jpeg_bytes))
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def urls(host):
+    return [f"http://127.0.0.1:{host.server_address[1]}/img/{number}.jpg" for number in range(1, IMAGES + 1)]
+
+
+@pytest.fixture
+def metadata_file(tmp_path):
+    path = tmp_path / 'metadata.json'
+    path.write_text(json.dumps({'existing.jpg': {
+        'source_url': 'https://example.invalid/existing.jpg',
+        'timestamp': '2024-01-01 00:00:00',
+        'alt_text': 'an existing image',
+        'analyzed': True,
+        'analysis': {'caption': 'an existing image', 'detections': None, 'model': 'fixture'},
+    }}))
+    return str(path)
+
+
+def pipeline_for(tmp_path, metadata_file, engine=None, call_cost=0.0, queue_size=4, **options):
+    downloader = ImageDownloader(str(tmp_path / 'images'), workers=2, backoff=0.01)
+    # Inline decoding: forking next to the pipeline's threads is unsafe
+    analysis = AnalysisPipeline(StandInCaptioner(call_cost, 0), StandInDetector(0, 0), workers=0, batch_size=2)
+    return IngestPipeline(downloader, analysis, metadata_file, engine=engine, discovered_queue=queue_size,
+                          downloaded_queue=queue_size, analyzed_queue=queue_size, batch_timeout=0.05,
+                          index_batch_size=4, index_interval=0.05, **options)
+
+
+def test_every_image_becomes_searchable(tmp_path, metadata_file, urls):
+    engine = ImageSearchEngine(use_snapshot=False, cache_size=0, metadata_file=metadata_file,
+                               index_dir=str(tmp_path / 'index'))
+    publishes = []
+    pipeline = pipeline_for(tmp_path, metadata_file, engine, publish=lambda: publishes.append(engine.total_images),
+                            publish_interval=0.2)
+    with pipeline.downloader:
+        stats = pipeline.run(scrolling_source(urls, 5, 0.05, {}))
+
+    filenames = [url.rsplit('/', 1)[1] for url in urls]
+    assert stats['searchable']['images'] == IMAGES
+    assert all(engine.get_image(filename) for filename in filenames)
+    # Published every interval and once more at the end, with everything indexed by then
+    assert stats['published'] == len(publishes) >= 2
+    assert publishes[-1] == IMAGES + 1
+    metadata = MetadataJournal(metadata_file).load()
+    assert all(metadata[filename]['analyzed'] for filename in filenames)
+
+
+def test_slow_analysis_holds_back_discovery(tmp_path, metadata_file, urls):
+    consumed, analyzed, ahead = [0], [0], []
+
+    def source():
+        for url in urls:
+            ahead.append(consumed[0] - analyzed[0])
+            consumed[0] += 1
+            yield url, 'alt text'
+
+    def progress(stage, filename):
+        if stage == 'analyzed':
+            analyzed[0] += 1
+
+    pipeline = pipeline_for(tmp_path, metadata_file, call_cost=0.03, queue_size=2, progress=progress)
+    with pipeline.downloader:
+        stats = pipeline.run(source())
+
+    assert stats['searchable']['images'] == IMAGES
+    # Both queues, the downloads in progress and one caption batch; more means a queue is unbounded
+    limit = 2 + 2 + pipeline.downloader.workers + pipeline.analysis.batch_size + 2
+    assert max(ahead) <= limit < IMAGES
+
+
+def test_source_error_propagates_after_ingesting_what_was_found(tmp_path, metadata_file, urls):
+    def source():
+        yield from ((url, 'alt text') for url in urls[:5])
+        raise RuntimeError('crawler died')
+
+    pipeline = pipeline_for(tmp_path, metadata_file)
+    with pipeline.downloader, pytest.raises(RuntimeError, match='crawler died'):
+        pipeline.run(source())
+    assert len(pipeline.latencies['searchable']) == 5
+
+
+def test_stage_error_stops_the_run(tmp_path, metadata_file, urls):
+    class BrokenEngine:
+        def add_documents(self, surrogates):
+            raise RuntimeError('index is broken')
+
+    pipeline = pipeline_for(tmp_path, metadata_file, BrokenEngine())
+    with pipeline.downloader, pytest.raises(RuntimeError, match='index is broken'):
+        pipeline.run(scrolling_source(urls, 5, 0.05, {}))
+    # The other stages stopped instead of working through the whole source
+    assert pipeline.counters['discovered'] < IMAGES
@@ -0,0 +1,31 @@
+import json
+from journal import MetadataJournal
+
+
+def test_append_after_torn_line_is_kept(tmp_path):
+    metadata_file = str(tmp_path / 'metadata.json')
+    journal = MetadataJournal(metadata_file)
+    journal.append('a.jpg', {'analyzed': False})
+    # A crash part-way through an append
+    with open(journal.path, 'a') as f:
+        f.write('{"filename":"b.jpg","da')
+
+    resumed = MetadataJournal(metadata_file)
+    resumed.append('c.jpg', {'analyzed': False})
+    resumed.append('d.jpg', {'analyzed': True})
+
+    assert MetadataJournal(metadata_file).load() == {
+        'a.jpg': {'analyzed': False}, 'c.jpg': {'analyzed': False}, 'd.jpg': {'analyzed': True}}
+    resumed.compact()
+    with open(metadata_file) as f:
+        assert sorted(json.load(f)) == ['a.jpg', 'c.jpg', 'd.jpg']
+
+
+def test_records_skip_bad_lines(tmp_path):
+    journal = MetadataJournal(str(tmp_path / 'metadata.json'))
+    with open(journal.path, 'w') as f:
+        f.write('{"filename":"a.jpg","data":{"x":1}}\n'
+                'garbage\n'
+                '{"no_filename":true}\n'
+                '{"filename":"b.jpg","data":{"x":2}}\n')
+    assert list(journal.records()) == [('a.jpg', {'x': 1}), ('b.jpg', {'x': 2})]
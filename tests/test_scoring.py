@@ -0,0 +1,74 @@
+import json
+import nltk
+import pytest
+from irsystem import ImageSearchEngine
+
+nltk.download('stopwords', quiet=True)
+nltk.download('wordnet', quiet=True)
+
+# Small corpus with exact duplicates (tied scores), shared and rare words, and repeated terms
+TEXTS = [
+    ("red car on a street", "a red car parked"),
+    ("red car on a street", "a red car parked"),
+    ("blue car near the sea", "car by the water"),
+    ("dog playing in the park", "a dog running"),
+    ("dog playing in the park", "a dog running"),
+    ("cat sleeping on a sofa", "a cat asleep"),
+    ("red red red balloon", "balloon in the sky"),
+    ("mountain lake at sunset", "sunset over a lake"),
+    ("city street at night", "street lights"),
+    ("dog and cat together", "a dog with a cat"),
+    ("car car car", "a car"),
+    ("zebra", "a zebra"),
+]
+
+QUERIES = ["car", "red car", "dog cat", "street", "car car street", "zebra", "sunset lake mountain",
+           "balloon sky red", "nothingmatchesthis"]
+
+
+@pytest.fixture(scope='module')
+def metadata_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp('corpus') / 'metadata.json'
+    corpus = {f"image_{i:02d}.jpg": {
+        'source_url': f"https://example.invalid/image_{i:02d}.jpg",
+        'timestamp': '2024-01-01 00:00:00',
+        'alt_text': alt_text,
+        'analyzed': True,
+        'analysis': {'caption': caption, 'detections': None, 'model': 'fixture'},
+    } for i, (alt_text, caption) in enumerate(TEXTS)}
+    path.write_text(json.dumps(corpus))
+    return str(path)
+
+
+def engine_for(metadata_file, tmp_path, **options):
+    return ImageSearchEngine(use_snapshot=False, cache_size=0, metadata_file=metadata_file,
+                             index_dir=str(tmp_path / 'index'), **options)
+
+
+def ranking(engine, method, query, top_k, scoring):
+    engine.scoring = scoring
+    search = engine.search_vsm if method == 'vsm' else engine.search_bm25
+    return [(record['filename'], score) for record, score in search(query, top_k=top_k)]
+
+
+@pytest.mark.parametrize('options', [{}, {'shards': 3}, {'compress_postings': True}],
+                         ids=['csr', 'sharded', 'compressed'])
+@pytest.mark.parametrize('method', ['vsm', 'bm25'])
+def test_numpy_rankings_match_python_reference(metadata_file, tmp_path, options, method):
+    reference_engine = engine_for(metadata_file, tmp_path)
+    engine = engine_for(metadata_file, tmp_path, **options)
+    for query in QUERIES:
+        reference = ranking(reference_engine, method, query, None, 'python')
+        # Full ranking, pruned top-k (ties included) and top_k beyond the number of matches
+        assert ranking(engine, method, query, None, 'numpy') == reference, query
+        for top_k in (1, 2, 3, 5, len(reference), len(reference) + 10, 1000):
+            assert ranking(engine, method, query, top_k, 'numpy') == reference[:top_k], (query, top_k)
+            assert ranking(reference_engine, method, query, top_k, 'python') == reference[:top_k], (query, top_k)
+
+
+def test_fixture_has_ties_and_short_result_lists(metadata_file, tmp_path):
+    engine = engine_for(metadata_file, tmp_path)
+    scores = [score for _, score in ranking(engine, 'bm25', 'red car', None, 'python')]
+    assert len(scores) != len(set(scores))
+    assert len(ranking(engine, 'bm25', 'zebra', 1000, 'numpy')) == 1
+    assert ranking(engine, 'vsm', 'nothingmatchesthis', 10, 'numpy') == []
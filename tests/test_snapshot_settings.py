@@ -0,0 +1,36 @@
+import json
+import os
+import subprocess
+import sys
+import nltk
+from config import load_settings
+from irsystem import ImageSearchEngine, engine_options
+
+nltk.download('stopwords', quiet=True)
+nltk.download('wordnet', quiet=True)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_cli_snapshot_is_loaded_by_app_configured_engine(tmp_path, monkeypatch):
+    metadata_file = tmp_path / 'metadata.json'
+    metadata_file.write_text(json.dumps({f"image_{i}.jpg": {
+        'source_url': f"https://example.invalid/image_{i}.jpg",
+        'timestamp': '2024-01-01 00:00:00',
+        'alt_text': alt_text,
+        'analyzed': True,
+        'analysis': {'caption': f"a photo of a {alt_text}", 'detections': None, 'model': 'fixture'},
+    } for i, alt_text in enumerate(['red car', 'brown dog', 'sleeping cat'])}))
+    # Every setting the snapshot check looks at differs from the defaults
+    settings = tmp_path / 'settings.py'
+    settings.write_text(f"METADATA_FILE = {str(metadata_file)!r}\nINDEX_DIR = {str(tmp_path / 'index')!r}\n"
+                        f"EMBEDDING_DTYPE = 'float16'\nCOMPRESS_POSTINGS = True\nINDEX_SHARDS = 2\n")
+    monkeypatch.setenv('VISUAL_VOYAGER_SETTINGS', str(settings))
+
+    subprocess.run([sys.executable, 'irsystem.py'], cwd=ROOT, check=True, capture_output=True)
+
+    engine = ImageSearchEngine(**engine_options(load_settings()))
+    assert engine.loaded_from_snapshot
+    assert [record['filename'] for record, _ in engine.search_bm25('dog')] == ['image_1.jpg']
+    # Sanity check that the settings matter: a default engine rejects this snapshot
+    assert not ImageSearchEngine(metadata_file=str(metadata_file), index_dir=str(tmp_path / 'index')).loaded_from_snapshot
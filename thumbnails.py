@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import tempfile
+from functools import lru_cache
+from multiprocessing import Pool
+from PIL import Image
+from config import Config, METADATA_FILE
+
+# Longest side of each pre-rendered size; images are never upscaled
+THUMBNAIL_SIZES = (160, 320)
+
+# Extension -> (Pillow format, MIME type, save options)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Mode an ordinary open() would give new files here; mkstemp's 0600 would hide thumbnails
+# from a separate static file server or CDN user
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+
+def thumbnail_path(thumb_folder, size, filename, ext):
+    """Where the thumbnail of filename at size is stored for one format."""
+    # The full name, extension included, so foo.jpg and foo.png never share a thumbnail
+    return os.path.join(thumb_folder, str(size), f"{filename}.{ext}")
+
+
+def is_fresh(thumb_path, source_path):
+    """Whether a thumbnail exists and is at least as new as its source image."""
+    try:
+        return os.stat(thumb_path).st_mtime_ns >= os.stat(source_path).st_mtime_ns
+    except OSError:
+        return False
+
+
+def render_thumbnails(source_path, thumb_folder, filename, sizes=THUMBNAIL_SIZES):
+    """Render every size and format of one image, replacing each file atomically."""
+    with Image.open(source_path) as img:
+        image = img.convert('RGB')
+    for size in sizes:
+        thumb = image.copy()
+        thumb.thumbnail((size, size), Image.LANCZOS)
+        for ext, (image_format, _, options) in THUMBNAIL_FORMATS.items():
+            target = thumbnail_path(thumb_folder, size, filename, ext)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Concurrent requests for a missing thumbnail may render it twice, but never serve half a file
+            fd, staging = tempfile.mkstemp(prefix='.thumb-', dir=os.path.dirname(target))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    thumb.save(f, image_format, **options)
+                os.chmod(staging, FILE_MODE)
+                os.replace(staging, target)
+            except BaseException:
+                if os.path.exists(staging):
+                    os.remove(staging)
+                raise
+
+
+def _render(job):
+    source_path, thumb_folder, filename = job
+    try:
+        render_thumbnails(source_path, thumb_folder, filename)
+        return filename, None
+    except Exception as e:
+        return filename, str(e)
+
+
+def build_thumbnails(filenames, image_folder=Config.IMAGE_FOLDER, thumb_folder=Config.THUMBNAIL_FOLDER,
+                     workers=None):
+    """Render missing or stale thumbnails on a process pool. Returns (rendered, failed)."""
+    jobs = []
+    for filename in filenames:
+        source_path = os.path.join(image_folder, filename)
+        if not all(is_fresh(thumbnail_path(thumb_folder, size, filename, ext), source_path)
+                   for size in THUMBNAIL_SIZES for ext in THUMBNAIL_FORMATS):
+            jobs.append((source_path, thumb_folder, filename))
+
+    rendered = failed = 0
+    if jobs:
+        with Pool(workers) as pool:
+            for filename, error in pool.imap_unordered(_render, jobs, chunksize=8):
+                if error:
+                    print(f"⚠️ Failed to render thumbnails for {filename}: {error}")
+                    failed += 1
+                else:
+                    rendered += 1
+    return rendered, failed
+
+
+def file_etag(path):
+    """Strong ETag from the file's contents, recomputed only when its mtime or size changes."""
+    stat = os.stat(path)
+    return _content_etag(path, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=65536)
+def _content_etag(path, mtime_ns, size):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        sha.update(f.read())
+    return sha.hexdigest()[:32]
+
+
+if __name__ == "__main__":
+    with open(METADATA_FILE, 'r') as f:
+        filenames = list(json.load(f))
+
+    print(f"🖼️ Rendering {len(THUMBNAIL_SIZES)} sizes x {len(THUMBNAIL_FORMATS)} formats for {len(filenames)} images")
+    rendered, failed = build_thumbnails(filenames)
+    print(f"✅ Rendered {rendered} images ({len(filenames) - rendered - failed} already up to date, {failed} failed)")
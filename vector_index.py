@@ -0,0 +1,242 @@
+import hashlib
+import os
+import re
+from functools import lru_cache
+import numpy as np
+from scoring import select_top_k
+
+# Dimensions of the offline hashing embedder
+EMBEDDING_DIM = 256
+
+# Rows scored per matrix product; small enough that the float32 copy of a float16/int8 block stays in cache
+SCORE_CHUNK = 4096
+
+# Corpora at least this large get an IVF index when none is asked for explicitly
+IVF_MIN_DOCS = 100_000
+
+# Feature hashes kept in memory; query and caption vocabularies repeat, so this covers the hot set
+FEATURE_HASH_CACHE = 200_000
+
+
+@lru_cache(maxsize=FEATURE_HASH_CACHE)
+def feature_hash(feature):
+    """64-bit hash of a feature string, stable across processes."""
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class HashingEmbedder:
+    """Offline embedder: signed feature hashing of words and character trigrams.
+
+    No model or network access is needed, and texts sharing words or word
+    fragments ("dog", "dogs") land close together. Rows are L2-normalized so
+    a dot product is a cosine similarity.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _bucket(self, feature):
+        value = feature_hash(feature)
+        return value % self.dim, 1.0 if value >> 63 else -1.0
+
+    def features(self, text):
+        """Word and character trigram features of a text, words weighted double."""
+        for word in re.findall(r'\w+', text.lower()):
+            yield f"w:{word}", 2.0
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                yield f"c:{padded[i:i + 3]}", 1.0
+
+    def embed(self, texts):
+        """float32 matrix with one normalized row per text."""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self.features(text):
+                bucket, sign = self._bucket(feature)
+                matrix[row, bucket] += sign * weight
+        return normalize(matrix)
+
+
+class SentenceTransformerEmbedder:
+    """sentence-transformers model, loaded on first use (needs the package and its weights)."""
+
+    def __init__(self, model_name='paraphrase-mpnet-base-v2'):
+        self.name = model_name
+        self._model = None
+
+    def embed(self, texts):
+        """float32 matrix with one normalized row per text."""
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.name)
+        return self._model.encode(list(texts), convert_to_numpy=True,
+                                  normalize_embeddings=True).astype(np.float32)
+
+
+def normalize(matrix):
+    """Rows scaled to unit length; all-zero rows stay zero."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1)
+
+
+def quantize(embeddings, dtype):
+    """Stored rows and per-row scales (None unless int8) for float32 embeddings."""
+    if dtype == 'int8':
+        scales = np.abs(embeddings).max(axis=1) / 127
+        safe = np.where(scales > 0, scales, 1)[:, None]
+        return np.rint(embeddings / safe).astype(np.int8), scales.astype(np.float32)
+    return embeddings.astype(dtype), None
+
+
+def kmeans(vectors, clusters, iterations=10, sample=None, seed=0):
+    """Spherical k-means centroids over (a sample of) normalized vectors."""
+    rng = np.random.default_rng(seed)
+    sample = sample or clusters * 64
+    points = vectors[np.sort(rng.choice(len(vectors), min(sample, len(vectors)), replace=False))]
+    points = np.asarray(points, dtype=np.float32)
+    centroids = points[rng.choice(len(points), clusters, replace=False)]
+    for _ in range(iterations):
+        assignments = np.argmax(points @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, points)
+        # Empty clusters keep their old centroid
+        centroids = np.where(np.bincount(assignments, minlength=clusters)[:, None] > 0, normalize(sums), centroids)
+    return centroids
+
+
+class VectorIndex:
+    """Document embeddings stored as float16, or int8 with a scale per row, indexed by doc id.
+
+    Queries are scored with chunked matrix products against the stored
+    rows, so a batch of queries costs one pass over the matrix. With IVF
+    centroids every document is assigned to its nearest centroid, and a
+    query only scores the documents of its `nprobe` nearest lists.
+    Snapshots memory-map the arrays, so workers share one copy.
+    """
+
+    def __init__(self, vectors, scales=None, centroids=None, assignments=None):
+        self.vectors = vectors
+        self.scales = scales
+        self.centroids = centroids
+        self.assignments = assignments
+        self.dim = vectors.shape[1]
+        if centroids is not None:
+            # Inverted lists: doc ids of list i are list_docs[list_offsets[i]:list_offsets[i + 1]], ascending
+            self.list_docs = np.argsort(assignments, kind='stable')
+            self.list_offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+            self.list_offsets[1:] = np.cumsum(np.bincount(assignments, minlength=len(centroids)))
+
+    @classmethod
+    def build(cls, embeddings, dtype='float16', nlist=None):
+        """Index float32 embeddings; nlist=None adds IVF lists only to large corpora, 0 never does."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if nlist is None:
+            nlist = int(np.sqrt(len(embeddings))) if len(embeddings) >= IVF_MIN_DOCS else 0
+        vectors, scales = quantize(embeddings, dtype)
+        if not nlist:
+            return cls(vectors, scales)
+        centroids = kmeans(embeddings, nlist)
+        return cls(vectors, scales, centroids, assign(embeddings, centroids))
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Open arrays written by save()."""
+        arrays = {}
+        for name in ('vectors', 'scales', 'centroids', 'assignments'):
+            path = os.path.join(directory, f"embedding_{name}.npy")
+            arrays[name] = np.load(path, mmap_mode=mmap_mode) if os.path.exists(path) else None
+        return cls(**arrays)
+
+    def save(self, directory):
+        """Write the matrix, and the scales and IVF arrays if present, as .npy files."""
+        for name in ('vectors', 'scales', 'centroids', 'assignments'):
+            array = getattr(self, name)
+            if array is not None:
+                np.save(os.path.join(directory, f"embedding_{name}.npy"), array)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def dtype(self):
+        return self.vectors.dtype.name
+
+    def rows(self, doc_ids=None):
+        """Dequantized float32 rows, all of them or the given doc ids."""
+        block = self.vectors if doc_ids is None else self.vectors[doc_ids]
+        block = np.asarray(block, dtype=np.float32)
+        if self.scales is not None:
+            block *= (self.scales if doc_ids is None else self.scales[doc_ids])[:, None]
+        return block
+
+    def scores(self, queries):
+        """Similarity of every document to each query row, shape (queries, documents)."""
+        queries = np.asarray(queries, dtype=np.float32)
+        scores = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), SCORE_CHUNK):
+            end = min(start + SCORE_CHUNK, len(self))
+            block = np.asarray(self.vectors[start:end], dtype=np.float32)
+            scores[:, start:end] = queries @ block.T
+            if self.scales is not None:
+                scores[:, start:end] *= self.scales[start:end]
+        return scores
+
+    def candidates(self, query, nprobe):
+        """Ascending doc ids in the nprobe lists whose centroids are nearest the query."""
+        lists = np.argsort(-(self.centroids @ query), kind='stable')[:nprobe]
+        return np.sort(np.concatenate([self.list_docs[self.list_offsets[i]:self.list_offsets[i + 1]]
+                                       for i in lists.tolist()]))
+
+    def search(self, query, top_k=None, nprobe=None, doc_ids=None):
+        """Ranked (doc_ids, scores) of documents with positive similarity; approximate when nprobe is given.
+
+        Given ascending doc_ids, only those rows are read and scored.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if doc_ids is not None:
+            doc_ids = np.asarray(doc_ids, dtype=np.int64)
+            if nprobe is not None and self.centroids is not None:
+                doc_ids = np.intersect1d(self.candidates(query, nprobe), doc_ids, assume_unique=True)
+            # Scaled after the product, as scores() does
+            scores = query[None, :] @ np.asarray(self.vectors[doc_ids], dtype=np.float32).T
+            if self.scales is not None:
+                scores *= self.scales[doc_ids]
+            return select_top_k(doc_ids, scores[0].astype(np.float64), top_k)
+        if nprobe is None or self.centroids is None:
+            scores = self.scores(query[None, :])[0].astype(np.float64)
+            return select_top_k(np.arange(len(self)), scores, top_k)
+        doc_ids = self.candidates(query, nprobe)
+        return select_top_k(doc_ids, (self.rows(doc_ids) @ query).astype(np.float64), top_k)
+
+    def search_batch(self, queries, top_k):
+        """Exact ranked (doc_ids, scores) for each query row, scored in one pass over the matrix."""
+        doc_ids = np.arange(len(self))
+        return [select_top_k(doc_ids, scores.astype(np.float64), top_k) for scores in self.scores(queries)]
+
+    def take(self, doc_ids):
+        """New index holding the given documents, in the given order; IVF centroids are kept."""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        return VectorIndex(np.asarray(self.vectors)[doc_ids],
+                           None if self.scales is None else np.asarray(self.scales)[doc_ids],
+                           self.centroids,
+                           None if self.assignments is None else np.asarray(self.assignments)[doc_ids])
+
+    def extend(self, embeddings):
+        """New index with float32 embeddings appended, quantized and assigned like the rest."""
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        vectors, scales = quantize(embeddings, self.dtype)
+        return VectorIndex(np.concatenate([self.vectors, vectors]),
+                           None if self.scales is None else np.concatenate([self.scales, scales]),
+                           self.centroids,
+                           None if self.assignments is None else
+                           np.concatenate([self.assignments, assign(embeddings, self.centroids)]))
+
+
+def assign(embeddings, centroids):
+    """Nearest centroid of each embedding, computed in chunks."""
+    assignments = np.empty(len(embeddings), dtype=np.int32)
+    for start in range(0, len(embeddings), SCORE_CHUNK):
+        block = np.asarray(embeddings[start:start + SCORE_CHUNK], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments